@@ -0,0 +1,169 @@
+"""Spatial-index and statistics health check for the input tables.
+
+The counting query only stays fast when the schools geometry column has a
+GiST index, the planner's statistics are current and, for large tables, the
+rows are stored in index order.  ``inspect_table`` reads the catalog and the
+statistics views and turns what it finds into recommendations; applying one
+runs its statement, and comparing the counting query's plan before and after
+shows what it changed.
+"""
+from psycopg2 import sql
+
+from .analysis import count_query, resolve_mapping
+from .database import metadata_cache
+
+# Modified rows, as a share of the live rows, after which statistics count as stale
+STALE_STATISTICS_RATIO = 0.1
+# Smaller tables fit in a few pages; clustering them changes nothing
+CLUSTER_MIN_ROWS = 10000
+
+HEALTH_QUERY = """
+    SELECT c.reltuples::bigint, s.n_live_tup, s.n_mod_since_analyze,
+           GREATEST(s.last_analyze, s.last_autoanalyze),
+           (SELECT ic.relname::text FROM pg_index i
+              JOIN pg_class ic ON ic.oid = i.indexrelid
+              JOIN pg_am am ON am.oid = ic.relam
+              JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+             WHERE i.indrelid = c.oid AND am.amname = 'gist' AND a.attname = %s
+             ORDER BY i.indisclustered DESC LIMIT 1),
+           EXISTS (SELECT 1 FROM pg_index i WHERE i.indrelid = c.oid AND i.indisclustered)
+    FROM pg_class c
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE c.oid = to_regclass(%s)
+"""
+
+
+class Recommendation:
+    """One finding about a table, with the statement that fixes it (None for warnings)."""
+
+    def __init__(self, table, kind, reason, statement=None):
+        self.table = table
+        self.kind = kind
+        self.reason = reason
+        self.statement = statement
+
+    def __repr__(self):
+        return f"Recommendation({self.table!r}, {self.kind!r})"
+
+
+class TableHealth:
+    """Catalog and statistics facts about one input table."""
+
+    def __init__(self, table, geometry_column, srid, estimated_rows, live_rows, modified_rows, last_analyzed,
+                 gist_index, clustered):
+        self.table = table
+        self.geometry_column = geometry_column
+        self.srid = srid
+        self.estimated_rows = estimated_rows
+        self.live_rows = live_rows
+        self.modified_rows = modified_rows
+        self.last_analyzed = last_analyzed
+        self.gist_index = gist_index
+        self.clustered = clustered
+
+    def recommendations(self):
+        """What should be done to this table, in the order it should be done."""
+        target = sql.Identifier("public", self.table)
+        index_name = self.gist_index or f"{self.table}_{self.geometry_column}_gist"
+        found = []
+        if not self.srid:
+            found.append(Recommendation(
+                self.table, "srid",
+                f"{self.table}.{self.geometry_column} has no SRID; the analysis has to wrap it in ST_SetSRID, "
+                "which keeps the planner from using a spatial index on it. Set the SRID with UpdateGeometrySRID."
+            ))
+        if self.gist_index is None:
+            found.append(Recommendation(
+                self.table, "index", f"{self.table}.{self.geometry_column} has no GiST index.",
+                sql.SQL("CREATE INDEX {} ON {} USING gist ({})").format(
+                    sql.Identifier(index_name), target, sql.Identifier(self.geometry_column))
+            ))
+        if not self.clustered and (self.live_rows or self.estimated_rows or 0) >= CLUSTER_MIN_ROWS:
+            found.append(Recommendation(
+                self.table, "cluster",
+                f"{self.table} is not stored in spatial order; CLUSTER on the GiST index groups nearby rows "
+                "on the same pages (takes an exclusive lock while it runs).",
+                sql.SQL("CLUSTER {} USING {}").format(target, sql.Identifier(index_name))
+            ))
+        live = self.live_rows or 0
+        stale = self.modified_rows is not None and self.modified_rows > live * STALE_STATISTICS_RATIO
+        if self.last_analyzed is None or stale or found:
+            if self.last_analyzed is None:
+                reason = f"{self.table} has never been analyzed."
+            elif stale:
+                reason = f"{self.modified_rows} of {live} rows of {self.table} changed since the last ANALYZE."
+            else:
+                reason = f"Statistics of {self.table} should be refreshed after the changes above."
+            found.append(Recommendation(self.table, "analyze", reason, sql.SQL("ANALYZE {}").format(target)))
+        return found
+
+
+def inspect_table(cursor, table):
+    """Gather the ``TableHealth`` of ``table`` in the ``public`` schema."""
+    geometry_column, srid = metadata_cache.geometry(cursor, table)
+    cursor.execute(HEALTH_QUERY, [geometry_column, f'"public"."{table}"'])
+    row = cursor.fetchone()
+    if row is None:
+        raise ValueError(f"Table {table} does not exist")
+    estimated_rows, live_rows, modified_rows, last_analyzed, gist_index, clustered = row
+    return TableHealth(table, geometry_column, srid, max(estimated_rows, 0), live_rows, modified_rows,
+                       last_analyzed, gist_index, clustered)
+
+
+def plan_nodes(plan):
+    """Every node of an ``EXPLAIN (FORMAT JSON)`` plan, depth first."""
+    if isinstance(plan, list):
+        plan = plan[0]
+    pending = [plan.get("Plan", plan)]
+    nodes = []
+    while pending:
+        node = pending.pop()
+        nodes.append(node)
+        pending.extend(reversed(node.get("Plans", [])))
+    return nodes
+
+
+def summarize_plan(plan):
+    """Cost, timing and scan types of a JSON plan, as a dict."""
+    top = plan[0] if isinstance(plan, list) else plan
+    nodes = plan_nodes(plan)
+    return {
+        "total_cost": top["Plan"]["Total Cost"],
+        "execution_ms": top.get("Execution Time"),
+        "node_types": [node["Node Type"] for node in nodes],
+        "index_scans": sorted({node["Index Name"] for node in nodes if "Index Name" in node}),
+        "seq_scans": sorted({node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"}),
+    }
+
+
+def explain_count(cursor, job, analyze=True):
+    """JSON plan of the counting query of ``job``; with ``analyze`` the query is also run."""
+    query, params = count_query(job, resolve_mapping(cursor, job))
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    cursor.execute(sql.SQL(f"EXPLAIN ({options}) ") + query, params)
+    return cursor.fetchone()[0]
+
+
+def format_comparison(before, after):
+    """Human readable before/after comparison of two plan summaries."""
+    lines = []
+    for label, summary in (("Before", before), ("After", after)):
+        timing = f", {summary['execution_ms']:.1f} ms" if summary["execution_ms"] is not None else ""
+        indexes = ", ".join(summary["index_scans"]) or "none"
+        sequential = ", ".join(summary["seq_scans"]) or "none"
+        lines.append(f"{label}: cost {summary['total_cost']:.0f}{timing}; "
+                     f"index scans: {indexes}; sequential scans: {sequential}")
+    return "\n".join(lines)
+
+
+def apply_recommendations(connection, recommendations):
+    """Run the statements of ``recommendations`` and commit; returns how many ran."""
+    cursor = connection.cursor()
+    applied = 0
+    for recommendation in recommendations:
+        if recommendation.statement is not None:
+            cursor.execute(recommendation.statement)
+            applied += 1
+    connection.commit()
+    cursor.close()
+    return applied
@@ -0,0 +1,101 @@
+"""Roll finest-level results up to parent administrative levels.
+
+Schools are counted once per area of the finest level (e.g. adm3).  Parent
+levels (adm2, adm1, ...) are then derived with vectorised group-by sums over
+a child-to-parent id mapping, so no level needs its own spatial count.
+Expected schools are recomputed from the summed population rather than
+summed, and the sum of the children's shortfalls is reported next to the
+parent's own shortfall because surpluses in one child offset gaps in another.
+"""
+import numpy as np
+from PyQt5.QtCore import QVariant
+from qgis.core import QgsGeometry, QgsSettings
+from psycopg2 import sql
+
+from .analysis import area_filters, area_key_sql, resolve_mapping
+from .output_sinks import RESULT_FIELDS
+
+SETTING_ROLLUP_COLUMNS = "needed_schools/rollup_columns"
+SUMMED_SHORTFALL_FIELD = "Sum_of_area_shortfalls"
+CHILD_COUNT_FIELD = "Child_Areas"
+
+LEVEL_FIELDS = RESULT_FIELDS + [(SUMMED_SHORTFALL_FIELD, QVariant.Int), (CHILD_COUNT_FIELD, QVariant.Int)]
+
+
+def rollup_columns_from_settings():
+    """Parent id columns configured as a comma separated list, finest parent first."""
+    value = QgsSettings().value(SETTING_ROLLUP_COLUMNS, "", type=str)
+    return [column.strip() for column in value.split(",") if column.strip()]
+
+
+def fetch_parent_ids(cursor, job, columns):
+    """Map every area key of ``job`` to its parent ids, one attribute-only query for all levels."""
+    mapping = resolve_mapping(cursor, job)
+    where, params = area_filters(job.copy(tile=None), None)
+    cursor.execute(sql.SQL("SELECT {key}, {parents} FROM {population_layer} p").format(
+        key=area_key_sql(mapping),
+        parents=sql.SQL(", ").join(sql.Identifier("p", column) for column in columns),
+        population_layer=sql.Identifier(job.population_table)
+    ) + where, params)
+    return {str(row[0]): row[1:] for row in cursor.fetchall()}
+
+
+def roll_up(parent_ids, population, existing, child_shortfall, students_per_school):
+    """Group-by sums of one level.
+
+    All inputs are equal-length sequences over the child areas.  Returns a
+    dict of arrays over the distinct parents: ``ids``, ``population``,
+    ``expected``, ``existing``, ``shortfall``, ``summed_shortfall``,
+    ``children`` and the per-child parent position ``inverse``.
+    """
+    ids, inverse = np.unique(np.asarray(parent_ids, dtype=object).astype(str), return_inverse=True)
+    count = len(ids)
+    population_sum = np.bincount(inverse, weights=np.asarray(population, dtype=np.float64), minlength=count)
+    existing_sum = np.bincount(inverse, weights=np.asarray(existing, dtype=np.float64), minlength=count)
+    summed_shortfall = np.bincount(inverse, weights=np.asarray(child_shortfall, dtype=np.float64), minlength=count)
+    expected = np.rint(population_sum / students_per_school)
+    return {
+        "ids": ids,
+        "population": population_sum,
+        "expected": expected.astype(np.int64),
+        "existing": existing_sum.astype(np.int64),
+        "shortfall": np.maximum(0, expected - existing_sum).astype(np.int64),
+        "summed_shortfall": summed_shortfall.astype(np.int64),
+        "children": np.bincount(inverse, minlength=count),
+        "inverse": inverse,
+    }
+
+
+def write_levels(table, parent_ids, level_names, students_per_school, sink_factory):
+    """Write one output per parent level from the finest level's ``ResultTable``.
+
+    ``parent_ids`` maps area id to a tuple of parent ids (as returned by
+    ``fetch_parent_ids``); ``sink_factory(fields, layer_name)`` creates each
+    level's sink.  Returns the closed sinks.
+    """
+    area_ids = table.area_ids.tolist()
+    missing = [area_id for area_id in area_ids if area_id not in parent_ids]
+    if missing:
+        raise ValueError(f"No parent ids for {len(missing)} area(s), e.g. {missing[0]}")
+
+    sinks = []
+    for level, level_name in enumerate(level_names):
+        ids = [parent_ids[area_id][level] for area_id in area_ids]
+        totals = roll_up(ids, table.population, table.existing, table.shortfall, students_per_school)
+        members = [[] for _ in range(len(totals["ids"]))]
+        for child, parent in enumerate(totals["inverse"]):
+            members[parent].append(table.geometry(child))
+
+        sink = sink_factory(LEVEL_FIELDS, f"Needed Schools - {level_name}")
+        for parent, parent_id in enumerate(totals["ids"]):
+            geometry = QgsGeometry.unaryUnion(members[parent])
+            label_point = geometry.pointOnSurface().asPoint()
+            sink.add([
+                str(parent_id), str(parent_id), float(totals["population"][parent]),
+                int(totals["expected"][parent]), int(totals["existing"][parent]),
+                int(totals["shortfall"][parent]), label_point.x(), label_point.y(),
+                int(totals["summed_shortfall"][parent]), int(totals["children"][parent]),
+            ], geometry)
+        sink.close()
+        sinks.append(sink)
+    return sinks
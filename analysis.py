@@ -0,0 +1,217 @@
+"""Core needed-schools computation shared by the dialog and batch runs."""
+from qgis.core import Qgis
+from psycopg2 import sql
+
+from .database import metadata_cache
+from .instrumentation import log_message
+from .results import ResultTable
+
+OUTPUT_SRID = 4326
+DEFAULT_LABEL_COLUMN = "adm3_en"
+
+
+class AnalysisJob:
+    """One needed-schools computation over a population table and a schools table."""
+
+    def __init__(self, population_table, schools_table, population_field, students_per_school,
+                 partition_column=None, region=None, name=None, label_column=None, id_column=None,
+                 tile=None, categories=None):
+        self.population_table = population_table
+        self.schools_table = schools_table
+        self.population_field = population_field
+        self.students_per_school = int(students_per_school)
+        self.partition_column = partition_column
+        self.region = region
+        self.name = name or (population_table if region is None else f"{population_table} {region}")
+        self.label_column = label_column
+        self.id_column = id_column
+        # (xmin, ymin, xmax, ymax) in EPSG:4326; areas whose label point falls inside belong to the tile
+        self.tile = tile
+        # Optional CategoryBreakdown of the school counts
+        self.categories = categories
+
+    def copy(self, **changes):
+        """Return a copy of the job with some attributes replaced."""
+        values = dict(self.__dict__)
+        values.update(changes)
+        return AnalysisJob(**values)
+
+    def __repr__(self):
+        return f"AnalysisJob({self.name!r})"
+
+
+class ColumnMapping:
+    """Which columns of the input tables the analysis reads."""
+
+    def __init__(self, id_column, label_column, population_column, geometry_column, srid,
+                 schools_geometry_column, schools_srid):
+        self.id_column = id_column
+        self.label_column = label_column
+        self.population_column = population_column
+        self.geometry_column = geometry_column
+        self.srid = srid
+        self.schools_geometry_column = schools_geometry_column
+        self.schools_srid = schools_srid
+
+
+def resolve_mapping(cursor, job):
+    """Work out the column mapping of ``job`` from its settings and the catalog.
+
+    The id column defaults to the table's primary key and the label column to
+    ``adm3_en`` when it exists; geometry columns and SRIDs come from
+    ``geometry_columns``.
+    """
+    table = job.population_table
+    columns = metadata_cache.columns(cursor, table)
+    geometry_column, srid = metadata_cache.geometry(cursor, table)
+    schools_geometry_column, schools_srid = metadata_cache.geometry(cursor, job.schools_table)
+
+    id_column = job.id_column or metadata_cache.primary_key(cursor, table)
+    if id_column is None:
+        log_message(f"Table {table} has no single-column primary key; areas are keyed by row position.",
+                    Qgis.Warning)
+    label_column = job.label_column
+    if label_column is None and DEFAULT_LABEL_COLUMN in columns:
+        label_column = DEFAULT_LABEL_COLUMN
+
+    for column in (id_column, label_column, job.population_field):
+        if column is not None and column not in columns:
+            raise ValueError(f"Column {column} does not exist in {table}")
+    if job.categories is not None:
+        schools_columns = metadata_cache.columns(cursor, job.schools_table)
+        for column in (job.categories.column, job.categories.capacity_column):
+            if column is not None and column not in schools_columns:
+                raise ValueError(f"Column {column} does not exist in {job.schools_table}")
+
+    return ColumnMapping(id_column, label_column, job.population_field, geometry_column, srid,
+                         schools_geometry_column, schools_srid)
+
+
+def geometry_sql(alias, column, srid, target_srid, sql=sql):
+    """Expression for ``alias.column`` in ``target_srid``; SRID 0 is taken as EPSG:4326.
+
+    The query builders take the ``sql`` composition module as a parameter so
+    the psycopg 3 data-access path can reuse them.
+    """
+    expression = sql.Identifier(alias, column)
+    if not srid:
+        expression = sql.SQL("ST_SetSRID({}, {})").format(expression, sql.Literal(OUTPUT_SRID))
+        srid = OUTPUT_SRID
+    if srid != target_srid:
+        expression = sql.SQL("ST_Transform({}, {})").format(expression, sql.Literal(target_srid))
+    return expression
+
+
+def area_key_sql(mapping, sql=sql):
+    """Expression for the id of area ``p`` that results are keyed by."""
+    # Without a primary key the physical row id keeps areas apart for one run
+    return sql.Identifier("p", mapping.id_column or "ctid")
+
+
+def area_filters(job, label_point, sql=sql):
+    """WHERE clause restricting areas to the job's partition and tile."""
+    conditions = []
+    params = []
+    if job.partition_column is not None:
+        conditions.append(sql.SQL("{} = %s").format(sql.Identifier("p", job.partition_column)))
+        params.append(job.region)
+    if job.tile is not None:
+        # Half-open bounds so an area on a tile edge is counted exactly once
+        conditions.append(sql.SQL(
+            "ST_X({point}) >= %s AND ST_X({point}) < %s AND ST_Y({point}) >= %s AND ST_Y({point}) < %s"
+        ).format(point=label_point))
+        xmin, ymin, xmax, ymax = job.tile
+        params += [xmin, xmax, ymin, ymax]
+    if not conditions:
+        return sql.SQL(""), []
+    return sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions), params
+
+
+def population_query(job, mapping, sql=sql):
+    """Build the query that fetches key, label, population, label point and WKB geometry of every area."""
+    where, params = area_filters(job, sql.SQL("g.label_point"), sql)
+    label = sql.Identifier("p", mapping.label_column) if mapping.label_column else sql.SQL("NULL")
+    query = sql.SQL("""
+        SELECT {key}, {label}, {population}, ST_X(g.label_point), ST_Y(g.label_point), ST_AsBinary(g.geom)
+        FROM {population_layer} p
+        CROSS JOIN LATERAL (
+            SELECT t.geom, ST_PointOnSurface(t.geom) AS label_point FROM (SELECT {geom} AS geom) t
+        ) g
+    """).format(
+        key=area_key_sql(mapping, sql),
+        label=label,
+        population=sql.Identifier("p", mapping.population_column),
+        geom=geometry_sql("p", mapping.geometry_column, mapping.srid, OUTPUT_SRID, sql),
+        population_layer=sql.Identifier(job.population_table)
+    ) + where
+    return query, params
+
+
+def count_query(job, mapping, sql=sql):
+    """Build the query that counts the schools inside every area, keyed by area id.
+
+    Areas are transformed into the schools' SRID so a spatial index on the
+    schools geometry column stays usable.  With a category breakdown the
+    filtered counts follow the total in the same scan.
+    """
+    where, params = area_filters(job, sql.SQL("g.label_point"), sql)
+    aggregates = [sql.SQL("COUNT(*)")]
+    if job.categories is not None:
+        expressions, category_params = job.categories.count_sql("s", sql)
+        aggregates += expressions
+        params = category_params + params
+    schools_srid = mapping.schools_srid or OUTPUT_SRID
+    label_point = sql.SQL("")
+    if job.tile is not None:
+        label_point = sql.SQL("CROSS JOIN LATERAL (SELECT ST_PointOnSurface({}) AS label_point) g").format(
+            geometry_sql("p", mapping.geometry_column, mapping.srid, OUTPUT_SRID, sql)
+        )
+    query = sql.SQL("""
+        SELECT {key}, {aggregates} FROM {population_layer} p
+        {label_point}
+        JOIN {schools_layer} s ON ST_Within({school_geom}, {area_geom})
+    """).format(
+        label_point=label_point,
+        key=area_key_sql(mapping, sql),
+        aggregates=sql.SQL(", ").join(aggregates),
+        population_layer=sql.Identifier(job.population_table),
+        schools_layer=sql.Identifier(job.schools_table),
+        school_geom=geometry_sql("s", mapping.schools_geometry_column, mapping.schools_srid, schools_srid, sql),
+        area_geom=geometry_sql("p", mapping.geometry_column, mapping.srid, schools_srid, sql)
+    ) + where + sql.SQL(" GROUP BY 1")
+    return query, params
+
+
+def compute_needed_schools(cursor, job, trace):
+    """Compute the ``ResultTable`` of every area of ``job``."""
+    with trace.span("resolve columns"):
+        mapping = resolve_mapping(cursor, job)
+
+    with trace.span("fetch population"):
+        query, params = population_query(job, mapping)
+        cursor.execute(query, params)
+        city_features = cursor.fetchall()
+
+    counting, params = count_query(job, mapping)
+    trace.explain_query(cursor, "count schools", counting, params)
+    with trace.span("count schools"):
+        cursor.execute(counting, params)
+        school_counts, category_counts = split_counts(cursor.fetchall())
+
+    return build_table(job, city_features, school_counts, trace, category_counts)
+
+
+def split_counts(rows):
+    """``({key: count}, {key: category aggregates})`` from the rows of ``count_query``."""
+    return {row[0]: row[1] for row in rows}, {row[0]: row[2:] for row in rows if len(row) > 2}
+
+
+def build_table(job, city_features, school_counts, trace, category_counts=None):
+    """Merge fetched areas with their school counts into a ``ResultTable``."""
+    with trace.span("build results"):
+        table = ResultTable.from_areas(city_features, school_counts, job.students_per_school)
+        if job.categories is not None:
+            keys = [row[0] for row in city_features]
+            table = table.with_columns(job.categories.columns(keys, category_counts or {}, table.population,
+                                                              job.students_per_school))
+        return table
@@ -0,0 +1,210 @@
+"""Asynchronous, pipelined data access built on psycopg 3.
+
+psycopg2 waits for every statement's result before sending the next one, so
+each catalog lookup and counting query costs a full network round trip.
+``AsyncDatabase`` runs an asyncio event loop on its own worker thread and
+sends batches of statements in libpq pipeline mode, which hides most of that
+latency when the database server is remote.  psycopg 3 is optional; callers
+check ``available()`` and fall back to the synchronous psycopg2 path.
+"""
+import asyncio
+import threading
+
+try:
+    import psycopg
+    from psycopg import sql as psycopg_sql
+except ImportError:
+    psycopg = None
+    psycopg_sql = None
+
+from .analysis import build_table, count_query, population_query, resolve_mapping, split_counts
+from .database import DATABASE_SETTINGS, metadata_cache
+
+CATALOG_TABLES = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"
+CATALOG_COLUMNS = (
+    "SELECT table_name, column_name FROM information_schema.columns "
+    "WHERE table_schema = 'public' AND (%(tables)s::text[] IS NULL OR table_name = ANY(%(tables)s)) "
+    "ORDER BY table_name, ordinal_position"
+)
+CATALOG_GEOMETRIES = (
+    "SELECT f_table_name, f_geometry_column, srid FROM geometry_columns "
+    "WHERE f_table_schema = 'public' AND (%(tables)s::text[] IS NULL OR f_table_name = ANY(%(tables)s)) "
+    "ORDER BY f_table_name, f_geometry_column"
+)
+CATALOG_KEYS = (
+    "SELECT c.relname, array_agg(a.attname::text) FROM pg_index i "
+    "JOIN pg_class c ON c.oid = i.indrelid "
+    "JOIN pg_namespace n ON n.oid = c.relnamespace "
+    "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+    "WHERE i.indisprimary AND n.nspname = 'public' "
+    "AND (%(tables)s::text[] IS NULL OR c.relname = ANY(%(tables)s)) "
+    "GROUP BY c.relname"
+)
+
+
+def available():
+    """True when psycopg 3 is installed."""
+    return psycopg is not None
+
+
+def conninfo():
+    """libpq connection string for the analysis database."""
+    settings = dict(DATABASE_SETTINGS)
+    settings["dbname"] = settings.pop("database")
+    return psycopg.conninfo.make_conninfo(**settings)
+
+
+class AsyncDatabase:
+    """Owns an event loop thread and one psycopg 3 async connection."""
+
+    def __init__(self):
+        if psycopg is None:
+            raise ImportError("The pipelined database path needs psycopg 3 (pip install psycopg).")
+        # psycopg's async connections need a selector loop, also on Windows
+        self.loop = asyncio.SelectorEventLoop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="needed-schools-db", daemon=True)
+        self.thread.start()
+        self._connection = None
+        self._lock = None
+
+    def submit(self, coroutine):
+        """Schedule ``coroutine`` on the loop thread; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """Run ``coroutine`` on the loop thread and wait for its result."""
+        return self.submit(coroutine).result(timeout)
+
+    async def _get_connection(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._connection is None or self._connection.closed:
+            self._connection = await psycopg.AsyncConnection.connect(conninfo(), autocommit=True)
+        return self._connection
+
+    async def pipeline(self, queries):
+        """Send every ``(query, params)`` in one pipeline and return all result rows, in order."""
+        connection = await self._get_connection()
+        async with self._lock:
+            async with connection.pipeline():
+                cursors = []
+                for query, params in queries:
+                    cursor = connection.cursor()
+                    await cursor.execute(query, params)
+                    cursors.append(cursor)
+                return [await cursor.fetchall() for cursor in cursors]
+
+    async def pipeline_groups(self, groups):
+        """Send lists of ``(query, params)`` in one pipeline, synced after every list.
+
+        Returns one entry per group: its result rows in order, or the error
+        that failed it.  A failing statement only aborts the pipeline up to
+        its group's sync point, so later groups still run.
+        """
+        connection = await self._get_connection()
+        outcomes = []
+        async with self._lock:
+            async with connection.pipeline() as pipeline:
+                for queries in groups:
+                    try:
+                        cursors = []
+                        for query, params in queries:
+                            cursor = connection.cursor()
+                            await cursor.execute(query, params)
+                            cursors.append(cursor)
+                        await pipeline.sync()
+                        outcomes.append([await cursor.fetchall() for cursor in cursors])
+                    except psycopg.Error as error:
+                        outcomes.append(error)
+                        # Leave the aborted state if the error came before this group's sync
+                        try:
+                            await pipeline.sync()
+                        except psycopg.Error:
+                            pass
+        return outcomes
+
+    async def load_catalog(self, tables=None):
+        """Fetch the table list, columns, geometry columns and primary keys together.
+
+        With ``tables`` only those tables' details are fetched.  The rows are
+        stored in the shared metadata cache.
+        """
+        params = {"tables": list(tables) if tables is not None else None}
+        table_rows, column_rows, geometry_rows, key_rows = await self.pipeline([
+            (CATALOG_TABLES, None),
+            (CATALOG_COLUMNS, params),
+            (CATALOG_GEOMETRIES, params),
+            (CATALOG_KEYS, params),
+        ])
+        names = [row[0] for row in table_rows]
+        columns = {}
+        for table, column in column_rows:
+            columns.setdefault(table, []).append(column)
+        wanted = list(tables) if tables is not None else names
+        geometries = {table: None for table in wanted}
+        for table, column, srid in geometry_rows:
+            if geometries.get(table) is None:
+                geometries[table] = (column, srid)
+        for table in wanted:
+            columns.setdefault(table, [])
+        keys = {table: None for table in wanted}
+        for table, key_columns in key_rows:
+            keys[table] = key_columns[0] if len(key_columns) == 1 else None
+        metadata_cache.prime(names, columns, geometries, keys)
+        return names
+
+    async def compute_jobs(self, jobs, trace):
+        """Compute several jobs with their data queries in one pipeline, synced after every job.
+
+        Returns ``(job, table, error)`` tuples in job order; ``table`` is None
+        for failed jobs, and one job's failing query does not fail the others.
+        """
+        tables = sorted({table for job in jobs for table in (job.population_table, job.schools_table)})
+        with trace.span("catalog"):
+            if not metadata_cache.is_loaded(tables):
+                await self.load_catalog(tables)
+
+        planned = []
+        outcomes = {}
+        known_tables = metadata_cache.tables(None)
+        for job in jobs:
+            missing = [table for table in (job.population_table, job.schools_table) if table not in known_tables]
+            if missing:
+                outcomes[id(job)] = (job, None, ValueError(f"Table {missing[0]} does not exist"))
+                continue
+            try:
+                # Served from the cache loaded above, so no cursor is needed
+                planned.append((job, resolve_mapping(None, job)))
+            except Exception as error:
+                outcomes[id(job)] = (job, None, error)
+
+        groups = [[population_query(job, mapping, psycopg_sql), count_query(job, mapping, psycopg_sql)]
+                  for job, mapping in planned]
+        with trace.span("pipelined queries"):
+            results = await self.pipeline_groups(groups)
+        trace.queries += 2 * len(groups)
+
+        for (job, mapping), result in zip(planned, results):
+            if isinstance(result, Exception):
+                outcomes[id(job)] = (job, None, result)
+                continue
+            city_features, count_rows = result
+            trace.record_rows(city_features)
+            trace.record_rows(count_rows)
+            try:
+                school_counts, category_counts = split_counts(count_rows)
+                outcomes[id(job)] = (job, build_table(job, city_features, school_counts, trace, category_counts), None)
+            except Exception as error:
+                outcomes[id(job)] = (job, None, error)
+        return [outcomes[id(job)] for job in jobs]
+
+    async def _close(self):
+        if self._connection is not None:
+            await self._connection.close()
+
+    def close(self):
+        """Close the connection and stop the loop thread."""
+        self.run(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
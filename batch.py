@@ -0,0 +1,205 @@
+"""Run many needed-schools jobs in one session over a bounded worker pool."""
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PyQt5.QtCore import QVariant
+from psycopg2 import sql
+
+from .analysis import AnalysisJob, compute_needed_schools
+from .database import create_pool, metadata_cache
+from .instrumentation import RunTrace, log_message
+from .output_sinks import RESULT_FIELDS
+from .validity import check_enabled, valid_table
+
+MAX_WORKERS = 4
+
+# Combined batch output carries the job name in front of the usual columns
+BATCH_FIELDS = [("Region", QVariant.String)] + RESULT_FIELDS
+
+JOB_COLUMNS = ["population_table", "schools_table", "population_field", "students_per_school"]
+
+
+def load_jobs_csv(path):
+    """Read batch jobs from a CSV file.
+
+    Required columns are ``population_table``, ``schools_table``,
+    ``population_field`` and ``students_per_school``; an optional
+    ``partition_column`` splits that row's population table into one job per
+    distinct value, and optional ``label_column`` / ``id_column`` override the
+    column mapping.
+    """
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        reader = csv.DictReader(csv_file)
+        missing = [column for column in JOB_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Batch file is missing column(s): {', '.join(missing)}")
+        return [
+            AnalysisJob(row["population_table"], row["schools_table"], row["population_field"],
+                        row["students_per_school"], partition_column=row.get("partition_column") or None,
+                        label_column=row.get("label_column") or None, id_column=row.get("id_column") or None)
+            for row in reader
+        ]
+
+
+def expand_partitions(cursor, jobs):
+    """Replace every partitioned job by one job per distinct partition value."""
+    expanded = []
+    for job in jobs:
+        if job.partition_column is None or job.region is not None:
+            expanded.append(job)
+            continue
+        cursor.execute(sql.SQL("SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL ORDER BY 1").format(
+            column=sql.Identifier(job.partition_column), table=sql.Identifier(job.population_table)
+        ))
+        for (region,) in cursor.fetchall():
+            expanded.append(job.copy(region=region, name=f"{job.population_table} {region}"))
+    return expanded
+
+
+def validate_job(cursor, job):
+    """Check the tables and columns of ``job`` against the cached catalog."""
+    tables = metadata_cache.tables(cursor)
+    for table in (job.population_table, job.schools_table):
+        if table not in tables:
+            raise ValueError(f"Table {table} does not exist")
+    columns = metadata_cache.columns(cursor, job.population_table)
+    for column in (job.population_field, job.partition_column, job.label_column, job.id_column):
+        if column is not None and column not in columns:
+            raise ValueError(f"Column {column} does not exist in {job.population_table}")
+
+
+class JobResult:
+    """Outcome of one batch job."""
+
+    def __init__(self, job, table=None, seconds=0.0, error=None):
+        self.job = job
+        self.table = table
+        self.seconds = seconds
+        self.error = error
+        self.areas = len(table) if table is not None else 0
+
+
+class BatchRunner:
+    """Schedules jobs on a thread pool that shares one connection pool.
+
+    Given an ``AsyncDatabase`` the jobs' queries are instead sent together in
+    one psycopg 3 pipeline, synced after every job so failures stay per job.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, async_database=None):
+        self.max_workers = max_workers
+        self.async_database = async_database
+        self.pool = create_pool(max_workers)
+
+    def close(self):
+        """Close every pooled connection."""
+        self.pool.closeall()
+
+    def _run_job(self, job):
+        """Compute the result table of one job on a pooled connection."""
+        started = time.perf_counter()
+        connection = self.pool.getconn()
+        trace = RunTrace.from_settings()
+        try:
+            cursor = trace.cursor(connection.cursor())
+            validate_job(cursor, job)
+            table = compute_needed_schools(cursor, job, trace)
+            cursor.close()
+            connection.rollback()
+            trace.report()
+            return JobResult(job, table, time.perf_counter() - started)
+        except Exception as error:
+            connection.rollback()
+            return JobResult(job, seconds=time.perf_counter() - started, error=error)
+        finally:
+            self.pool.putconn(connection)
+
+    def _run_pipelined(self, jobs):
+        """Compute all jobs over the pipelined psycopg 3 connection."""
+        started = time.perf_counter()
+        trace = RunTrace.from_settings()
+        try:
+            outcomes = self.async_database.run(self.async_database.compute_jobs(jobs, trace))
+        except Exception as error:
+            # Without the connection no job gets its rows; each reports why
+            outcomes = [(job, None, error) for job in jobs]
+        trace.report()
+        seconds = time.perf_counter() - started
+        return [JobResult(job, table, seconds, error) for job, table, error in outcomes]
+
+    def prepare(self, jobs):
+        """Expand partitioned jobs and repair invalid areas using one pooled connection.
+
+        Each population table is checked once, however many jobs read it, so
+        one invalid polygon cannot fail every job of a partitioned table.
+        """
+        connection = self.pool.getconn()
+        try:
+            cursor = connection.cursor()
+            jobs = expand_partitions(cursor, jobs)
+            if check_enabled():
+                valid_tables = {}
+                for table in {job.population_table for job in jobs}:
+                    valid_tables[table], invalid = valid_table(cursor, table)
+                    if invalid:
+                        log_message(f"{invalid} invalid area(s) of {table} were repaired for this batch.")
+                jobs = [job.copy(population_table=valid_tables[job.population_table]) for job in jobs]
+            cursor.close()
+            connection.commit()
+            return jobs
+        finally:
+            self.pool.putconn(connection)
+
+    def run(self, jobs, sink_factory, per_region=False, progress=None):
+        """Run ``jobs`` and write their results through sinks made by ``sink_factory``.
+
+        ``sink_factory(fields, layer_name, region)`` returns an output sink;
+        ``region`` is the job name, or None for the combined output.  With
+        ``per_region`` every job gets its own sink and layer, otherwise all
+        rows go to one combined layer with a ``Region`` column.  ``progress``
+        is called as ``progress(finished, total, result)``.  Returns the
+        closed output sinks (each holding its ``layer``) and the list of
+        job results.
+        """
+        jobs = self.prepare(jobs)
+        combined = None if per_region else sink_factory(BATCH_FIELDS, "Needed Schools (batch)", None)
+        sinks = []
+        results = []
+
+        # Workers only query; rows are written here so sinks stay single-threaded
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            if self.async_database is not None:
+                completed = self._run_pipelined(jobs)
+            else:
+                futures = [executor.submit(self._run_job, job) for job in jobs]
+                completed = (future.result() for future in as_completed(futures))
+            for result in completed:
+                results.append(result)
+                if result.error is None:
+                    if per_region:
+                        sink = sink_factory(RESULT_FIELDS, f"Needed Schools - {result.job.name}", result.job.name)
+                        sink.write_table(result.table)
+                        sink.close()
+                        sinks.append(sink)
+                    else:
+                        combined.write_table(result.table, [result.job.name])
+                    result.table = None
+                if progress is not None:
+                    progress(len(results), len(jobs), result)
+
+        if combined is not None:
+            combined.close()
+            sinks.append(combined)
+        log_message(summarize(results))
+        return sinks, results
+
+
+def summarize(results):
+    """Human readable progress summary of a finished batch."""
+    failed = [result for result in results if result.error is not None]
+    lines = [f"Batch finished: {len(results) - len(failed)} of {len(results)} job(s) succeeded"]
+    for result in results:
+        status = f"failed: {result.error}" if result.error is not None else "ok"
+        lines.append(f"  {result.job.name}: {status}, {result.areas} area(s) ({result.seconds:.2f} s)")
+    return "\n".join(lines)
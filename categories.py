@@ -0,0 +1,145 @@
+"""Needed schools broken down by a category of the schools table.
+
+With a category column configured (school level, ownership, status...),
+the counting query adds one ``COUNT(*) FILTER (WHERE ...)`` per category,
+and optionally a filtered sum of a capacity column, to the scan that
+already counts all schools, so the breakdown costs no extra pass over the
+schools.  Each category gets its own expected, current and shortfall
+columns on the output layer; a category may have its own students-per-school
+ratio, e.g. ``primary:800, secondary:1500``.
+"""
+import re
+
+import numpy as np
+from PyQt5.QtCore import QVariant
+from qgis.core import QgsSettings
+
+SETTING_COLUMN = "needed_schools/category_column"
+SETTING_CATEGORIES = "needed_schools/categories"
+SETTING_CAPACITY_COLUMN = "needed_schools/capacity_column"
+
+
+def parse_categories(value):
+    """``[(category, students per school or None)]`` from ``"primary:800, secondary"``."""
+    categories = []
+    for part in value.split(","):
+        name, _, ratio = part.partition(":")
+        name = name.strip()
+        if not name:
+            continue
+        if ratio.strip():
+            ratio = int(ratio)
+            if ratio <= 0:
+                raise ValueError(f"Students per school of category {name} must be positive")
+        categories.append((name, ratio or None))
+    return categories
+
+
+def category_text(value):
+    """``value`` as the counting query's ``::text`` cast writes it, or None for NULL."""
+    if value is None or isinstance(value, QVariant) and value.isNull():
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        # PostgreSQL prints integral floats without a fraction, Python with ".0"
+        return str(int(value))
+    return str(value)
+
+
+class CategoryBreakdown:
+    """Which schools column to break the counts down by, and into which categories."""
+
+    def __init__(self, column, categories, capacity_column=None):
+        if not categories:
+            raise ValueError("A category breakdown needs at least one category")
+        self.column = column
+        self.categories = list(categories)
+        self.capacity_column = capacity_column
+
+    @classmethod
+    def from_settings(cls):
+        """The breakdown configured in the QGIS settings, or None."""
+        settings = QgsSettings()
+        column = settings.value(SETTING_COLUMN, "", type=str)
+        categories = parse_categories(settings.value(SETTING_CATEGORIES, "", type=str))
+        if not column or not categories:
+            return None
+        return cls(column, categories, settings.value(SETTING_CAPACITY_COLUMN, "", type=str) or None)
+
+    def __repr__(self):
+        return f"CategoryBreakdown({self.column!r}, {self.categories!r}, {self.capacity_column!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, CategoryBreakdown) and repr(self) == repr(other)
+
+    def __hash__(self):
+        return hash(repr(self))
+
+    def labels(self):
+        """Field-name-safe form of every category."""
+        return [re.sub(r"\W+", "_", name).strip("_") or "blank" for name, _ in self.categories]
+
+    def fields(self):
+        """Output fields added for the breakdown, in ``columns`` order."""
+        fields = []
+        for label in self.labels():
+            fields += [(f"Expected_{label}", QVariant.Int), (f"Current_{label}", QVariant.Int),
+                       (f"Shortfall_{label}", QVariant.Int)]
+            if self.capacity_column:
+                fields.append((f"Capacity_{label}", QVariant.Double))
+        return fields
+
+    def count_sql(self, alias, sql):
+        """Filtered aggregates to add to the counting query's select list, and their parameters.
+
+        Per category: the school count, then the capacity sum when a
+        capacity column is configured.
+        """
+        column = sql.Identifier(alias, self.column)
+        expressions, params = [], []
+        for name, _ in self.categories:
+            expressions.append(sql.SQL("COUNT(*) FILTER (WHERE {}::text = %s)").format(column))
+            params.append(name)
+            if self.capacity_column:
+                expressions.append(sql.SQL("COALESCE(SUM({})::float8 FILTER (WHERE {}::text = %s), 0)").format(
+                    sql.Identifier(alias, self.capacity_column), column))
+                params.append(name)
+        return expressions, params
+
+    def columns(self, keys, category_counts, population, students_per_school):
+        """Output columns of areas ``keys`` from ``{key: aggregates}`` in ``count_sql`` order."""
+        step = 2 if self.capacity_column else 1
+        width = len(self.categories) * step
+        aggregates = np.array([category_counts.get(key) or [0] * width for key in keys],
+                              dtype=np.float64).reshape(len(keys), width)
+        population = np.asarray(population, dtype=np.float64)
+        columns = {}
+        for index, (label, (_, ratio)) in enumerate(zip(self.labels(), self.categories)):
+            expected = np.rint(population / (ratio or students_per_school)).astype(np.int32)
+            current = aggregates[:, index * step].astype(np.int32)
+            columns[f"Expected_{label}"] = expected
+            columns[f"Current_{label}"] = current
+            columns[f"Shortfall_{label}"] = np.maximum(0, expected - current)
+            if self.capacity_column:
+                columns[f"Capacity_{label}"] = aggregates[:, index * step + 1]
+        return columns
+
+    def aggregate_local(self, area_index, school_category, school_capacity, areas):
+        """Per-area aggregates in ``count_sql`` order from matched ``(area, school)`` pairs, by bincount.
+
+        ``school_category`` is the category index of each matched school, -1
+        for schools in none of the categories.  Returns an ``(areas, width)``
+        array.
+        """
+        width = len(self.categories)
+        area_index = np.asarray(area_index, dtype=np.int64)
+        school_category = np.asarray(school_category, dtype=np.int64)
+        keep = school_category >= 0
+        cells = area_index[keep] * width + school_category[keep]
+        counts = np.bincount(cells, minlength=areas * width).reshape(areas, width)
+        if not self.capacity_column:
+            return counts.astype(np.float64)
+        capacity = np.bincount(cells, weights=np.asarray(school_capacity, dtype=np.float64)[keep],
+                               minlength=areas * width).reshape(areas, width)
+        return np.stack([counts, capacity], axis=2).reshape(areas, 2 * width)
@@ -0,0 +1,195 @@
+"""Distance-to-nearest-school raster and underserved-population surface.
+
+The population extent is covered by a grid aligned with the demand points
+lattice.  Distances from cell centres to the nearest school are computed
+tile by tile: each tile only compares its cells with the schools that can
+possibly be nearest to one of them, found from the tile centre's nearest
+school, so memory stays bounded and dense areas stay cheap.  Demand points
+are binned into the same grid, and the population living farther than the
+coverage distance from any school forms the underserved surface, written to
+a GeoTIFF next to the distances and added as a raster layer.
+"""
+import math
+import os
+import re
+import tempfile
+
+import numpy as np
+from qgis.core import (
+    QgsColorRampShader, QgsRasterLayer, QgsRasterShader, QgsSettings, QgsSingleBandPseudoColorRenderer, QgsStyle
+)
+from psycopg2 import sql
+
+from .analysis import OUTPUT_SRID, geometry_sql, resolve_mapping
+from .demand import METRES_PER_DEGREE, grid_spacing
+
+SETTING_CELL_SIZE = "needed_schools/coverage_cell_size"
+SETTING_DISTANCE = "needed_schools/coverage_distance"
+SETTING_OUTPUT_DIR = "needed_schools/coverage_dir"
+DEFAULT_DISTANCE = 5000.0
+TILE_CELLS = 256
+# Cell x school distances evaluated at once inside a tile
+MAX_BROADCAST = 4000000
+
+UNDERSERVED_BAND = 1
+DISTANCE_BAND = 2
+
+
+def coverage_settings():
+    """``(cell size, coverage distance)`` in metres from the QGIS settings; cell size 0 means off."""
+    settings = QgsSettings()
+    return (settings.value(SETTING_CELL_SIZE, 0.0, type=float),
+            settings.value(SETTING_DISTANCE, DEFAULT_DISTANCE, type=float))
+
+
+def fetch_school_points(cursor, job):
+    """Longitudes and latitudes of every school of ``job``."""
+    mapping = resolve_mapping(cursor, job)
+    point = geometry_sql("s", mapping.schools_geometry_column, mapping.schools_srid, OUTPUT_SRID)
+    cursor.execute(sql.SQL("SELECT ST_X(p), ST_Y(p) FROM (SELECT ST_PointOnSurface({point}) AS p FROM {schools} s) points "
+                           "WHERE p IS NOT NULL").format(point=point, schools=sql.Identifier(job.schools_table)))
+    rows = cursor.fetchall()
+    return (np.array([row[0] for row in rows], dtype=np.float64),
+            np.array([row[1] for row in rows], dtype=np.float64))
+
+
+class CoverageGrid:
+    """Raster grid in EPSG:4326 whose cell centres coincide with the demand points lattice."""
+
+    def __init__(self, extent, cell_size, latitude):
+        self.cell_size = cell_size
+        self.latitude = latitude
+        self.step_x, self.step_y = grid_spacing(cell_size, latitude)
+        xmin, ymin, xmax, ymax = extent
+        self.column_offset = math.floor(xmin / self.step_x)
+        self.row_offset = math.floor(ymin / self.step_y)
+        self.columns = max(1, math.ceil(xmax / self.step_x) - self.column_offset)
+        self.rows = max(1, math.ceil(ymax / self.step_y) - self.row_offset)
+
+    @property
+    def geotransform(self):
+        """GDAL geotransform; raster row 0 is the northernmost grid row."""
+        return (self.column_offset * self.step_x, self.step_x, 0.0,
+                (self.row_offset + self.rows) * self.step_y, 0.0, -self.step_y)
+
+    def cell_centres(self, row_start, row_stop, column_start, column_stop):
+        """Longitudes and latitudes of a block of cells, in raster (north-up) order."""
+        columns = np.arange(column_start, column_stop) + self.column_offset + 0.5
+        rows = self.row_offset + self.rows - np.arange(row_start, row_stop) - 0.5
+        x, y = np.meshgrid(columns * self.step_x, rows * self.step_y)
+        return x, y
+
+    def to_metres(self, x, y):
+        """Local equirectangular coordinates in metres, good enough for distances within a country."""
+        return (np.asarray(x) * METRES_PER_DEGREE * math.cos(math.radians(self.latitude)),
+                np.asarray(y) * METRES_PER_DEGREE)
+
+    def bin_population(self, x, y, population):
+        """Sum point populations into a ``rows`` x ``columns`` array in raster order."""
+        columns = np.floor(np.asarray(x) / self.step_x).astype(np.int64) - self.column_offset
+        rows = self.rows - 1 - (np.floor(np.asarray(y) / self.step_y).astype(np.int64) - self.row_offset)
+        inside = (columns >= 0) & (columns < self.columns) & (rows >= 0) & (rows < self.rows)
+        grid = np.bincount(rows[inside] * self.columns + columns[inside], weights=np.asarray(population)[inside],
+                           minlength=self.rows * self.columns)
+        return grid.reshape(self.rows, self.columns)
+
+
+def nearest_distances(cell_x, cell_y, school_x, school_y):
+    """Distance from every cell centre to its nearest school, all in metres.
+
+    Only schools within the tile centre's nearest distance plus the tile's
+    diameter can be nearest to one of the cells, so the others are skipped.
+    """
+    if len(school_x) == 0:
+        return np.full(len(cell_x), np.inf)
+    centre_x, centre_y = cell_x.mean(), cell_y.mean()
+    half_diagonal = np.sqrt(np.max((cell_x - centre_x) ** 2 + (cell_y - centre_y) ** 2))
+    to_centre = (school_x - centre_x) ** 2 + (school_y - centre_y) ** 2
+    radius = np.sqrt(to_centre.min()) + 2 * half_diagonal
+    candidates = to_centre <= radius ** 2
+    school_x, school_y = school_x[candidates], school_y[candidates]
+
+    distances = np.empty(len(cell_x))
+    step = max(1, MAX_BROADCAST // len(school_x))
+    for start in range(0, len(cell_x), step):
+        dx = cell_x[start:start + step, None] - school_x[None, :]
+        dy = cell_y[start:start + step, None] - school_y[None, :]
+        distances[start:start + step] = np.sqrt((dx * dx + dy * dy).min(axis=1))
+    return distances
+
+
+def write_coverage_raster(path, grid, school_x, school_y, population, max_distance):
+    """Write the underserved population (band 1) and nearest-school distance (band 2) as a GeoTIFF.
+
+    ``population`` is the binned population grid.  Returns the total
+    underserved population.
+    """
+    from osgeo import gdal, osr
+
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        path, grid.columns, grid.rows, 2, gdal.GDT_Float32,
+        ["TILED=YES", f"BLOCKXSIZE={TILE_CELLS}", f"BLOCKYSIZE={TILE_CELLS}", "COMPRESS=DEFLATE"]
+    )
+    if dataset is None:
+        raise IOError(f"Cannot create raster {path}")
+    dataset.SetGeoTransform(grid.geotransform)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(OUTPUT_SRID)
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.GetRasterBand(UNDERSERVED_BAND).SetDescription("Underserved population")
+    dataset.GetRasterBand(DISTANCE_BAND).SetDescription("Distance to nearest school (m)")
+
+    schools_mx, schools_my = grid.to_metres(school_x, school_y)
+    underserved_total = 0.0
+    for row in range(0, grid.rows, TILE_CELLS):
+        row_stop = min(row + TILE_CELLS, grid.rows)
+        for column in range(0, grid.columns, TILE_CELLS):
+            column_stop = min(column + TILE_CELLS, grid.columns)
+            x, y = grid.cell_centres(row, row_stop, column, column_stop)
+            cell_mx, cell_my = grid.to_metres(x.ravel(), y.ravel())
+            distance = nearest_distances(cell_mx, cell_my, schools_mx, schools_my).reshape(x.shape)
+            tile_population = population[row:row_stop, column:column_stop]
+            underserved = np.where(distance > max_distance, tile_population, 0.0)
+            underserved_total += float(underserved.sum())
+            dataset.GetRasterBand(UNDERSERVED_BAND).WriteArray(underserved.astype(np.float32), column, row)
+            dataset.GetRasterBand(DISTANCE_BAND).WriteArray(
+                np.minimum(distance, np.finfo(np.float32).max).astype(np.float32), column, row)
+    dataset.FlushCache()
+    dataset = None
+    return underserved_total
+
+
+def build_coverage(table, points, school_x, school_y, cell_size, max_distance, layer_name, directory=None):
+    """Write the coverage raster of a run from its ``ResultTable``, demand points and school points.
+
+    Returns the raster path and the total underserved population.
+    """
+    if directory is None:
+        directory = QgsSettings().value(SETTING_OUTPUT_DIR, "", type=str) or os.path.join(
+            tempfile.gettempdir(), "needed_schools_coverage")
+    os.makedirs(directory, exist_ok=True)
+    # A file of its own per run, since earlier coverage layers keep theirs open
+    prefix = re.sub(r"[^0-9A-Za-z]+", "_", layer_name).strip("_").lower()
+    handle, path = tempfile.mkstemp(prefix=f"{prefix}_", suffix="_coverage.tif", dir=directory)
+    os.close(handle)
+
+    # Same reference latitude as the demand points, so their lattice and the grid coincide
+    grid = CoverageGrid((points.x.min(), points.y.min(), points.x.max(), points.y.max()), cell_size,
+                        float(np.mean(table.label_y)))
+    population = grid.bin_population(points.x, points.y, points.population(table.population))
+    return path, write_coverage_raster(path, grid, school_x, school_y, population, max_distance)
+
+
+def coverage_layer(path, layer_name="Underserved population"):
+    """Raster layer of the underserved band, coloured with a pseudocolor ramp."""
+    layer = QgsRasterLayer(path, layer_name)
+    if not layer.isValid():
+        raise ValueError(f"Could not load the coverage raster {path}")
+    statistics = layer.dataProvider().bandStatistics(UNDERSERVED_BAND)
+    shader_function = QgsColorRampShader(0, max(statistics.maximumValue, 1))
+    shader_function.setSourceColorRamp(QgsStyle.defaultStyle().colorRamp("Reds"))
+    shader_function.classifyColorRamp(5)
+    shader = QgsRasterShader()
+    shader.setRasterShaderFunction(shader_function)
+    layer.setRenderer(QgsSingleBandPseudoColorRenderer(layer.dataProvider(), UNDERSERVED_BAND, shader))
+    return layer
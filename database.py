@@ -0,0 +1,150 @@
+"""Connection settings and helpers for the analysis database."""
+import threading
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from qgis.core import QgsDataSourceUri
+
+# Connection parameters for the analysis database
+DATABASE_SETTINGS = {
+    "database": "analysis",
+    "user": "postgres",
+    "password": "Munthali56@",
+    "host": "localhost",
+    "port": "5432",
+}
+
+
+def connect():
+    """Open a new connection to the analysis database."""
+    return psycopg2.connect(**DATABASE_SETTINGS)
+
+
+def layer_uri(table, geometry_column="geom", key_column=None, schema="public"):
+    """Return a QGIS ``postgres`` provider URI for a table in the analysis database."""
+    uri = QgsDataSourceUri()
+    uri.setConnection(
+        DATABASE_SETTINGS["host"], DATABASE_SETTINGS["port"], DATABASE_SETTINGS["database"],
+        DATABASE_SETTINGS["user"], DATABASE_SETTINGS["password"]
+    )
+    uri.setDataSource(schema, table, geometry_column, "", key_column or "")
+    return uri.uri(False)
+
+
+def create_pool(max_connections, dsn=None):
+    """Create a thread-safe pool of up to ``max_connections`` connections.
+
+    Connects with ``DATABASE_SETTINGS`` unless a libpq ``dsn`` is given.
+    """
+    if dsn is not None:
+        return ThreadedConnectionPool(1, max_connections, dsn)
+    return ThreadedConnectionPool(1, max_connections, **DATABASE_SETTINGS)
+
+
+def relation_name(table):
+    """``table`` quoted for ``to_regclass``, resolved like the queries' unqualified names.
+
+    The search path puts a connection's temporary tables before ``public``,
+    so per-run copies are found the same way the queries find them.
+    """
+    return '"{}"'.format(table.replace('"', '""'))
+
+
+class MetadataCache:
+    """Caches catalog lookups so repeated runs in one session skip them.
+
+    Table details are looked up by the name's resolution on the search path,
+    which includes the connection's temporary tables; the table list only
+    holds the ``public`` schema.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = None
+        self._columns = {}
+        self._geometries = {}
+        self._keys = {}
+
+    def tables(self, cursor):
+        """Names of the tables in the ``public`` schema."""
+        with self._lock:
+            if self._tables is None:
+                cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
+                self._tables = [row[0] for row in cursor.fetchall()]
+            return list(self._tables)
+
+    def columns(self, cursor, table):
+        """Column names of ``table``."""
+        with self._lock:
+            if table not in self._columns:
+                cursor.execute(
+                    "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attnum > 0 "
+                    "AND NOT attisdropped ORDER BY attnum",
+                    [relation_name(table)]
+                )
+                self._columns[table] = [row[0] for row in cursor.fetchall()]
+            return list(self._columns[table])
+
+    def geometry(self, cursor, table):
+        """``(geometry column, SRID)`` of ``table`` as registered in ``geometry_columns``."""
+        with self._lock:
+            if table not in self._geometries:
+                cursor.execute(
+                    "SELECT g.f_geometry_column, g.srid FROM pg_class c "
+                    "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                    "JOIN geometry_columns g ON g.f_table_schema = n.nspname AND g.f_table_name = c.relname "
+                    "WHERE c.oid = to_regclass(%s) ORDER BY g.f_geometry_column",
+                    [relation_name(table)]
+                )
+                row = cursor.fetchone()
+                self._geometries[table] = (row[0], row[1]) if row is not None else None
+            if self._geometries[table] is None:
+                raise ValueError(f"Table {table} has no geometry column")
+            return self._geometries[table]
+
+    def primary_key(self, cursor, table):
+        """Single-column primary key of ``table``, or None."""
+        with self._lock:
+            if table not in self._keys:
+                cursor.execute(
+                    "SELECT a.attname FROM pg_index i "
+                    "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+                    "WHERE i.indrelid = to_regclass(%s) AND i.indisprimary",
+                    [relation_name(table)]
+                )
+                rows = cursor.fetchall()
+                self._keys[table] = rows[0][0] if len(rows) == 1 else None
+            return self._keys[table]
+
+    def is_loaded(self, tables=()):
+        """True when the table list and the details of ``tables`` are cached."""
+        with self._lock:
+            return self._tables is not None and all(
+                table in self._columns and table in self._geometries and table in self._keys for table in tables
+            )
+
+    def prime(self, tables=None, columns=None, geometries=None, keys=None):
+        """Fill the cache from catalog rows fetched in bulk elsewhere.
+
+        ``columns`` maps table to column names, ``geometries`` table to
+        ``(geometry column, SRID)`` or None, and ``keys`` table to its primary
+        key column or None.
+        """
+        with self._lock:
+            if tables is not None:
+                self._tables = list(tables)
+            self._columns.update(columns or {})
+            self._geometries.update(geometries or {})
+            self._keys.update(keys or {})
+
+    def clear(self):
+        """Forget everything, e.g. after tables were created or altered."""
+        with self._lock:
+            self._tables = None
+            self._columns.clear()
+            self._geometries.clear()
+            self._keys.clear()
+
+
+# Shared by the dialog and batch runs for the lifetime of the QGIS session
+metadata_cache = MetadataCache()
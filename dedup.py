@@ -0,0 +1,227 @@
+"""Spatial deduplication of school registries.
+
+The schools table merges several registries, so one school is often
+recorded two or three times a few metres apart.  Points closer than the
+tolerance, and with similar names when a name column is configured, are
+joined into clusters; counting then uses one canonical school per cluster.
+
+Candidate pairs come from a grid hash with cells the size of the
+tolerance: every point is only compared with the points of its own and
+the neighbouring cells, all with NumPy, so the work grows with the number
+of points rather than its square.  Clusters are the connected components
+of the close pairs, found by min-label propagation.  Clusters with more
+than one member are returned as a point layer for review.
+"""
+import difflib
+import math
+import re
+
+import numpy as np
+from PyQt5.QtCore import QVariant
+from psycopg2 import sql
+from qgis.core import QgsFeature, QgsField, QgsGeometry, QgsPointXY, QgsSettings, QgsVectorLayer
+
+from .analysis import OUTPUT_SRID, geometry_sql, resolve_mapping
+from .database import metadata_cache
+from .demand import METRES_PER_DEGREE
+
+SETTING_TOLERANCE = "needed_schools/dedup_tolerance"
+SETTING_NAME_COLUMN = "needed_schools/dedup_name_column"
+SETTING_NAME_SIMILARITY = "needed_schools/dedup_name_similarity"
+DEFAULT_NAME_SIMILARITY = 0.8
+CANONICAL_SUFFIX = "_canonical"
+
+# Words that registries add or drop freely, ignored when comparing names
+_NOISE_WORDS = re.compile(r"\b(school|primary|secondary|community|day|cdss|lea|fp|sch|pvt|private|the)\b")
+
+# Half of the 3 x 3 neighbourhood: every pair of neighbouring cells is visited once
+_NEIGHBOURS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def dedup_settings():
+    """``(tolerance in metres, name column or None, minimum name similarity)``; tolerance 0 means off."""
+    settings = QgsSettings()
+    return (settings.value(SETTING_TOLERANCE, 0.0, type=float),
+            settings.value(SETTING_NAME_COLUMN, "", type=str) or None,
+            settings.value(SETTING_NAME_SIMILARITY, DEFAULT_NAME_SIMILARITY, type=float))
+
+
+def normalize_name(name):
+    """Lower-case name without punctuation and noise words."""
+    words = re.sub(r"[^0-9a-z]+", " ", str(name or "").lower())
+    return " ".join(_NOISE_WORDS.sub(" ", words).split())
+
+
+def similar_names(first, second, min_similarity=DEFAULT_NAME_SIMILARITY):
+    """Whether two names may be the same school; a missing name matches anything."""
+    first, second = normalize_name(first), normalize_name(second)
+    if not first or not second or first == second:
+        return True
+    return difflib.SequenceMatcher(None, first, second).ratio() >= min_similarity
+
+
+def candidate_pairs(x, y, tolerance):
+    """Index pairs ``(i, j)``, ``i != j``, of points at most ``tolerance`` apart, each pair once."""
+    count = len(x)
+    if count < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    cell_x = np.floor(x / tolerance).astype(np.int64)
+    cell_y = np.floor(y / tolerance).astype(np.int64)
+    cell_x -= cell_x.min()
+    cell_y -= cell_y.min() - 1
+    width = int(cell_y.max()) + 2
+    keys = cell_x * width + cell_y
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    # Neighbour lookups run on the sorted keys, so the searches walk memory in order
+    first, second = [], []
+    for dx, dy in _NEIGHBOURS:
+        wanted = sorted_keys + dx * width + dy
+        starts = np.searchsorted(sorted_keys, wanted, side="left")
+        sizes = np.searchsorted(sorted_keys, wanted, side="right") - starts
+        points = np.repeat(np.arange(count), sizes)
+        # Position of every candidate inside its cell's run of sorted_keys
+        others = np.repeat(starts, sizes) + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        if (dx, dy) == (0, 0):
+            points, others = points[points < others], others[points < others]
+        first.append(order[points])
+        second.append(order[others])
+    first, second = np.concatenate(first), np.concatenate(second)
+    close = np.hypot(x[first] - x[second], y[first] - y[second]) <= tolerance
+    return first[close], second[close]
+
+
+def connected_labels(count, first, second):
+    """Component label of every node of the graph with edges ``(first, second)``: its smallest member."""
+    labels = np.arange(count)
+    while True:
+        updated = labels.copy()
+        lowest = np.minimum(labels[first], labels[second])
+        np.minimum.at(updated, first, lowest)
+        np.minimum.at(updated, second, lowest)
+        # Pointer jumping shortens long chains
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def cluster_points(x, y, tolerance, names=None, min_similarity=DEFAULT_NAME_SIMILARITY):
+    """Cluster label of every point, in metres; the label is the index of the cluster's canonical point."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if tolerance <= 0:
+        return np.arange(len(x))
+    first, second = candidate_pairs(x, y, tolerance)
+    if names is not None and len(first):
+        keep = np.array([similar_names(names[i], names[j], min_similarity)
+                         for i, j in zip(first.tolist(), second.tolist())], dtype=bool)
+        first, second = first[keep], second[keep]
+    return connected_labels(len(x), first, second)
+
+
+def to_metres(longitudes, latitudes):
+    """Local equirectangular coordinates in metres around the mean latitude."""
+    latitude = float(np.mean(latitudes)) if len(latitudes) else 0.0
+    return (np.asarray(longitudes) * METRES_PER_DEGREE * math.cos(math.radians(latitude)),
+            np.asarray(latitudes) * METRES_PER_DEGREE)
+
+
+class SchoolRegistry:
+    """Key, position in EPSG:4326 and name of every school, with its cluster label once clustered."""
+
+    def __init__(self, keys, longitudes, latitudes, names=None):
+        self.keys = list(keys)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.names = names
+        self.labels = np.arange(len(self.keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def cluster(self, tolerance, min_similarity=DEFAULT_NAME_SIMILARITY):
+        x, y = to_metres(self.longitudes, self.latitudes)
+        self.labels = cluster_points(x, y, tolerance, self.names, min_similarity)
+        return self
+
+    def canonical(self):
+        """Keys of one school per cluster."""
+        return [self.keys[index] for index in np.flatnonzero(self.labels == np.arange(len(self)))]
+
+    def duplicate_count(self):
+        return int(np.count_nonzero(self.labels != np.arange(len(self))))
+
+    def review_layer(self, layer_name="Duplicate schools"):
+        """Memory point layer of the schools in clusters with more than one member."""
+        layer = QgsVectorLayer(f"Point?crs=EPSG:{OUTPUT_SRID}", layer_name, "memory")
+        layer.dataProvider().addAttributes([
+            QgsField("Cluster", QVariant.Int), QgsField("School_Id", QVariant.String),
+            QgsField("Name", QVariant.String), QgsField("Canonical", QVariant.Int),
+        ])
+        layer.updateFields()
+        sizes = np.bincount(self.labels, minlength=len(self))
+        features = []
+        for index in np.flatnonzero(sizes[self.labels] > 1).tolist():
+            feature = QgsFeature()
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(self.longitudes[index], self.latitudes[index])))
+            label = int(self.labels[index])
+            feature.setAttributes([label, str(self.keys[index]),
+                                   None if self.names is None else self.names[index], int(label == index)])
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        return layer
+
+
+def fetch_registry(cursor, job, name_column=None):
+    """The schools of ``job``'s schools table as a ``SchoolRegistry`` keyed by primary key or ctid."""
+    mapping = resolve_mapping(cursor, job)
+    key_column = metadata_cache.primary_key(cursor, job.schools_table)
+    if name_column is not None and name_column not in metadata_cache.columns(cursor, job.schools_table):
+        raise ValueError(f"Column {name_column} does not exist in {job.schools_table}")
+    cursor.execute(sql.SQL(
+        "SELECT k, ST_X(p), ST_Y(p), n FROM (SELECT {key}::text AS k, ST_PointOnSurface({point}) AS p, {name} AS n "
+        "FROM {schools} s) points WHERE p IS NOT NULL"
+    ).format(
+        key=sql.Identifier("s", key_column or "ctid"),
+        point=geometry_sql("s", mapping.schools_geometry_column, mapping.schools_srid, OUTPUT_SRID),
+        name=sql.Identifier("s", name_column) if name_column else sql.SQL("NULL"),
+        schools=sql.Identifier(job.schools_table),
+    ))
+    rows = cursor.fetchall()
+    return SchoolRegistry([row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows],
+                          [row[3] for row in rows] if name_column else None)
+
+
+def write_canonical_table(cursor, job, keys):
+    """Create ``<schools>_canonical`` with the schools whose key is in ``keys``; returns its name.
+
+    The table is temporary: it belongs to the run's connection and goes
+    with it, so concurrent runs never share it and counting needs no write
+    permission on the schema.  The copy gets its own GiST index and
+    statistics, so counting against it plans like counting against the
+    full table.
+    """
+    table = job.schools_table + CANONICAL_SUFFIX
+    key_column = metadata_cache.primary_key(cursor, job.schools_table)
+    geometry = metadata_cache.geometry(cursor, job.schools_table)
+    columns = metadata_cache.columns(cursor, job.schools_table)
+    if key_column is not None:
+        selection = sql.SQL("JOIN unnest(%s::text[]) AS k(key) ON {}::text = k.key").format(
+            sql.Identifier("s", key_column))
+    else:
+        selection = sql.SQL("WHERE s.ctid = ANY(%s::tid[])")
+    # Only an earlier run's copy on this connection is dropped, never a table of the schema
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier("pg_temp", table)))
+    cursor.execute(sql.SQL("CREATE TEMPORARY TABLE {} AS SELECT s.* FROM {} s ").format(
+        sql.Identifier(table), sql.Identifier(job.schools_table)) + selection, [list(keys)])
+    cursor.execute(sql.SQL("CREATE INDEX ON {} USING gist ({})").format(
+        sql.Identifier(table), sql.Identifier(geometry[0])))
+    if key_column is not None:
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY ({})").format(
+            sql.Identifier(table), sql.Identifier(key_column)))
+    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+    # The copy has the source table's layout, so its catalog lookups need no queries
+    metadata_cache.prime(columns={table: columns}, geometries={table: geometry}, keys={table: key_column})
+    return table
@@ -0,0 +1,238 @@
+"""Population-weighted demand points from area polygons.
+
+An area's population is spread over the centres of a regular grid that fall
+inside it, either evenly or in proportion to a land-use mask raster, so that
+distance and capacity analyses see where people live instead of one lump per
+area.  Grid points and their shares of the area population are generated
+with NumPy (point-in-polygon by vectorised ray casting) and cached per
+(table, cell size, mask); only the shares are stored, so the same cache
+serves every population field.
+"""
+import hashlib
+import math
+import os
+import struct
+import tempfile
+
+import numpy as np
+from PyQt5.QtCore import QVariant
+from qgis.core import QgsFeature, QgsField, QgsGeometry, QgsPointXY, QgsSettings, QgsVectorLayer
+
+from .instrumentation import log_message
+
+SETTING_CELL_SIZE = "needed_schools/demand_cell_size"
+SETTING_MASK = "needed_schools/demand_mask"
+SETTING_CACHE_DIR = "needed_schools/demand_cache_dir"
+
+METRES_PER_DEGREE = 111320.0
+# Point x edge comparisons evaluated at once when testing points against a polygon
+MAX_BROADCAST = 4000000
+
+_POLYGON, _MULTIPOLYGON = 3, 6
+
+
+def wkb_rings(wkb):
+    """Rings of a (multi)polygon in WKB, as ``(n, 2)`` float arrays; Z/M values are dropped."""
+    rings = []
+
+    def read(offset):
+        byte_order = "<" if wkb[offset] == 1 else ">"
+        (geometry_type,) = struct.unpack_from(byte_order + "I", wkb, offset + 1)
+        # ISO WKB adds 1000 for Z, 2000 for M and 3000 for ZM coordinates
+        dimensions = (2, 3, 3, 4)[geometry_type // 1000]
+        base_type = geometry_type % 1000
+        offset += 5
+        (count,) = struct.unpack_from(byte_order + "I", wkb, offset)
+        offset += 4
+        if base_type == _MULTIPOLYGON:
+            for _ in range(count):
+                offset = read(offset)
+        elif base_type == _POLYGON:
+            for _ in range(count):
+                (points,) = struct.unpack_from(byte_order + "I", wkb, offset)
+                offset += 4
+                coordinates = np.frombuffer(wkb, np.dtype(np.float64).newbyteorder(byte_order),
+                                            points * dimensions, offset)
+                rings.append(coordinates.reshape(points, dimensions)[:, :2].astype(np.float64))
+                offset += points * dimensions * 8
+        else:
+            raise ValueError(f"Demand points need polygon areas, not WKB type {geometry_type}")
+        return offset
+
+    read(0)
+    return rings
+
+
+def points_in_rings(x, y, rings):
+    """Boolean mask of the points ``(x, y)`` inside ``rings`` by the even-odd rule."""
+    edges = np.concatenate([np.stack([ring[:-1], ring[1:]], axis=1) for ring in rings])
+    x1, y1 = edges[:, 0, 0], edges[:, 0, 1]
+    x2, y2 = edges[:, 1, 0], edges[:, 1, 1]
+    inside = np.zeros(len(x), dtype=bool)
+    step = max(1, MAX_BROADCAST // max(1, len(edges)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, len(x), step):
+            px = x[start:start + step, None]
+            py = y[start:start + step, None]
+            crosses = ((y1 > py) != (y2 > py)) & (px < (x2 - x1) * (py - y1) / (y2 - y1) + x1)
+            inside[start:start + step] = np.count_nonzero(crosses, axis=1) % 2 == 1
+    return inside
+
+
+class DemandPoints:
+    """Grid points with the area each belongs to and its share of that area's population."""
+
+    def __init__(self, area_ids, x, y, area_index, share):
+        self.area_ids = list(area_ids)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.area_index = np.asarray(area_index, dtype=np.int32)
+        self.share = np.asarray(share, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.x)
+
+    def population(self, area_population):
+        """Population of every point, given the population of every area in ``area_ids`` order."""
+        return np.asarray(area_population, dtype=np.float64)[self.area_index] * self.share
+
+    def save(self, path):
+        np.savez(path, area_ids=np.asarray(self.area_ids, dtype=str), x=self.x, y=self.y,
+                 area_index=self.area_index, share=self.share)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            return cls(archive["area_ids"].tolist(), archive["x"], archive["y"], archive["area_index"],
+                       archive["share"])
+
+
+def grid_spacing(cell_size, latitude):
+    """Grid steps in degrees for square cells of ``cell_size`` metres around ``latitude``."""
+    return (cell_size / (METRES_PER_DEGREE * max(0.01, math.cos(math.radians(latitude)))),
+            cell_size / METRES_PER_DEGREE)
+
+
+def sample_mask(path, x, y):
+    """Values of the first band of the raster ``path`` at EPSG:4326 points; outside and nodata are 0."""
+    from osgeo import gdal, osr
+
+    dataset = gdal.Open(path)
+    if dataset is None:
+        raise IOError(f"Cannot open the land-use mask {path}")
+    raster_srs = osr.SpatialReference(wkt=dataset.GetProjection())
+    points_srs = osr.SpatialReference()
+    points_srs.ImportFromEPSG(4326)
+    points_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    raster_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    if not raster_srs.IsSame(points_srs):
+        transformed = osr.CoordinateTransformation(points_srs, raster_srs).TransformPoints(
+            np.column_stack([x, y]).tolist())
+        x = np.array([point[0] for point in transformed])
+        y = np.array([point[1] for point in transformed])
+
+    band = dataset.GetRasterBand(1)
+    values = band.ReadAsArray().astype(np.float64)
+    origin_x, pixel_width, _, origin_y, _, pixel_height = dataset.GetGeoTransform()
+    columns = np.floor((x - origin_x) / pixel_width).astype(np.int64)
+    rows = np.floor((y - origin_y) / pixel_height).astype(np.int64)
+    inside = (columns >= 0) & (columns < values.shape[1]) & (rows >= 0) & (rows < values.shape[0])
+    sampled = np.zeros(len(x), dtype=np.float64)
+    sampled[inside] = values[rows[inside], columns[inside]]
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        sampled[sampled == nodata] = 0
+    return np.maximum(sampled, 0)
+
+
+def build_demand_points(table, cell_size, mask_path=None):
+    """Spread the areas of a ``ResultTable`` over a regular grid of ``cell_size`` metres.
+
+    Every area keeps at least one point: one smaller than a cell gets its
+    label point.  With a mask, shares follow the mask values; an area whose
+    points all fall on zero weight is spread evenly instead.
+    """
+    latitude = float(np.mean(table.label_y)) if len(table) else 0.0
+    step_x, step_y = grid_spacing(cell_size, latitude)
+    xs, ys, owners = [], [], []
+    for index in range(len(table)):
+        wkb = table.wkb_at(index)
+        if not wkb:
+            raise ValueError("Demand points need the area polygons, but the results were kept without geometries")
+        rings = wkb_rings(wkb)
+        stacked = np.concatenate(rings)
+        xmin, ymin = stacked.min(axis=0)
+        xmax, ymax = stacked.max(axis=0)
+        # Cell centres on one grid anchored at the origin, so neighbouring areas share the lattice
+        grid_x = (np.arange(math.floor(xmin / step_x), math.ceil(xmax / step_x)) + 0.5) * step_x
+        grid_y = (np.arange(math.floor(ymin / step_y), math.ceil(ymax / step_y)) + 0.5) * step_y
+        px, py = (axis.ravel() for axis in np.meshgrid(grid_x, grid_y))
+        inside = points_in_rings(px, py, rings)
+        if inside.any():
+            px, py = px[inside], py[inside]
+        else:
+            px, py = table.label_x[index:index + 1], table.label_y[index:index + 1]
+        xs.append(px)
+        ys.append(py)
+        owners.append(np.full(len(px), index, dtype=np.int32))
+
+    x = np.concatenate(xs) if xs else np.zeros(0)
+    y = np.concatenate(ys) if ys else np.zeros(0)
+    area_index = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int32)
+    weights = sample_mask(mask_path, x, y) if mask_path else np.ones(len(x))
+    totals = np.bincount(area_index, weights=weights, minlength=len(table))
+    # Areas with no weight at all fall back to an even spread
+    unweighted = totals[area_index] == 0
+    weights[unweighted] = 1
+    totals = np.bincount(area_index, weights=weights, minlength=len(table))
+    return DemandPoints(table.area_ids.tolist(), x, y, area_index, weights / totals[area_index])
+
+
+def cache_path(population_table, cell_size, mask_path=None, directory=None):
+    """Cache file of the demand points of ``population_table`` at ``cell_size``."""
+    if directory is None:
+        directory = QgsSettings().value(SETTING_CACHE_DIR, "", type=str) or os.path.join(
+            tempfile.gettempdir(), "needed_schools_demand")
+    os.makedirs(directory, exist_ok=True)
+    mask_key = f"{os.path.abspath(mask_path)}:{os.path.getmtime(mask_path)}" if mask_path else ""
+    digest = hashlib.sha1(f"{population_table}|{cell_size:g}|{mask_key}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"{population_table}_{digest}.npz")
+
+
+def demand_points(table, population_table, cell_size, mask_path=None, directory=None):
+    """Cached demand points for the areas of ``table``.
+
+    A cache whose area ids no longer match the table is rebuilt.
+    """
+    path = cache_path(population_table, cell_size, mask_path, directory)
+    if os.path.exists(path):
+        points = DemandPoints.load(path)
+        if points.area_ids == table.area_ids.tolist():
+            return points
+        log_message(f"Areas of {population_table} changed; rebuilding its demand points.")
+    points = build_demand_points(table, cell_size, mask_path)
+    points.save(path)
+    return points
+
+
+def demand_settings():
+    """``(cell size in metres, mask path or None)`` from the QGIS settings; cell size 0 means off."""
+    settings = QgsSettings()
+    return (settings.value(SETTING_CELL_SIZE, 0.0, type=float),
+            settings.value(SETTING_MASK, "", type=str) or None)
+
+
+def demand_layer(points, area_population, layer_name="Demand points"):
+    """Memory point layer of the demand points with their area id and population."""
+    layer = QgsVectorLayer("Point?crs=EPSG:4326", layer_name, "memory")
+    layer.dataProvider().addAttributes([QgsField("Area_Id", QVariant.String), QgsField("Population", QVariant.Double)])
+    layer.updateFields()
+    population = points.population(area_population)
+    features = []
+    for x, y, owner, value in zip(points.x.tolist(), points.y.tolist(), points.area_index.tolist(), population.tolist()):
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+        feature.setAttributes([points.area_ids[owner], value])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
@@ -0,0 +1,165 @@
+"""Lightweight timing and query instrumentation for Needed Schools runs."""
+import json
+import time
+from contextlib import contextmanager
+
+from qgis.core import Qgis, QgsMessageLog, QgsSettings
+from psycopg2 import sql
+
+LOG_TAG = "Needed Schools"
+
+# QgsSettings keys that switch instrumentation on for a QGIS profile
+SETTING_TRACE = "needed_schools/trace"
+SETTING_EXPLAIN = "needed_schools/trace_explain"
+SETTING_TRACE_FILE = "needed_schools/trace_file"
+
+
+def log_message(message, level=Qgis.Info):
+    """Write a message to the plugin's tab in the QGIS message log."""
+    QgsMessageLog.logMessage(message, LOG_TAG, level)
+
+
+def _approximate_size(value):
+    """Rough number of bytes a fetched column value occupied on the wire."""
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+    return 8
+
+
+class RunTrace:
+    """Collects stage timings and database traffic for one calculation run."""
+
+    def __init__(self, enabled=True, explain=False, trace_file=None):
+        self.enabled = enabled
+        self.explain = explain
+        self.trace_file = trace_file
+        self.stages = {}  # stage name -> [calls, seconds], in first-seen order
+        self.queries = 0
+        self.rows = 0
+        self.bytes = 0
+        self.plans = {}
+        self._started = time.perf_counter()
+
+    @classmethod
+    def from_settings(cls):
+        """Build a trace configured from the user's QGIS settings."""
+        settings = QgsSettings()
+        return cls(
+            enabled=settings.value(SETTING_TRACE, False, type=bool),
+            explain=settings.value(SETTING_EXPLAIN, False, type=bool),
+            trace_file=settings.value(SETTING_TRACE_FILE, "", type=str) or None,
+        )
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block and add it to the named stage."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        """Accumulate ``seconds`` spent in stage ``name``."""
+        stage = self.stages.setdefault(name, [0, 0.0])
+        stage[0] += 1
+        stage[1] += seconds
+
+    def cursor(self, cursor):
+        """Return ``cursor`` wrapped so its round trips are counted."""
+        if not self.enabled:
+            return cursor
+        return TracedCursor(cursor, self)
+
+    def record_rows(self, rows):
+        """Count fetched rows and their approximate size."""
+        self.rows += len(rows)
+        for row in rows:
+            self.bytes += sum(_approximate_size(value) for value in row)
+
+    def explain_query(self, cursor, name, query, params=None):
+        """Capture an ``EXPLAIN (ANALYZE, BUFFERS)`` plan for ``query`` once per name."""
+        if not (self.enabled and self.explain) or name in self.plans:
+            return
+        raw_cursor = cursor.wrapped if isinstance(cursor, TracedCursor) else cursor
+        raw_cursor.execute(sql.SQL("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ") + query, params)
+        self.plans[name] = raw_cursor.fetchone()[0]
+
+    def summary(self):
+        """Return the collected measurements as a JSON-serialisable dict."""
+        return {
+            "total_seconds": round(time.perf_counter() - self._started, 6),
+            "stages": [
+                {"name": name, "calls": calls, "seconds": round(seconds, 6)}
+                for name, (calls, seconds) in self.stages.items()
+            ],
+            "queries": self.queries,
+            "rows": self.rows,
+            "approx_bytes": self.bytes,
+            "plans": self.plans,
+        }
+
+    def report(self):
+        """Send the summary to the QGIS message log and, if configured, a JSON trace file."""
+        if not self.enabled:
+            return
+        summary = self.summary()
+        lines = [f"Run finished in {summary['total_seconds']:.3f} s"]
+        for stage in summary["stages"]:
+            lines.append(f"  {stage['name']}: {stage['seconds']:.3f} s over {stage['calls']} call(s)")
+        lines.append(f"  SQL round trips: {self.queries}, rows fetched: {self.rows}, ~{self.bytes} bytes")
+        for name, plan in self.plans.items():
+            top = plan[0] if isinstance(plan, list) and plan else {}
+            lines.append(f"  EXPLAIN {name}: {top.get('Execution Time', '?')} ms, "
+                         f"top node {top.get('Plan', {}).get('Node Type', '?')}")
+        log_message("\n".join(lines))
+
+        if self.trace_file:
+            with open(self.trace_file, "w", encoding="utf-8") as trace_file:
+                json.dump(summary, trace_file, indent=2)
+
+
+class TracedCursor:
+    """Thin psycopg2 cursor proxy that counts round trips and fetched rows."""
+
+    def __init__(self, cursor, trace):
+        self.wrapped = cursor
+        self.trace = trace
+
+    def execute(self, query, params=None):
+        self.trace.queries += 1
+        return self.wrapped.execute(query, params)
+
+    def executemany(self, query, params_seq):
+        params_seq = list(params_seq)
+        self.trace.queries += len(params_seq)
+        return self.wrapped.executemany(query, params_seq)
+
+    def fetchone(self):
+        row = self.wrapped.fetchone()
+        if row is not None:
+            self.trace.record_rows([row])
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.wrapped.fetchmany(size) if size is not None else self.wrapped.fetchmany()
+        self.trace.record_rows(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.wrapped.fetchall()
+        self.trace.record_rows(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self.wrapped:
+            self.trace.record_rows([row])
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
@@ -0,0 +1,168 @@
+"""Needed-schools computation over QGIS vector layers instead of database tables.
+
+Shapefiles, GeoPackages and any other layer loaded in the project are
+counted locally.  The school points are bulk-loaded into a
+``QgsSpatialIndex`` from one feature iterator, which builds the tree in a
+single pass instead of one insert per feature, and the index keeps their
+geometries so no second lookup is needed.  Every area then asks the index
+for the schools in its bounding box and confirms them against its prepared
+geometry.  Areas are read with only the attributes the analysis uses.
+"""
+import numpy as np
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsExpression, QgsFeatureRequest, QgsGeometry, QgsProject, QgsSpatialIndex,
+    QgsVectorLayer, QgsWkbTypes
+)
+
+from .analysis import DEFAULT_LABEL_COLUMN, OUTPUT_SRID, build_table
+from .categories import category_text
+from .database import layer_uri, metadata_cache
+from .dedup import SchoolRegistry
+
+
+def output_request(layer):
+    """Feature request returning geometries in the output CRS."""
+    request = QgsFeatureRequest()
+    request.setDestinationCrs(QgsCoordinateReferenceSystem(f"EPSG:{OUTPUT_SRID}"),
+                              QgsProject.instance().transformContext())
+    return request
+
+
+def database_layer(cursor, table):
+    """Vector layer of a table of the analysis database, for mixing with project layers."""
+    geometry_column, _ = metadata_cache.geometry(cursor, table)
+    layer = QgsVectorLayer(layer_uri(table, geometry_column, metadata_cache.primary_key(cursor, table)), table,
+                           "postgres")
+    if not layer.isValid():
+        raise ValueError(f"Could not load table {table}")
+    return layer
+
+
+def school_request(layer, school_ids=None):
+    """Feature request for the schools of ``layer``, only ``school_ids`` when given, without attributes."""
+    request = output_request(layer).setNoAttributes()
+    if school_ids is not None:
+        request.setFilterFids(list(school_ids))
+    return request
+
+
+def school_index(layer, school_ids=None):
+    """Bulk-loaded spatial index over the schools of ``layer``, storing their geometries."""
+    request = school_request(layer, school_ids)
+    return QgsSpatialIndex(layer.getFeatures(request), None, QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+
+def layer_school_points(layer, school_ids=None):
+    """Longitudes and latitudes of the schools of ``layer``."""
+    x, y = [], []
+    for feature in layer.getFeatures(school_request(layer, school_ids)):
+        geometry = feature.geometry()
+        if geometry.isEmpty():
+            continue
+        point = geometry.pointOnSurface().asPoint()
+        x.append(point.x())
+        y.append(point.y())
+    return np.array(x, dtype=np.float64), np.array(y, dtype=np.float64)
+
+
+def layer_registry(layer, name_column=None):
+    """The schools of ``layer`` as a ``SchoolRegistry`` keyed by feature id."""
+    fields = layer.fields()
+    if name_column is not None and fields.lookupField(name_column) < 0:
+        raise ValueError(f"Field {name_column} does not exist in {layer.name()}")
+    request = output_request(layer)
+    request.setSubsetOfAttributes([name_column] if name_column else [], fields)
+    keys, x, y, names = [], [], [], []
+    for feature in layer.getFeatures(request):
+        geometry = feature.geometry()
+        if geometry.isEmpty():
+            continue
+        point = geometry.pointOnSurface().asPoint()
+        keys.append(feature.id())
+        x.append(point.x())
+        y.append(point.y())
+        names.append(feature[name_column] if name_column else None)
+    return SchoolRegistry(keys, x, y, names if name_column else None)
+
+
+def school_categories(layer, categories):
+    """``{feature id: (category index, capacity)}`` of the schools of ``layer``, read without geometries."""
+    fields = layer.fields()
+    columns = [column for column in (categories.column, categories.capacity_column) if column is not None]
+    for column in columns:
+        if fields.lookupField(column) < 0:
+            raise ValueError(f"Field {column} does not exist in {layer.name()}")
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes(columns, fields)
+    positions = {name: index for index, (name, _) in enumerate(categories.categories)}
+    attributes = {}
+    for feature in layer.getFeatures(request):
+        value = category_text(feature[categories.column])
+        capacity = feature[categories.capacity_column] if categories.capacity_column else None
+        attributes[feature.id()] = (positions.get(value, -1), float(capacity or 0))
+    return attributes
+
+
+def compute_from_layers(population_layer, schools_layer, job, trace, school_ids=None):
+    """Compute the ``ResultTable`` of ``job`` from two vector layers.
+
+    Areas are keyed by ``job.id_column`` or, without one, by feature id; a
+    school counts for an area when the area contains it, as with ``ST_Within``;
+    invalid areas are repaired with ``makeValid`` first.
+    A category breakdown is aggregated from the matched pairs with one
+    bincount.  ``school_ids`` limits the count to those schools, e.g. the
+    canonical schools left by deduplication.
+    """
+    if population_layer.geometryType() != QgsWkbTypes.PolygonGeometry:
+        raise ValueError(f"{population_layer.name()} is not a polygon layer")
+    fields = population_layer.fields()
+    label_column = job.label_column
+    if label_column is None and fields.lookupField(DEFAULT_LABEL_COLUMN) >= 0:
+        label_column = DEFAULT_LABEL_COLUMN
+    columns = [column for column in (job.id_column, label_column, job.population_field) if column is not None]
+    for column in columns:
+        if fields.lookupField(column) < 0:
+            raise ValueError(f"Field {column} does not exist in {population_layer.name()}")
+
+    with trace.span("index schools"):
+        index = school_index(schools_layer, school_ids)
+        if job.categories is not None:
+            categories = school_categories(schools_layer, job.categories)
+
+    request = output_request(population_layer).setSubsetOfAttributes(columns, fields)
+    if job.partition_column is not None:
+        request.setFilterExpression(QgsExpression.createFieldEqualityExpression(job.partition_column, job.region))
+
+    city_features = []
+    school_counts = {}
+    matched_areas, matched_schools = [], []
+    with trace.span("count schools"):
+        for feature in population_layer.getFeatures(request):
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            if not geometry.isGeosValid():
+                geometry = geometry.makeValid()
+            key = feature[job.id_column] if job.id_column else feature.id()
+            label = feature[label_column] if label_column else None
+            population = feature[job.population_field]
+            label_point = geometry.pointOnSurface().asPoint()
+            city_features.append((key, str(label) if label else None, population or 0,
+                                  label_point.x(), label_point.y(), bytes(geometry.asWkb())))
+
+            engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+            engine.prepareGeometry()
+            matches = [school_id for school_id in index.intersects(geometry.boundingBox())
+                       if engine.contains(index.geometry(school_id).constGet())]
+            if matches:
+                school_counts[key] = len(matches)
+                matched_areas += [len(city_features) - 1] * len(matches)
+                matched_schools += matches
+
+    category_counts = None
+    if job.categories is not None:
+        with trace.span("count categories"):
+            category, capacity = zip(*(categories[school_id] for school_id in matched_schools)) \
+                if matched_schools else ((), ())
+            aggregates = job.categories.aggregate_local(matched_areas, category, capacity, len(city_features))
+            category_counts = {row[0]: values for row, values in zip(city_features, aggregates.tolist())}
+    return build_table(job, city_features, school_counts, trace, category_counts)
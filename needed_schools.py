@@ -5,7 +5,6 @@ from qgis.core import (
 )
 from qgis.PyQt.QtCore import QVariant
 from qgis.PyQt.QtWidgets import QAction
-from .needed_schools_dialog import NeededSchoolsDialog
 
 class NeededSchools:
     LAYER_SCHOOLS_INPUT = 'LAYER_SCHOOLS_INPUT'
@@ -22,7 +21,9 @@ class NeededSchools:
         """
         self.iface = iface
         self.output_layer = None
-        self.dialog = NeededSchoolsDialog()
+        # Built on first use: the dialog module pulls in psycopg2, NumPy and the
+        # generated UI, and opening it queries the database
+        self.dialog = None
 
     def name(self):
         return 'needed_schools'
@@ -47,11 +48,16 @@ class NeededSchools:
         """
         self.iface.removePluginMenu('&Needed Schools', self.action)
         self.iface.removeToolBarIcon(self.action)
+        if self.dialog is not None:
+            self.dialog.close_connections()
 
     def run(self):
         """
         Called when the plugin's action is triggered.
         """
+        if self.dialog is None:
+            from .needed_schools_dialog import NeededSchoolsDialog
+            self.dialog = NeededSchoolsDialog()
         self.dialog.exec_()
 
     def initAlgorithm(self, config=None):
@@ -1,10 +1,59 @@
-from PyQt5.QtWidgets import QDialog
-from PyQt5.QtCore import QVariant
-from PyQt5.QtGui import QFont
-from qgis.core import QgsProject, QgsVectorLayer, QgsField, QgsFeature, QgsGeometry, QgsPalLayerSettings, QgsTextFormat, QgsVectorLayerSimpleLabeling
+import os
+import re
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtWidgets import QDialog, QFileDialog
+from qgis.core import QgsProject, QgsVectorLayer, QgsWkbTypes
 import psycopg2
-from psycopg2 import sql
 from .needed_schools_dialog_ui import Ui_neededSchoolsDialog
+from .instrumentation import RunTrace, log_message
+from .database import connect, metadata_cache
+from .batch import BatchRunner, load_jobs_csv
+from .output_sinks import (
+    RESULT_FIELDS, ArrowSink, MBTilesSink, MemorySink, GeoPackageSink, PostgisSink, ResultCollector, join_csv
+)
+from .analysis import AnalysisJob, DEFAULT_LABEL_COLUMN, compute_needed_schools
+from .rendering import apply_rendering
+from .tiling import TileCheckpoint, plan_tiles, run_tiled
+from .categories import CategoryBreakdown
+from .layer_analysis import compute_from_layers, database_layer, layer_registry, layer_school_points
+from .dedup import dedup_settings, fetch_registry, write_canonical_table
+from .validity import check_enabled, valid_table
+from .uncertainty import shortfall_bands, uncertainty_settings, write_bands
+from .temporal import SchoolIntervals, as_of_columns, as_of_settings, fetch_intervals, write_as_of
+from .aggregation import fetch_parent_ids, rollup_columns_from_settings, write_levels
+from .network import area_access, label_points, load_roads, network_settings, write_access
+from .scenarios import ScenarioMatrix, join_scenarios, write_scenarios
+from .snapshot import compute_from_snapshot, export_snapshot, snapshot_job
+from .demand import demand_layer, demand_points, demand_settings
+from .coverage import build_coverage, coverage_layer, coverage_settings, fetch_school_points
+from .advisor import apply_recommendations, explain_count, format_comparison, inspect_table, summarize_plan
+from .vector_tiles import tile_settings
+from . import async_db
+
+OUTPUT_MEMORY = "Memory layer"
+OUTPUT_GEOPACKAGE = "GeoPackage"
+OUTPUT_POSTGIS = "PostGIS table"
+PROJECT_LAYER_SUFFIX = "(project layer)"
+OUTPUT_ARROW = "GeoParquet / Arrow file"
+ARROW_EXTENSIONS = (".parquet", ".arrow", ".feather")
+OUTPUT_MBTILES = "MBTiles vector tiles"
+
+
+class CatalogLoader(QObject):
+    """Hands the result of a background catalog load back to the GUI thread."""
+
+    loaded = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def deliver(self, future):
+        """Done-callback for the future returned by ``AsyncDatabase.submit``."""
+        error = future.exception()
+        if error is not None:
+            self.failed.emit(str(error))
+        else:
+            self.loaded.emit(future.result())
+
 
 class NeededSchoolsDialog(QDialog, Ui_neededSchoolsDialog):
     def __init__(self, parent=None):
@@ -12,68 +61,191 @@ class NeededSchoolsDialog(QDialog, Ui_neededSchoolsDialog):
         super().__init__(parent)
         self.setupUi(self)
 
-        # Populate combo boxes with available tables from the database
-        self.populate_table_comboboxes()
+        # Populate combo boxes with available tables from the database; with
+        # psycopg 3 the whole catalog is fetched in one background pipeline
+        self.async_database = None
+        self.catalog_loader = CatalogLoader()
+        self.catalog_loader.loaded.connect(self.fill_table_comboboxes)
+        self.catalog_loader.failed.connect(lambda message: self.display_error(f"Error connecting to the database: {message}"))
+        if async_db.available():
+            self.async_database = async_db.AsyncDatabase()
+            self.async_database.submit(self.async_database.load_catalog()).add_done_callback(self.catalog_loader.deliver)
+        else:
+            self.populate_table_comboboxes()
+        self.comboBox_output.addItems([OUTPUT_MEMORY, OUTPUT_GEOPACKAGE, OUTPUT_POSTGIS, OUTPUT_ARROW,
+                                       OUTPUT_MBTILES])
+        # Road graphs by (path, modification time, speed field, speed); loading one is the slow part
+        self.road_graphs = {}
 
         # Connect the city layer combo box to update population field combo box
         self.comboBox_cityLayer.currentIndexChanged.connect(self.update_population_fields)
 
         # Connect the execute button to calculate the required schools
         self.button_execute.clicked.connect(self.determine_needed_schools)
+        self.button_batch.clicked.connect(self.run_batch)
+        self.button_exportSnapshot.clicked.connect(self.export_snapshot)
+        self.button_snapshotRun.clicked.connect(self.run_snapshot)
+        self.button_checkTables.clicked.connect(self.check_tables)
 
     def connect_to_database(self):
         """Establish a connection to the PostgreSQL database."""
-        return psycopg2.connect(database="analysis", user="postgres", password="Munthali56@", host="localhost", port="5432")
+        return connect()
+
+    def create_result_sink(self, connection=None, fields=RESULT_FIELDS, layer_name="Needed Schools", suffix=None):
+        """Create the output sink chosen in the dialog; ``suffix`` distinguishes per-region PostGIS tables.
+
+        Without ``connection`` a PostGIS sink writes over a connection of its
+        own, independent of the transaction used for reading.
+        """
+        output = self.comboBox_output.currentText()
+        target = self.lineEdit_outputTarget.text().strip()
+        if output == OUTPUT_MEMORY:
+            return MemorySink(fields, layer_name)
+        if not target:
+            raise ValueError(f"Please enter a destination for the {output} output.")
+        if output == OUTPUT_GEOPACKAGE:
+            if not target.lower().endswith(".gpkg"):
+                target += ".gpkg"
+            return GeoPackageSink(fields, target, layer_name)
+        if suffix:
+            suffix = re.sub(r'[^0-9A-Za-z]+', '_', suffix).strip('_').lower()
+        if output == OUTPUT_ARROW:
+            base, extension = os.path.splitext(target)
+            if extension.lower() not in ARROW_EXTENSIONS:
+                base, extension = target, ".parquet"
+            # Every layer of a run goes to a file of its own
+            return ArrowSink(fields, f"{base}_{suffix}{extension}" if suffix else base + extension, layer_name)
+        if output == OUTPUT_MBTILES:
+            base = target[:-len(".mbtiles")] if target.lower().endswith(".mbtiles") else target
+            return MBTilesSink(fields, f"{base}_{suffix}.mbtiles" if suffix else base + ".mbtiles", *tile_settings(),
+                               layer_name=layer_name)
+        if suffix:
+            target = f"{target}_{suffix}"
+        if connection is None:
+            return PostgisSink(fields, self.connect_to_database(), target, layer_name=layer_name, owns_connection=True)
+        return PostgisSink(fields, connection, target, layer_name=layer_name)
+
+    def road_graph(self, network):
+        """The ``RoadGraph`` of the configured road layer, loaded once per file version."""
+        path = network["path"]
+        source = path.split("|")[0]
+        key = (path, os.path.getmtime(source) if os.path.exists(source) else None, network["speed_field"],
+               network["speed"])
+        if key not in self.road_graphs:
+            graph = load_roads(path, network["speed_field"], network["speed"])
+            log_message(f"Road network: {len(graph)} nodes, {graph.edge_count} directed edges.")
+            self.road_graphs = {key: graph}
+        return self.road_graphs[key]
+
+    def close_connections(self):
+        """Stop the background database thread, if one is running."""
+        if self.async_database is not None:
+            self.async_database.close()
+            self.async_database = None
 
     def populate_table_comboboxes(self):
         """Populate the combo boxes with available tables from the database."""
         try:
             connection = self.connect_to_database()
             cursor = connection.cursor()
-            cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-            table_names = [row[0] for row in cursor.fetchall()]
-
-            # Clear existing items in the combo boxes
-            self.comboBox_cityLayer.clear()
-            self.comboBox_schoolsLayer.clear()
-
-            # Add placeholder text to combo boxes
-            self.comboBox_cityLayer.addItem("Select a population layer")
-            self.comboBox_schoolsLayer.addItem("Select school (point) layer")
-
-            # Add available table names to each combo box
-            self.comboBox_cityLayer.addItems(table_names)
-            self.comboBox_schoolsLayer.addItems(table_names)
+            table_names = metadata_cache.tables(cursor)
+            self.fill_table_comboboxes(table_names)
 
             cursor.close()
             connection.close()
         except (Exception, psycopg2.DatabaseError) as error:
             self.display_error(f"Error connecting to the database: {error}")
 
+    def fill_table_comboboxes(self, table_names):
+        """Show ``table_names`` in the population and schools combo boxes."""
+        # Clear existing items in the combo boxes
+        self.comboBox_cityLayer.clear()
+        self.comboBox_schoolsLayer.clear()
+
+        # Add placeholder text to combo boxes
+        self.comboBox_cityLayer.addItem("Select a population layer")
+        self.comboBox_schoolsLayer.addItem("Select school (point) layer")
+
+        # Add available table names to each combo box
+        self.comboBox_cityLayer.addItems(table_names)
+        self.comboBox_schoolsLayer.addItems(table_names)
+        self.refresh_project_layers()
+
+    def showEvent(self, event):
+        """Offer the layers in the project as it is now; the dialog is kept between runs."""
+        self.refresh_project_layers()
+        super().showEvent(event)
+
+    def refresh_project_layers(self):
+        """Replace the project layer entries of the combo boxes, keyed by layer id, keeping the selection."""
+        layers = [layer for layer in QgsProject.instance().mapLayers().values()
+                  if isinstance(layer, QgsVectorLayer) and layer.isSpatial()]
+        population_selection = self.comboBox_cityLayer.currentText()
+        for combo_box, geometry_type in ((self.comboBox_cityLayer, QgsWkbTypes.PolygonGeometry),
+                                         (self.comboBox_schoolsLayer, QgsWkbTypes.PointGeometry)):
+            selected = combo_box.currentData()
+            combo_box.blockSignals(True)
+            for index in reversed(range(combo_box.count())):
+                if combo_box.itemData(index) is not None:
+                    combo_box.removeItem(index)
+            for layer in layers:
+                if layer.geometryType() == geometry_type:
+                    combo_box.addItem(f"{layer.name()} {PROJECT_LAYER_SUFFIX}", layer.id())
+            if selected is not None:
+                combo_box.setCurrentIndex(max(combo_box.findData(selected), 0))
+            combo_box.blockSignals(False)
+        # A population layer removed from the project leaves its fields behind otherwise
+        if self.comboBox_cityLayer.currentText() != population_selection:
+            self.update_population_fields()
+
+    def selects_project_layer(self):
+        """Whether a project layer rather than a database table is selected."""
+        return self.comboBox_cityLayer.currentData() is not None or self.comboBox_schoolsLayer.currentData() is not None
+
+    def project_layer(self, combo_box):
+        """The project layer selected in ``combo_box``, or None for a database table."""
+        layer_id = combo_box.currentData()
+        if layer_id is None:
+            return None
+        layer = QgsProject.instance().mapLayer(layer_id)
+        if layer is None:
+            raise ValueError(f"Layer {combo_box.currentText()} is no longer in the project")
+        return layer
+
     def update_population_fields(self):
         """Populate the population fields combo box based on the selected population layer."""
         try:
             self.comboBox_populationField.clear()
             self.comboBox_populationField.addItem("Select a population field")
+            self.comboBox_labelField.clear()
+            self.comboBox_labelField.addItem("Select a label field")
 
             population_layer_name = self.comboBox_cityLayer.currentText()
-            print(f"Selected Population Layer: {population_layer_name}")  # Debug statement
+            log_message(f"Selected Population Layer: {population_layer_name}")
 
             if population_layer_name != "Select a population layer":
-                connection = self.connect_to_database()
-                cursor = connection.cursor()
-                cursor.execute(sql.SQL("SELECT column_name FROM information_schema.columns WHERE table_name = %s"), [population_layer_name])
-                field_names = [row[0] for row in cursor.fetchall()]
-                print(f"Available Fields: {field_names}")  # Debug statement
+                population_layer = self.project_layer(self.comboBox_cityLayer)
+                if population_layer is not None:
+                    field_names = population_layer.fields().names()
+                elif metadata_cache.is_loaded([population_layer_name]):
+                    field_names = metadata_cache.columns(None, population_layer_name)
+                else:
+                    connection = self.connect_to_database()
+                    cursor = connection.cursor()
+                    field_names = metadata_cache.columns(cursor, population_layer_name)
+                    cursor.close()
+                    connection.close()
+                log_message(f"Available Fields: {field_names}")
                 self.comboBox_populationField.addItems(field_names)
-
-                cursor.close()
-                connection.close()
+                self.comboBox_labelField.addItems(field_names)
+                if DEFAULT_LABEL_COLUMN in field_names:
+                    self.comboBox_labelField.setCurrentText(DEFAULT_LABEL_COLUMN)
         except (Exception, psycopg2.DatabaseError) as error:
             self.display_error(f"Error retrieving population fields: {error}")
 
     def determine_needed_schools(self):
         """Calculate the required number of schools based on the population and students per school, and generate a QGIS layer with labels."""
+        trace = RunTrace.from_settings()
         try:
             population_layer_name = self.comboBox_cityLayer.currentText()
             schools_layer_name = self.comboBox_schoolsLayer.currentText()
@@ -82,87 +254,356 @@ class NeededSchoolsDialog(QDialog, Ui_neededSchoolsDialog):
                 self.display_error("Please select both the population and school (point) layers.")
                 return
             
-            connection = self.connect_to_database()
-            cursor = connection.cursor()
-            
+            # Project layers are counted locally; the database is only needed for its tables
+            population_layer = self.project_layer(self.comboBox_cityLayer)
+            schools_layer = self.project_layer(self.comboBox_schoolsLayer)
+            local = population_layer is not None or schools_layer is not None
+            connection = cursor = None
+            if population_layer is None or schools_layer is None:
+                with trace.span("connect"):
+                    connection = self.connect_to_database()
+                    cursor = trace.cursor(connection.cursor())
+
             population_field = self.comboBox_populationField.currentText()
-            print(f"Selected Population Field: {population_field}")  # Debug statement
+            log_message(f"Selected Population Field: {population_field}")
 
             if population_field == "Select a population field":
                 self.display_error("Please select a population field.")
                 return
             
-            max_students_per_school = int(self.lineEdit_peoplePerSchool.text())
-
-            cursor.execute(sql.SQL("SELECT adm3_en, {population_field}, ST_AsText(geom) AS geom FROM {population_layer}").format(
-                population_field=sql.Identifier(population_field),
-                population_layer=sql.Identifier(population_layer_name)
-            ))
-
-            city_features = cursor.fetchall()
-
-            results_layer = QgsVectorLayer("Polygon?crs=EPSG:4326", "Needed Schools", "memory")
-            provider = results_layer.dataProvider()
-
-            provider.addAttributes([
-                QgsField("Location_Name", QVariant.String),
-                QgsField("Expected_Schools", QVariant.Int),
-                QgsField("current_number_of_schools", QVariant.Int),
-                QgsField("Schools_that_are_supposed_to_be_built", QVariant.Int),
-                QgsField("Label", QVariant.String)
-            ])
-            results_layer.updateFields()
-
-            features = []
-
-            for feature in city_features:
-                area_name = feature[0]
-                population = feature[1]
-                geom_wkt = feature[2]
-                geom = QgsGeometry.fromWkt(geom_wkt)  # Convert WKT to QgsGeometry
-
-                required_schools = round(population / max_students_per_school)
-                cursor.execute(sql.SQL("""
-                    SELECT COUNT(*) FROM {schools_layer}
-                    WHERE ST_Within(ST_Transform(geom, 4326), ST_GeomFromText(%s, 4326))
-                """).format(
-                    schools_layer=sql.Identifier(schools_layer_name)
-                ), [geom_wkt])
-                current_number_of_schools = cursor.fetchone()[0]
-                schools_that_are_supposed_to_be_built = max(0, round(required_schools - current_number_of_schools))
-
-                label_text = f"{area_name} = {schools_that_are_supposed_to_be_built}"
-
-                feat = QgsFeature()
-                feat.setGeometry(geom)
-                feat.setAttributes([area_name, required_schools, current_number_of_schools, schools_that_are_supposed_to_be_built, label_text])
-                features.append(feat)
-
-            provider.addFeatures(features)
+            label_field = self.comboBox_labelField.currentText()
+            if label_field == "Select a label field":
+                label_field = None
+
+            if local:
+                population_layer = population_layer or database_layer(cursor, population_layer_name)
+                schools_layer = schools_layer or database_layer(cursor, schools_layer_name)
+                population_layer_name, schools_layer_name = population_layer.name(), schools_layer.name()
+            job = AnalysisJob(population_layer_name, schools_layer_name, population_field,
+                              self.lineEdit_peoplePerSchool.text(), label_column=label_field,
+                              categories=CategoryBreakdown.from_settings())
+            fields = RESULT_FIELDS + job.categories.fields() if job.categories is not None else RESULT_FIELDS
+            sink = self.create_result_sink(fields=fields)
+
+            # Later stages work on the collected result table; parent admin
+            # levels are rolled up from the finest level's rows
+            rollup_columns = rollup_columns_from_settings()
+            if rollup_columns and local:
+                log_message("Roll-ups read parent columns from the database; skipped for project layers.")
+                rollup_columns = []
+            # Roll-ups, demand points and the coverage grid read the area polygons, so those are kept too
+            cell_size, mask_path = demand_settings()
+            coverage_cell, coverage_distance = coverage_settings()
+            target = ResultCollector(sink, keep_geometries=bool(rollup_columns) or cell_size > 0 or coverage_cell > 0)
+
+            # Invalid area polygons are repaired once and the repairs reused by later runs
+            if not local and check_enabled():
+                with trace.span("check geometries"):
+                    population_table, invalid = valid_table(cursor, job.population_table)
+                    connection.commit()
+                if invalid:
+                    log_message(f"{invalid} invalid area(s) of {job.population_table} were repaired with ST_MakeValid.")
+                    job = job.copy(population_table=population_table)
+
+            # Near-duplicate school records are merged; counting uses one canonical school per cluster
+            tolerance, name_column, name_similarity = dedup_settings()
+            duplicates = canonical_ids = None
+            if tolerance > 0:
+                with trace.span("deduplicate schools"):
+                    registry = layer_registry(schools_layer, name_column) if local \
+                        else fetch_registry(cursor, job, name_column)
+                    registry.cluster(tolerance, name_similarity)
+                    if local:
+                        canonical_ids = registry.canonical()
+                    else:
+                        job = job.copy(schools_table=write_canonical_table(cursor, job, registry.canonical()))
+                        connection.commit()
+                    duplicates = registry.review_layer(f"Duplicate schools - {schools_layer_name}")
+                log_message(f"{registry.duplicate_count()} of {len(registry)} school record(s) are duplicates "
+                            f"within {tolerance:g} m; see the duplicate schools layer.")
+
+            failed_tiles = []
+            if local:
+                if self.checkBox_tiled.isChecked():
+                    log_message("Project layers are counted in one pass; tiling applies to database tables only.")
+                table = compute_from_layers(population_layer, schools_layer, job, trace, canonical_ids)
+                with trace.span("write results"):
+                    target.write_table(table)
+            elif self.checkBox_tiled.isChecked():
+                with trace.span("plan tiles"):
+                    tiles = plan_tiles(cursor, job)
+                checkpoint = TileCheckpoint.for_run(job, tiles)
+                failed_tiles = run_tiled(cursor, job, target, trace, tiles, checkpoint)
+                if not failed_tiles:
+                    checkpoint.remove()
+            else:
+                table = compute_needed_schools(cursor, job, trace)
+                with trace.span("write results"):
+                    target.write_table(table)
+
+            with trace.span("write results"):
+                sink.close()
+            sinks = [sink]
+            results = target.table()
+
+            if rollup_columns and results is not None:
+                with trace.span("roll up"):
+                    parent_ids = fetch_parent_ids(cursor, job, rollup_columns)
+                    sinks += write_levels(
+                        results, parent_ids, rollup_columns, job.students_per_school,
+                        lambda fields, layer_name: self.create_result_sink(None, fields, layer_name, layer_name)
+                    )
+
+            # Demand points are cached per table and cell size, so only the first run builds them
+            demand = points = None
+            if cell_size > 0 and results is not None:
+                with trace.span("demand points"):
+                    points = demand_points(results, job.population_table, cell_size, mask_path)
+                    demand = demand_layer(points, results.population, f"Demand points - {job.name}")
+
+            # School points for the distance-based outputs
+            network = network_settings()
+            if (coverage_cell > 0 or network["path"]) and results is not None:
+                with trace.span("fetch schools"):
+                    if local:
+                        school_x, school_y = layer_school_points(schools_layer, canonical_ids)
+                    else:
+                        school_x, school_y = fetch_school_points(cursor, job)
+
+            # Distance to the nearest school over a grid, weighted by the demand points
+            coverage = None
+            if coverage_cell > 0 and results is not None:
+                with trace.span("coverage raster"):
+                    if cell_size != coverage_cell:
+                        points = demand_points(results, job.population_table, coverage_cell, mask_path)
+                    raster_path, underserved = build_coverage(results, points, school_x, school_y, coverage_cell,
+                                                              coverage_distance, job.name)
+                    coverage = coverage_layer(raster_path, f"Underserved population - {job.name}")
+                log_message(f"{underserved:.0f} people live farther than {coverage_distance:g} m from a school.")
+
+            # Travel time to the nearest school along the roads, from demand or label points
+            if network["path"] and results is not None:
+                with trace.span("network access"):
+                    graph = self.road_graph(network)
+                    if points is None:
+                        points = label_points(results)
+                    served, unserved = area_access(
+                        graph, points, points.population(results.population), len(results), school_x, school_y,
+                        network["speed"], network["max_minutes"], network["snap_distance"]
+                    )
+                    join_csv(sink.layer, write_access(results, served, unserved, sink.layer.name()), "network access")
+                log_message(f"{served.sum():.0f} people live within {network['max_minutes']:g} minutes of a school "
+                            f"along the roads, {unserved.sum():.0f} farther.")
+
+            # Counts on past dates from the schools' opening and closing dates, in one spatial join
+            open_column, close_column, as_of_dates = as_of_settings()
+            if as_of_dates and (open_column or close_column) and results is not None:
+                if local:
+                    log_message("As-of counts read the schools' dates from the database; skipped for project layers.")
+                else:
+                    with trace.span("as-of counts"):
+                        intervals = SchoolIntervals.from_rows(fetch_intervals(cursor, job, open_column, close_column),
+                                                              results.area_ids.tolist())
+                        columns = as_of_columns(results, intervals, as_of_dates)
+                        join_csv(sink.layer, write_as_of(results, columns, sink.layer.name()), "as of")
+
+            if connection is not None:
+                cursor.close()
+                connection.close()
+
+            # Growth scenarios are projected from the collected base arrays, without further queries
+            scenarios = ScenarioMatrix.from_settings(job.students_per_school)
+            if scenarios is not None and results is not None:
+                with trace.span("scenarios"):
+                    join_scenarios(sink.layer, write_scenarios(results, scenarios, sink.layer.name()))
+
+            # Shortfall percentiles from sampled population and capacity around the collected arrays
+            population_sd, capacity_sd, samples, seed = uncertainty_settings()
+            if (population_sd > 0 or capacity_sd > 0) and results is not None:
+                with trace.span("uncertainty"):
+                    bands = shortfall_bands(results.population, results.existing, job.students_per_school,
+                                            population_sd, capacity_sd, samples, seed)
+                    join_csv(sink.layer, write_bands(results, bands, sink.layer.name()), "uncertainty")
+                log_message("Total shortfall over {} draws: {}.".format(samples, ", ".join(
+                    f"P{percentile} {value:.0f}" for percentile, value in zip(bands.percentiles, bands.total))))
+
+            # Configure labeling and symbology
+            with trace.span("rendering setup"):
+                for output in sinks:
+                    apply_rendering(output.layer, output.shortfalls)
+
+            with trace.span("add layer"):
+                for output in sinks:
+                    QgsProject.instance().addMapLayer(output.layer)
+                if demand is not None:
+                    QgsProject.instance().addMapLayer(demand)
+                if coverage is not None:
+                    QgsProject.instance().addMapLayer(coverage)
+                if duplicates is not None and duplicates.featureCount():
+                    QgsProject.instance().addMapLayer(duplicates)
+            trace.report()
+            if failed_tiles:
+                self.display_error(f"{len(failed_tiles)} of {len(tiles)} tile(s) failed and are missing from the results; "
+                                   "see the Needed Schools message log. Compute again to resume the remaining tiles.")
+                return
+            self.display_info("Required schools calculation completed and results layer with labels added to the QGIS project.")
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            trace.report()
+            self.display_error(f"Error during calculation: {error}")
+
+    def export_snapshot(self):
+        """Save the selected population and schools tables to a GeoPackage for offline runs."""
+        population_layer_name = self.comboBox_cityLayer.currentText()
+        schools_layer_name = self.comboBox_schoolsLayer.currentText()
+        population_field = self.comboBox_populationField.currentText()
+        if population_layer_name == "Select a population layer" or schools_layer_name == "Select school (point) layer" \
+                or population_field == "Select a population field":
+            self.display_error("Please select the population and school (point) layers and a population field.")
+            return
+        if self.selects_project_layer():
+            self.display_error("Snapshots are exported from database tables; project layers can be saved from QGIS directly.")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Save snapshot", f"{population_layer_name}.gpkg", "GeoPackage (*.gpkg)")
+        if not path:
+            return
+        label_field = self.comboBox_labelField.currentText()
+        if label_field == "Select a label field":
+            label_field = None
+
+        trace = RunTrace.from_settings()
+        try:
+            job = AnalysisJob(population_layer_name, schools_layer_name, population_field,
+                              self.lineEdit_peoplePerSchool.text(), label_column=label_field)
+            connection = self.connect_to_database()
+            try:
+                areas = export_snapshot(trace.cursor(connection.cursor()), job, path, trace)
+            finally:
+                connection.close()
+            trace.report()
+            self.display_info(f"Snapshot of {areas} area(s) saved to {path}.")
+        except (Exception, psycopg2.DatabaseError) as error:
+            trace.report()
+            self.display_error(f"Error exporting the snapshot: {error}")
+
+    def run_snapshot(self):
+        """Compute needed schools from a snapshot file, without a database connection."""
+        path, _ = QFileDialog.getOpenFileName(self, "Select snapshot", "", "GeoPackage (*.gpkg)")
+        if not path:
+            return
+        trace = RunTrace.from_settings()
+        try:
+            job = snapshot_job(path, self.lineEdit_peoplePerSchool.text())
+            table = compute_from_snapshot(path, job, trace)
+            sink = self.create_result_sink(layer_name=f"Needed Schools - {job.name} (snapshot)")
+            with trace.span("write results"):
+                sink.write_table(table)
+                sink.close()
+
+            scenarios = ScenarioMatrix.from_settings(job.students_per_school)
+            if scenarios is not None:
+                with trace.span("scenarios"):
+                    join_scenarios(sink.layer, write_scenarios(table, scenarios, sink.layer.name()))
+
+            with trace.span("rendering setup"):
+                apply_rendering(sink.layer, sink.shortfalls)
+            QgsProject.instance().addMapLayer(sink.layer)
+            trace.report()
+            self.display_info("Required schools calculated from the snapshot and the results layer added to the QGIS project.")
+        except (Exception, psycopg2.DatabaseError) as error:
+            trace.report()
+            self.display_error(f"Error computing from the snapshot: {error}")
+
+    def check_tables(self):
+        """Report missing indexes and stale statistics of the selected tables and offer to fix them."""
+        population_layer_name = self.comboBox_cityLayer.currentText()
+        schools_layer_name = self.comboBox_schoolsLayer.currentText()
+        if population_layer_name == "Select a population layer" or schools_layer_name == "Select school (point) layer":
+            self.display_error("Please select both the population and school (point) layers.")
+            return
+        if self.selects_project_layer():
+            self.display_error("Only database tables can be checked.")
+            return
+        connection = None
+        try:
+            connection = self.connect_to_database()
+            cursor = connection.cursor()
+            recommendations = []
+            for table in dict.fromkeys([schools_layer_name, population_layer_name]):
+                recommendations += inspect_table(cursor, table).recommendations()
+            connection.rollback()
+            if not recommendations:
+                self.display_info("Both tables have spatial indexes and current statistics.")
+                return
+
+            report = "\n".join(f"- {recommendation.reason}" for recommendation in recommendations)
+            fixes = [recommendation for recommendation in recommendations if recommendation.statement is not None]
+            log_message(f"Table check:\n{report}")
+            if not fixes:
+                self.display_info(report)
+                return
+            from PyQt5.QtWidgets import QMessageBox
+            answer = QMessageBox.question(self, "Table check", f"{report}\n\nApply the {len(fixes)} fix(es) now?")
+            if answer != QMessageBox.Yes:
+                return
 
+            # The counting query's plan shows the effect; it needs a population field to be built
+            population_field = self.comboBox_populationField.currentText()
+            job = None
+            if population_field != "Select a population field":
+                job = AnalysisJob(population_layer_name, schools_layer_name, population_field,
+                                  self.lineEdit_peoplePerSchool.text() or 1)
+                before = summarize_plan(explain_count(cursor, job))
+                connection.rollback()
+            applied = apply_recommendations(connection, fixes)
+            message = f"Applied {applied} fix(es)."
+            if job is not None:
+                after = summarize_plan(explain_count(cursor, job))
+                connection.rollback()
+                message += "\n\nCounting query plan:\n" + format_comparison(before, after)
             cursor.close()
-            connection.close()
+            log_message(message)
+            self.display_info(message)
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.display_error(f"Error checking the tables: {error}")
+        finally:
+            if connection is not None:
+                connection.close()
 
-            # Configure labeling
-            label_settings = QgsPalLayerSettings()
-            label_settings.fieldName = "Label"
-            label_settings.placement = QgsPalLayerSettings.AroundPoint
-            label_settings.enabled = True
+    def run_batch(self):
+        """Run every job listed in a CSV batch file and add the output layers."""
+        path, _ = QFileDialog.getOpenFileName(self, "Select batch job file", "", "CSV files (*.csv)")
+        if not path:
+            return
+        runner = None
+        connection = None
+        try:
+            jobs = load_jobs_csv(path)
+            connection = self.connect_to_database()
+            per_region = self.checkBox_perRegion.isChecked()
 
-            text_format = QgsTextFormat()
-            text_format.setFont(QFont("Arial", 10))
-            text_format.setSize(10)
-            label_settings.setFormat(text_format)
+            def sink_factory(fields, layer_name, region):
+                return self.create_result_sink(connection, fields, layer_name, region)
 
-            results_layer.setLabelsEnabled(True)
-            results_layer.setLabeling(QgsVectorLayerSimpleLabeling(label_settings))
-            results_layer.triggerRepaint()
+            def progress(finished, total, result):
+                log_message(f"Batch progress: {finished}/{total} ({result.job.name})")
 
-            QgsProject.instance().addMapLayer(results_layer)
-            self.display_info("Required schools calculation completed and results layer with labels added to the QGIS project.")
+            runner = BatchRunner(async_database=self.async_database)
+            sinks, results = runner.run(jobs, sink_factory, per_region, progress)
+            for sink in sinks:
+                apply_rendering(sink.layer, sink.shortfalls)
+                QgsProject.instance().addMapLayer(sink.layer)
 
+            failed = sum(1 for result in results if result.error is not None)
+            self.display_info(f"Batch completed: {len(results) - failed} of {len(results)} job(s) succeeded. "
+                              "See the Needed Schools message log for details.")
         except (Exception, psycopg2.DatabaseError) as error:
-            self.display_error(f"Error during calculation: {error}")
+            self.display_error(f"Error during batch run: {error}")
+        finally:
+            if runner is not None:
+                runner.close()
+            if connection is not None:
+                connection.close()
 
     def display_error(self, message):
         """Show an error message to the user."""
@@ -31,17 +31,47 @@ class Ui_neededSchoolsDialog(object):
         self.label_population.setGeometry(QtCore.QRect(10, 50, 101, 20))
         self.label_population.setObjectName("label_population")
         self.comboBox_populationField = QtWidgets.QComboBox(neededSchoolsDialog)
-        self.comboBox_populationField.setGeometry(QtCore.QRect(120, 50, 380, 25))
+        self.comboBox_populationField.setGeometry(QtCore.QRect(120, 50, 185, 25))
         self.comboBox_populationField.setObjectName("comboBox_populationField")
+        self.comboBox_labelField = QtWidgets.QComboBox(neededSchoolsDialog)
+        self.comboBox_labelField.setGeometry(QtCore.QRect(315, 50, 185, 25))
+        self.comboBox_labelField.setObjectName("comboBox_labelField")
         self.label_peoplePerSchool = QtWidgets.QLabel(neededSchoolsDialog)
         self.label_peoplePerSchool.setGeometry(QtCore.QRect(10, 130, 101, 20))
         self.label_peoplePerSchool.setObjectName("label_peoplePerSchool")
         self.lineEdit_peoplePerSchool = QtWidgets.QLineEdit(neededSchoolsDialog)
         self.lineEdit_peoplePerSchool.setGeometry(QtCore.QRect(120, 130, 381, 25))
         self.lineEdit_peoplePerSchool.setObjectName("lineEdit_peoplePerSchool")
+        self.label_output = QtWidgets.QLabel(neededSchoolsDialog)
+        self.label_output.setGeometry(QtCore.QRect(10, 170, 101, 20))
+        self.label_output.setObjectName("label_output")
+        self.comboBox_output = QtWidgets.QComboBox(neededSchoolsDialog)
+        self.comboBox_output.setGeometry(QtCore.QRect(120, 170, 120, 25))
+        self.comboBox_output.setObjectName("comboBox_output")
+        self.lineEdit_outputTarget = QtWidgets.QLineEdit(neededSchoolsDialog)
+        self.lineEdit_outputTarget.setGeometry(QtCore.QRect(250, 170, 251, 25))
+        self.lineEdit_outputTarget.setObjectName("lineEdit_outputTarget")
+        self.checkBox_perRegion = QtWidgets.QCheckBox(neededSchoolsDialog)
+        self.checkBox_perRegion.setGeometry(QtCore.QRect(120, 220, 160, 20))
+        self.checkBox_perRegion.setObjectName("checkBox_perRegion")
+        self.checkBox_tiled = QtWidgets.QCheckBox(neededSchoolsDialog)
+        self.checkBox_tiled.setGeometry(QtCore.QRect(120, 250, 200, 20))
+        self.checkBox_tiled.setObjectName("checkBox_tiled")
+        self.button_batch = QtWidgets.QPushButton(neededSchoolsDialog)
+        self.button_batch.setGeometry(QtCore.QRect(290, 215, 100, 30))
+        self.button_batch.setObjectName("button_batch")
         self.button_execute = QtWidgets.QPushButton(neededSchoolsDialog)
-        self.button_execute.setGeometry(QtCore.QRect(400, 180, 100, 30))
+        self.button_execute.setGeometry(QtCore.QRect(400, 215, 100, 30))
         self.button_execute.setObjectName("button_execute")
+        self.button_exportSnapshot = QtWidgets.QPushButton(neededSchoolsDialog)
+        self.button_exportSnapshot.setGeometry(QtCore.QRect(515, 10, 115, 30))
+        self.button_exportSnapshot.setObjectName("button_exportSnapshot")
+        self.button_snapshotRun = QtWidgets.QPushButton(neededSchoolsDialog)
+        self.button_snapshotRun.setGeometry(QtCore.QRect(515, 50, 115, 30))
+        self.button_snapshotRun.setObjectName("button_snapshotRun")
+        self.button_checkTables = QtWidgets.QPushButton(neededSchoolsDialog)
+        self.button_checkTables.setGeometry(QtCore.QRect(515, 90, 115, 30))
+        self.button_checkTables.setObjectName("button_checkTables")
 
         self.retranslateUi(neededSchoolsDialog)
         QtCore.QMetaObject.connectSlotsByName(neededSchoolsDialog)
@@ -54,4 +84,17 @@ class Ui_neededSchoolsDialog(object):
         self.label_peoplePerSchool.setText(_translate("neededSchoolsDialog", "Max # of Students"))
         self.lineEdit_peoplePerSchool.setInputMask(_translate("neededSchoolsDialog", "99999"))
         self.lineEdit_peoplePerSchool.setText(_translate("neededSchoolsDialog", "00"))
+        self.comboBox_labelField.setToolTip(_translate("neededSchoolsDialog", "Column used to name each area"))
+        self.label_output.setText(_translate("neededSchoolsDialog", "Output"))
+        self.lineEdit_outputTarget.setPlaceholderText(_translate("neededSchoolsDialog", "GeoPackage, PostGIS table or Parquet file"))
+        self.checkBox_perRegion.setText(_translate("neededSchoolsDialog", "One layer per region"))
+        self.checkBox_tiled.setToolTip(_translate("neededSchoolsDialog", "Compute tile by tile and resume an interrupted run"))
+        self.checkBox_tiled.setText(_translate("neededSchoolsDialog", "Tiled, resumable run"))
+        self.button_batch.setText(_translate("neededSchoolsDialog", "Batch..."))
         self.button_execute.setText(_translate("neededSchoolsDialog", "Compute"))
+        self.button_exportSnapshot.setToolTip(_translate("neededSchoolsDialog", "Save the selected tables to a GeoPackage for offline runs"))
+        self.button_exportSnapshot.setText(_translate("neededSchoolsDialog", "Export snapshot..."))
+        self.button_snapshotRun.setToolTip(_translate("neededSchoolsDialog", "Compute from a snapshot without a database connection"))
+        self.button_snapshotRun.setText(_translate("neededSchoolsDialog", "From snapshot..."))
+        self.button_checkTables.setToolTip(_translate("neededSchoolsDialog", "Check spatial indexes and statistics of the selected tables"))
+        self.button_checkTables.setText(_translate("neededSchoolsDialog", "Check tables..."))
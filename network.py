@@ -0,0 +1,318 @@
+"""Travel-time access to schools over a road network.
+
+Straight-line containment ignores rivers and hills; here access is measured
+along the roads instead.  A local road layer is read once into a compact
+graph in CSR form (one offsets array and flat neighbour and travel-time
+arrays), school and demand points are snapped to their nearest road node,
+and a single multi-source Dijkstra from every school gives the travel time
+to the nearest school for every node.  Demand points reached within the
+time limit count as served, the rest as unserved, summed per area.
+
+SciPy's compiled ``csgraph`` and ``cKDTree`` are used when QGIS ships them;
+otherwise the same search runs on the CSR arrays with ``heapq``.
+"""
+import functools
+import heapq
+import importlib.util
+import math
+import struct
+
+import numpy as np
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsFeatureRequest, QgsProject, QgsSettings, QgsVectorLayer
+)
+
+from .demand import METRES_PER_DEGREE, DemandPoints
+from .output_sinks import output_directory, write_area_csv
+
+SETTING_ROADS = "needed_schools/network_roads"
+SETTING_SPEED_FIELD = "needed_schools/network_speed_field"
+SETTING_SPEED = "needed_schools/network_speed"
+SETTING_MAX_MINUTES = "needed_schools/network_max_minutes"
+SETTING_SNAP_DISTANCE = "needed_schools/network_snap_distance"
+SETTING_OUTPUT_DIR = "needed_schools/network_output_dir"
+# Walking speed in km/h, used off the roads and on roads without a speed
+DEFAULT_SPEED = 5.0
+DEFAULT_MAX_MINUTES = 60.0
+DEFAULT_SNAP_DISTANCE = 1000.0
+# Vertices closer than this many degrees (about a centimetre) are one node
+NODE_TOLERANCE = 1e-7
+
+SERVED_FIELD = "Served_Population"
+UNSERVED_FIELD = "Unserved_Population"
+
+_LINESTRING, _MULTILINESTRING = 2, 5
+
+
+def scipy_available():
+    return importlib.util.find_spec("scipy") is not None
+
+
+@functools.lru_cache(maxsize=None)
+def _scipy():
+    # SciPy is slow to import; only network runs load it
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+    from scipy.spatial import cKDTree
+    return csr_matrix, dijkstra, cKDTree
+
+
+def wkb_lines(wkb):
+    """Parts of a (multi)linestring in WKB, as ``(n, 2)`` float arrays; Z/M values are dropped."""
+    lines = []
+
+    def read(offset):
+        byte_order = "<" if wkb[offset] == 1 else ">"
+        (geometry_type,) = struct.unpack_from(byte_order + "I", wkb, offset + 1)
+        dimensions = (2, 3, 3, 4)[geometry_type // 1000]
+        base_type = geometry_type % 1000
+        offset += 5
+        (count,) = struct.unpack_from(byte_order + "I", wkb, offset)
+        offset += 4
+        if base_type == _MULTILINESTRING:
+            for _ in range(count):
+                offset = read(offset)
+        elif base_type == _LINESTRING:
+            coordinates = np.frombuffer(wkb, np.dtype(np.float64).newbyteorder(byte_order), count * dimensions, offset)
+            lines.append(coordinates.reshape(count, dimensions)[:, :2].astype(np.float64))
+            offset += count * dimensions * 8
+        else:
+            raise ValueError(f"Road networks need line geometries, not WKB type {geometry_type}")
+        return offset
+
+    read(0)
+    return lines
+
+
+class RoadGraph:
+    """Directed road graph in CSR form, with node coordinates in EPSG:4326.
+
+    The edges leaving node ``n`` are ``indices[indptr[n]:indptr[n + 1]]``,
+    with travel times in seconds in the same slice of ``seconds``.
+    """
+
+    def __init__(self, x, y, indptr, indices, seconds):
+        self.x = x
+        self.y = y
+        self.indptr = indptr
+        self.indices = indices
+        self.seconds = seconds
+        self.latitude = float(np.mean(y)) if len(y) else 0.0
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_lines(cls, lines, speeds):
+        """Build the graph of ``lines`` travelled both ways at ``speeds`` km/h, one per line.
+
+        Vertices shared by several lines, up to ``NODE_TOLERANCE``, become one
+        node, so lines that meet at a vertex are connected.
+        """
+        if not lines:
+            empty = np.zeros(0)
+            return cls(empty, empty, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), empty)
+        counts = np.array([len(line) for line in lines])
+        coordinates = np.concatenate(lines)
+        quantized = np.rint(coordinates / NODE_TOLERANCE).astype(np.int64)
+        keys = quantized[:, 0] * (1 << 31) + (quantized[:, 1] + (1 << 30))
+        unique_keys, first, nodes = np.unique(keys, return_index=True, return_inverse=True)
+        x, y = coordinates[first, 0], coordinates[first, 1]
+
+        # Consecutive vertices of the same line are edges
+        line_of = np.repeat(np.arange(len(lines)), counts)
+        same_line = line_of[:-1] == line_of[1:]
+        source, target = nodes[:-1][same_line], nodes[1:][same_line]
+        metres_x = METRES_PER_DEGREE * math.cos(math.radians(float(np.mean(y))))
+        length = np.hypot((x[target] - x[source]) * metres_x, (y[target] - y[source]) * METRES_PER_DEGREE)
+        seconds = length / (np.asarray(speeds, dtype=np.float64)[line_of[:-1][same_line]] / 3.6)
+        keep = source != target
+        source, target, seconds = source[keep], target[keep], seconds[keep]
+
+        source, target = np.concatenate([source, target]), np.concatenate([target, source])
+        seconds = np.concatenate([seconds, seconds])
+        order = np.argsort(source, kind="stable")
+        indptr = np.zeros(len(unique_keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=len(unique_keys)), out=indptr[1:])
+        return cls(x, y, indptr, target[order].astype(np.int32), seconds[order])
+
+    def to_metres(self, x, y):
+        """Local equirectangular coordinates in metres around the graph's mean latitude."""
+        return (np.asarray(x) * METRES_PER_DEGREE * math.cos(math.radians(self.latitude)),
+                np.asarray(y) * METRES_PER_DEGREE)
+
+    def snap(self, x, y, max_distance):
+        """Nearest node of every point and its distance in metres.
+
+        Points farther than ``max_distance`` from every node get node -1.
+        """
+        nodes_x, nodes_y = self.to_metres(self.x, self.y)
+        points_x, points_y = self.to_metres(x, y)
+        if len(self) == 0:
+            return np.full(len(points_x), -1, dtype=np.int64), np.full(len(points_x), np.inf)
+        if scipy_available():
+            _, _, cKDTree = _scipy()
+            distance, node = cKDTree(np.column_stack([nodes_x, nodes_y])).query(
+                np.column_stack([points_x, points_y]), distance_upper_bound=max_distance)
+            node = np.where(np.isfinite(distance), node, -1).astype(np.int64)
+            return node, distance
+        return _snap_grid(nodes_x, nodes_y, points_x, points_y, max_distance)
+
+    def travel_times(self, sources, offsets, limit=np.inf):
+        """Seconds from the nearest source to every node, starting each source at its offset.
+
+        Nodes not reached within ``limit`` seconds are ``inf``.
+        """
+        times = np.full(len(self), np.inf)
+        if len(sources) == 0:
+            return times
+        if scipy_available():
+            csr_matrix, dijkstra, _ = _scipy()
+            # One virtual node linked to every source turns the search into a single-source one
+            count = len(self)
+            indptr = np.concatenate([self.indptr, [self.indptr[-1] + len(sources)]])
+            indices = np.concatenate([self.indices, sources])
+            # csgraph treats stored zeros as missing edges
+            weights = np.concatenate([self.seconds, np.maximum(offsets, 1e-9)])
+            graph = csr_matrix((weights, indices, indptr), shape=(count + 1, count + 1))
+            return dijkstra(graph, directed=True, indices=count, limit=limit)[:count]
+        return _dijkstra(self.indptr, self.indices, self.seconds, sources, offsets, limit, len(self))
+
+
+def _snap_grid(nodes_x, nodes_y, points_x, points_y, max_distance):
+    # Nodes bucketed in cells of max_distance: a node within reach is always in the 3 x 3 neighbourhood
+    cell = max(max_distance, 1e-9)
+    node_cells = np.floor(nodes_x / cell).astype(np.int64) * (1 << 32) + np.floor(nodes_y / cell).astype(np.int64)
+    order = np.argsort(node_cells, kind="stable")
+    sorted_cells = node_cells[order]
+    point_cx = np.floor(points_x / cell).astype(np.int64)
+    point_cy = np.floor(points_y / cell).astype(np.int64)
+    node = np.full(len(points_x), -1, dtype=np.int64)
+    distance = np.full(len(points_x), np.inf)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            wanted = (point_cx + dx) * (1 << 32) + point_cy + dy
+            starts = np.searchsorted(sorted_cells, wanted, side="left")
+            stops = np.searchsorted(sorted_cells, wanted, side="right")
+            for index in np.flatnonzero(stops > starts):
+                candidates = order[starts[index]:stops[index]]
+                gaps = np.hypot(nodes_x[candidates] - points_x[index], nodes_y[candidates] - points_y[index])
+                best = int(np.argmin(gaps))
+                if gaps[best] < distance[index]:
+                    distance[index] = gaps[best]
+                    node[index] = candidates[best]
+    unreachable = distance > max_distance
+    node[unreachable] = -1
+    distance[unreachable] = np.inf
+    return node, distance
+
+
+def _dijkstra(indptr, indices, seconds, sources, offsets, limit, count):
+    # Plain lists index much faster than NumPy scalars inside the loop
+    indptr, indices, seconds = indptr.tolist(), indices.tolist(), seconds.tolist()
+    times = [math.inf] * count
+    heap = []
+    for source, offset in zip(np.asarray(sources).tolist(), np.asarray(offsets, dtype=np.float64).tolist()):
+        if offset < times[source] and offset <= limit:
+            times[source] = offset
+            heap.append((offset, source))
+    heapq.heapify(heap)
+    while heap:
+        time, node = heapq.heappop(heap)
+        if time > times[node]:
+            continue
+        for edge in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[edge]
+            reached = time + seconds[edge]
+            if reached < times[neighbour] and reached <= limit:
+                times[neighbour] = reached
+                heapq.heappush(heap, (reached, neighbour))
+    return np.array(times)
+
+
+def load_roads(path, speed_field=None, default_speed=DEFAULT_SPEED):
+    """Read the road layer at ``path`` (any OGR source) into a ``RoadGraph``.
+
+    Speeds come from ``speed_field`` in km/h where it holds a positive
+    number, and ``default_speed`` elsewhere.
+    """
+    layer = QgsVectorLayer(path, "roads", "ogr")
+    if not layer.isValid():
+        raise ValueError(f"Could not load the road layer {path}")
+    request = QgsFeatureRequest()
+    request.setDestinationCrs(QgsCoordinateReferenceSystem("EPSG:4326"), QgsProject.instance().transformContext())
+    speed_index = layer.fields().lookupField(speed_field) if speed_field else -1
+    if speed_index >= 0:
+        request.setSubsetOfAttributes([speed_index])
+    else:
+        request.setNoAttributes()
+
+    lines, speeds = [], []
+    for feature in layer.getFeatures(request):
+        geometry = feature.geometry()
+        if geometry.isEmpty():
+            continue
+        speed = default_speed
+        if speed_index >= 0:
+            try:
+                speed = float(feature.attribute(speed_index)) or default_speed
+            except (TypeError, ValueError):
+                pass
+        for line in wkb_lines(bytes(geometry.asWkb())):
+            if len(line) > 1:
+                lines.append(line)
+                speeds.append(speed if speed > 0 else default_speed)
+    return RoadGraph.from_lines(lines, speeds)
+
+
+def area_access(graph, points, point_population, area_count, school_x, school_y, speed, max_minutes,
+                snap_distance):
+    """Served and unserved population per area.
+
+    School and demand points walk to their snapped node at ``speed`` km/h;
+    a point is served when the nearest school is at most ``max_minutes`` away.
+    """
+    limit = max_minutes * 60
+    metres_per_second = speed / 3.6
+    school_nodes, school_gaps = graph.snap(school_x, school_y, snap_distance)
+    snapped = school_nodes >= 0
+    times = graph.travel_times(school_nodes[snapped], school_gaps[snapped] / metres_per_second, limit)
+
+    point_nodes, point_gaps = graph.snap(points.x, points.y, snap_distance)
+    travel = np.full(len(points), np.inf)
+    on_network = point_nodes >= 0
+    travel[on_network] = times[point_nodes[on_network]] + point_gaps[on_network] / metres_per_second
+    served = travel <= limit
+    population = np.asarray(point_population, dtype=np.float64)
+    served_population = np.bincount(points.area_index, weights=np.where(served, population, 0), minlength=area_count)
+    total = np.bincount(points.area_index, weights=population, minlength=area_count)
+    return served_population, total - served_population
+
+
+def label_points(table):
+    """One demand point per area, at its label point, for runs without demand points."""
+    return DemandPoints(table.area_ids.tolist(), table.label_x, table.label_y, np.arange(len(table)),
+                        np.ones(len(table)))
+
+
+def network_settings():
+    """Road layer path and access parameters from the QGIS settings; no path means off."""
+    settings = QgsSettings()
+    return {
+        "path": settings.value(SETTING_ROADS, "", type=str) or None,
+        "speed_field": settings.value(SETTING_SPEED_FIELD, "", type=str) or None,
+        "speed": settings.value(SETTING_SPEED, DEFAULT_SPEED, type=float),
+        "max_minutes": settings.value(SETTING_MAX_MINUTES, DEFAULT_MAX_MINUTES, type=float),
+        "snap_distance": settings.value(SETTING_SNAP_DISTANCE, DEFAULT_SNAP_DISTANCE, type=float),
+    }
+
+
+def write_access(table, served, unserved, layer_name, directory=None):
+    """Write the served and unserved population of every area as CSV, returning its path."""
+    columns = {SERVED_FIELD: np.rint(served).astype(np.int64), UNSERVED_FIELD: np.rint(unserved).astype(np.int64)}
+    return write_area_csv(table.area_ids.tolist(), columns, "Integer", layer_name, "access",
+                          output_directory(SETTING_OUTPUT_DIR, "needed_schools_network", directory))
@@ -0,0 +1,422 @@
+"""Destinations for Needed Schools results.
+
+Every sink buffers rows and writes them in fixed-size batches, then returns a
+QGIS layer loaded from wherever the results were stored.  Rows reach
+``write_batch`` as ``(attributes, wkb)`` pairs; columnar result tables are
+only turned into rows one batch at a time.
+"""
+import csv
+import io
+import json
+import os
+import re
+import struct
+import tempfile
+
+from PyQt5.QtCore import QUrl, QVariant
+from qgis.core import QgsVectorLayer, QgsField, QgsFeature, QgsGeometry, QgsProject, QgsSettings, QgsVectorLayerJoinInfo
+from psycopg2 import sql
+
+from .database import layer_uri, metadata_cache
+
+AREA_ID_FIELD = "Area_Id"
+POPULATION_FIELD = "Population"
+EXPECTED_FIELD = "Expected_Schools"
+CURRENT_FIELD = "current_number_of_schools"
+SHORTFALL_FIELD = "Schools_that_are_supposed_to_be_built"
+LABEL_X_FIELD = "Label_X"
+LABEL_Y_FIELD = "Label_Y"
+
+# Attribute columns of the results layer, in output order
+RESULT_FIELDS = [
+    (AREA_ID_FIELD, QVariant.String),
+    ("Location_Name", QVariant.String),
+    (POPULATION_FIELD, QVariant.Double),
+    (EXPECTED_FIELD, QVariant.Int),
+    (CURRENT_FIELD, QVariant.Int),
+    (SHORTFALL_FIELD, QVariant.Int),
+    (LABEL_X_FIELD, QVariant.Double),
+    (LABEL_Y_FIELD, QVariant.Double),
+]
+
+
+BATCH_SIZE = 1000
+RESULTS_SRID = 4326
+RESULTS_TABLE_COMMENT = "Needed Schools results"
+
+# GeoParquet metadata; without a "crs" member readers assume OGC:CRS84, i.e. EPSG:4326 lon/lat
+GEOPARQUET_METADATA = {
+    "version": "1.0.0",
+    "primary_column": "geometry",
+    "columns": {"geometry": {"encoding": "WKB", "geometry_types": []}},
+}
+
+_POSTGRES_TYPES = {
+    QVariant.String: "text",
+    QVariant.Int: "integer",
+    QVariant.LongLong: "bigint",
+    QVariant.Double: "double precision",
+}
+
+
+class ResultSink:
+    """Base class that buffers results and hands them to ``write_batch``."""
+
+    def __init__(self, fields, layer_name="Needed Schools", batch_size=BATCH_SIZE):
+        self.fields = fields
+        self.layer_name = layer_name
+        self.batch_size = batch_size
+        self.written = 0
+        self.layer = None
+        self.shortfalls = []
+        self._pending = []
+        names = [name for name, _ in fields]
+        self._shortfall_index = names.index(SHORTFALL_FIELD) if SHORTFALL_FIELD in names else None
+
+    def add(self, attributes, geometry):
+        """Queue one result row; ``geometry`` is a QgsGeometry."""
+        self._pending.append((attributes, bytes(geometry.asWkb())))
+        if self._shortfall_index is not None:
+            self.shortfalls.append(attributes[self._shortfall_index])
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def write_table(self, table, leading=()):
+        """Write a ``ResultTable``, building rows one batch at a time.
+
+        ``leading`` values are put in front of every row, e.g. the region of
+        a combined batch output.
+        """
+        self.flush()
+        leading = list(leading)
+        for start in range(0, len(table), self.batch_size):
+            stop = min(start + self.batch_size, len(table))
+            self.write_batch([
+                (leading + attributes, table.wkb_at(index))
+                for index, attributes in enumerate(table.rows(start, stop), start)
+            ])
+            self.written += stop - start
+        if self._shortfall_index is not None:
+            self.shortfalls.extend(table.shortfall.tolist())
+
+    def flush(self):
+        """Write any queued rows."""
+        if self._pending:
+            self.write_batch(self._pending)
+            self.written += len(self._pending)
+            self._pending = []
+
+    def write_batch(self, batch):
+        raise NotImplementedError
+
+    def finish(self):
+        """Finalise the store after the last batch and return a layer loaded from it."""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush remaining rows and return the output layer."""
+        self.flush()
+        self.layer = self.finish()
+        return self.layer
+
+
+class ResultCollector:
+    """Passes result tables on to a sink while keeping them for later stages."""
+
+    def __init__(self, sink, keep_geometries=False):
+        self.sink = sink
+        self.keep_geometries = keep_geometries
+        self.tables = []
+
+    def write_table(self, table, leading=()):
+        self.tables.append(table if self.keep_geometries else table.without_geometry())
+        self.sink.write_table(table, leading)
+
+    def table(self):
+        """Everything written so far as one table."""
+        return type(self.tables[0]).concat(self.tables) if self.tables else None
+
+
+def output_directory(setting, default_name, directory=None):
+    """``directory``, else the one configured under ``setting``, else ``default_name`` in the temp directory."""
+    directory = directory or QgsSettings().value(setting, "", type=str) or os.path.join(
+        tempfile.gettempdir(), default_name)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def write_area_csv(area_ids, columns, csv_type, layer_name, suffix, directory):
+    """Write per-area ``columns`` keyed by area id as a new CSV in ``directory``; returns its path.
+
+    ``columns`` maps field names to one value per area, all of the .csvt
+    type ``csv_type``.  Every call writes a file of its own, named after
+    ``layer_name`` and ``suffix``, so rerunning under the same layer name
+    never overwrites a CSV that an earlier layer is still joined to.
+    """
+    prefix = re.sub(r"[^0-9A-Za-z]+", "_", layer_name).strip("_").lower()
+    handle, path = tempfile.mkstemp(suffix=f"_{suffix}.csv", prefix=f"{prefix}_", dir=directory)
+    values = [value.tolist() if hasattr(value, "tolist") else list(value) for value in columns.values()]
+    with os.fdopen(handle, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow([AREA_ID_FIELD] + list(columns))
+        writer.writerows(zip(area_ids, *values))
+    with open(os.path.splitext(path)[0] + ".csvt", "w", encoding="utf-8") as csvt_file:
+        csvt_file.write(",".join(['"String"'] + [f'"{csv_type}"'] * len(columns)))
+    return path
+
+
+def join_csv(layer, path, suffix):
+    """Load the per-area CSV at ``path`` and join it to ``layer`` on the area id.
+
+    The table layer is added to the project without showing it in the layer
+    tree, since QGIS joins need the joined layer to live in the project.
+    """
+    uri = QUrl.fromLocalFile(os.path.abspath(path)).toString() + "?delimiter=,"
+    table = QgsVectorLayer(uri, f"{layer.name()} - {suffix}", "delimitedtext")
+    if not table.isValid():
+        raise ValueError(f"Could not load {path}")
+    QgsProject.instance().addMapLayer(table, False)
+    join = QgsVectorLayerJoinInfo()
+    join.setJoinLayer(table)
+    join.setJoinFieldName(AREA_ID_FIELD)
+    join.setTargetFieldName(AREA_ID_FIELD)
+    join.setPrefix("")
+    join.setUsingMemoryCache(True)
+    layer.addJoin(join)
+    return table
+
+
+class MemorySink(ResultSink):
+    """Keeps results in a transient ``memory`` provider layer."""
+
+    def __init__(self, fields, layer_name="Needed Schools", batch_size=BATCH_SIZE):
+        super().__init__(fields, layer_name, batch_size)
+        self.memory_layer = QgsVectorLayer(f"Polygon?crs=EPSG:{RESULTS_SRID}", layer_name, "memory")
+        self.memory_layer.dataProvider().addAttributes([QgsField(name, field_type) for name, field_type in fields])
+        self.memory_layer.updateFields()
+
+    def write_batch(self, batch):
+        features = []
+        for attributes, wkb in batch:
+            geometry = QgsGeometry()
+            geometry.fromWkb(wkb)
+            feat = QgsFeature()
+            feat.setGeometry(geometry)
+            feat.setAttributes(list(attributes))
+            features.append(feat)
+        self.memory_layer.dataProvider().addFeatures(features)
+
+    def finish(self):
+        return self.memory_layer
+
+
+class GeoPackageSink(ResultSink):
+    """Streams results into a GeoPackage layer, one transaction per batch."""
+
+    def __init__(self, fields, path, layer_name="Needed Schools", batch_size=BATCH_SIZE):
+        super().__init__(fields, layer_name, batch_size)
+        from osgeo import ogr, osr
+
+        self._ogr = ogr
+        self.path = path
+        if os.path.exists(path):
+            self.datasource = ogr.Open(path, update=1)
+        else:
+            self.datasource = ogr.GetDriverByName("GPKG").CreateDataSource(path)
+        if self.datasource is None:
+            raise IOError(f"Cannot open GeoPackage {path}")
+
+        # Replace the results of a previous run stored under the same name
+        for index in range(self.datasource.GetLayerCount()):
+            if self.datasource.GetLayerByIndex(index).GetName() == layer_name:
+                self.datasource.DeleteLayer(index)
+                break
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(RESULTS_SRID)
+        self.ogr_layer = self.datasource.CreateLayer(layer_name, srs, ogr.wkbMultiPolygon)
+        ogr_types = {QVariant.String: ogr.OFTString, QVariant.Int: ogr.OFTInteger,
+                     QVariant.LongLong: ogr.OFTInteger64, QVariant.Double: ogr.OFTReal}
+        for name, field_type in fields:
+            self.ogr_layer.CreateField(ogr.FieldDefn(name, ogr_types[field_type]))
+        self._definition = self.ogr_layer.GetLayerDefn()
+
+    def write_batch(self, batch):
+        ogr = self._ogr
+        self.ogr_layer.StartTransaction()
+        for attributes, wkb in batch:
+            feature = ogr.Feature(self._definition)
+            for index, value in enumerate(attributes):
+                if value is not None:
+                    feature.SetField(index, value)
+            ogr_geometry = ogr.CreateGeometryFromWkb(wkb)
+            feature.SetGeometry(ogr.ForceToMultiPolygon(ogr_geometry))
+            self.ogr_layer.CreateFeature(feature)
+        self.ogr_layer.CommitTransaction()
+
+    def finish(self):
+        self.datasource.FlushCache()
+        self.ogr_layer = None
+        self.datasource = None
+        return QgsVectorLayer(f"{self.path}|layername={self.layer_name}", self.layer_name, "ogr")
+
+
+def to_ewkb(wkb, srid):
+    """Add an SRID to ISO/OGC WKB so PostGIS accepts it for a typed column."""
+    byte_order = "<" if wkb[0] == 1 else ">"
+    (geometry_type,) = struct.unpack_from(byte_order + "I", wkb, 1)
+    return (wkb[:1] + struct.pack(byte_order + "II", geometry_type | 0x20000000, srid) + wkb[5:])
+
+
+def encode_copy_binary(rows, field_types):
+    """Encode rows for ``COPY ... FROM STDIN (FORMAT binary)``.
+
+    ``field_types`` holds one QVariant type per attribute; the last value of
+    every row is EWKB geometry bytes.
+    """
+    buffer = io.BytesIO()
+    buffer.write(b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0))
+    column_count = struct.pack("!h", len(field_types) + 1)
+    for row in rows:
+        buffer.write(column_count)
+        for value, field_type in zip(row, field_types):
+            if value is None:
+                buffer.write(struct.pack("!i", -1))
+            elif field_type == QVariant.String:
+                data = str(value).encode("utf-8")
+                buffer.write(struct.pack("!i", len(data)) + data)
+            elif field_type == QVariant.Int:
+                buffer.write(struct.pack("!ii", 4, int(value)))
+            elif field_type == QVariant.LongLong:
+                buffer.write(struct.pack("!iq", 8, int(value)))
+            else:
+                buffer.write(struct.pack("!id", 8, float(value)))
+        geometry = row[-1]
+        buffer.write(struct.pack("!i", len(geometry)) + geometry)
+    buffer.write(struct.pack("!h", -1))
+    buffer.seek(0)
+    return buffer
+
+
+class PostgisSink(ResultSink):
+    """Loads results into a PostGIS table with binary ``COPY``."""
+
+    def __init__(self, fields, connection, table, schema="public", layer_name="Needed Schools",
+                 batch_size=BATCH_SIZE * 10, owns_connection=False):
+        super().__init__(fields, layer_name, batch_size)
+        self.connection = connection
+        self.owns_connection = owns_connection
+        self.table = table
+        self.schema = schema
+        self.cursor = connection.cursor()
+        self._field_types = [field_type for _, field_type in fields]
+        self._target = sql.Identifier(schema, table)
+        self._prepare_table()
+
+    def _prepare_table(self):
+        """Create the results table, replacing an earlier results table of the same name."""
+        qualified_name = f'"{self.schema}"."{self.table}"'
+        self.cursor.execute("SELECT to_regclass(%s) IS NOT NULL, obj_description(to_regclass(%s), 'pg_class')",
+                            [qualified_name, qualified_name])
+        exists, comment = self.cursor.fetchone()
+        if exists and comment != RESULTS_TABLE_COMMENT:
+            raise ValueError(f"Table {self.schema}.{self.table} exists and was not created by Needed Schools.")
+
+        columns = [
+            sql.SQL("{} {}").format(sql.Identifier(name), sql.SQL(_POSTGRES_TYPES[field_type]))
+            for name, field_type in self.fields
+        ]
+        self.cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(self._target))
+        self.cursor.execute(sql.SQL("CREATE TABLE {} (id serial PRIMARY KEY, {}, geom geometry(Geometry, {}))").format(
+            self._target, sql.SQL(", ").join(columns), sql.Literal(RESULTS_SRID)
+        ))
+        self.cursor.execute(sql.SQL("COMMENT ON TABLE {} IS {}").format(
+            self._target, sql.Literal(RESULTS_TABLE_COMMENT)
+        ))
+        self._copy = sql.SQL("COPY {} ({}, geom) FROM STDIN (FORMAT binary)").format(
+            self._target, sql.SQL(", ").join(sql.Identifier(name) for name, _ in self.fields)
+        )
+
+    def write_batch(self, batch):
+        rows = (list(attributes) + [to_ewkb(wkb, RESULTS_SRID)] for attributes, wkb in batch)
+        self.cursor.copy_expert(self._copy.as_string(self.connection), encode_copy_binary(rows, self._field_types))
+
+    def finish(self):
+        self.cursor.execute(sql.SQL("CREATE INDEX ON {} USING gist (geom)").format(self._target))
+        self.cursor.execute(sql.SQL("ANALYZE {}").format(self._target))
+        self.connection.commit()
+        self.cursor.close()
+        if self.owns_connection:
+            self.connection.close()
+        metadata_cache.clear()
+        return QgsVectorLayer(layer_uri(self.table, "geom", "id", self.schema), self.layer_name, "postgres")
+
+
+def arrow_schema(fields):
+    """Arrow schema for rows written with ``fields`` plus a WKB ``geometry`` column."""
+    import pyarrow
+
+    arrow_types = {QVariant.String: pyarrow.string(), QVariant.Int: pyarrow.int32(),
+                   QVariant.LongLong: pyarrow.int64(), QVariant.Double: pyarrow.float64()}
+    schema = pyarrow.schema([(name, arrow_types[field_type]) for name, field_type in fields]
+                            + [("geometry", pyarrow.binary())])
+    return schema.with_metadata({b"geo": json.dumps(GEOPARQUET_METADATA).encode("utf-8")})
+
+
+class ArrowSink(ResultSink):
+    """Streams results into a GeoParquet (``.parquet``) or Arrow IPC file, one record batch per batch."""
+
+    def __init__(self, fields, path, layer_name="Needed Schools", batch_size=BATCH_SIZE * 10):
+        super().__init__(fields, layer_name, batch_size)
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Arrow and Parquet output needs pyarrow (pip install pyarrow).")
+
+        self._pyarrow = pyarrow
+        self.path = path
+        self.schema = arrow_schema(fields)
+        if path.lower().endswith(".parquet"):
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write_batch(self, batch):
+        columns = list(zip(*(list(attributes) + [wkb] for attributes, wkb in batch)))
+        self.writer.write_batch(self._pyarrow.record_batch(
+            [self._pyarrow.array(column, field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema
+        ))
+
+    def finish(self):
+        self.writer.close()
+        # GDAL reads both formats from version 3.5 on
+        return QgsVectorLayer(self.path, self.layer_name, "ogr")
+
+
+class MBTilesSink(MemorySink):
+    """Keeps results in a memory layer and writes them as vector tiles to an MBTiles file when closed."""
+
+    def __init__(self, fields, path, min_zoom, max_zoom, workers=None, layer_name="Needed Schools",
+                 batch_size=BATCH_SIZE):
+        super().__init__(fields, layer_name, batch_size)
+        self.path = path
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.workers = workers
+        self.rows = []
+        self.tiles = 0
+
+    def write_batch(self, batch):
+        super().write_batch(batch)
+        self.rows.extend(batch)
+
+    def finish(self):
+        from .vector_tiles import write_mbtiles
+
+        self.tiles = write_mbtiles(self.path, [name for name, _ in self.fields], self.rows, self.min_zoom,
+                                   self.max_zoom, self.workers)
+        self.rows = []
+        return super().finish()
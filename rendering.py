@@ -0,0 +1,120 @@
+"""Styling and labeling of Needed Schools output layers.
+
+The rendering profile keeps canvas refreshes cheap on large outputs: labels
+are placed on points precomputed with ``ST_PointOnSurface`` instead of being
+searched for on every polygon, only appear below a configurable scale, and
+are built from an expression instead of a stored string column.
+"""
+from PyQt5.QtGui import QFont
+from qgis.core import (
+    QgsGraduatedSymbolRenderer, QgsPalLayerSettings, QgsProperty, QgsRendererRange, QgsSettings,
+    QgsStyle, QgsSymbol, QgsTextFormat, QgsVectorLayerSimpleLabeling, QgsVectorSimplifyMethod
+)
+
+from .output_sinks import LABEL_X_FIELD, LABEL_Y_FIELD, SHORTFALL_FIELD
+
+LABEL_EXPRESSION = 'concat("Location_Name", \' = \', "Schools_that_are_supposed_to_be_built")'
+
+SETTING_LABEL_MIN_SCALE = "needed_schools/label_min_scale"
+SETTING_GRADUATED = "needed_schools/graduated_renderer"
+DEFAULT_LABEL_MIN_SCALE = 2000000
+GRADUATED_CLASSES = 5
+
+# Renderers already built for a set of class breaks, reused by later layers
+_renderer_cache = {}
+
+
+class RenderingProfile:
+    """How an output layer is labelled and drawn."""
+
+    def __init__(self, label_min_scale=DEFAULT_LABEL_MIN_SCALE, graduated=True, simplify=True):
+        self.label_min_scale = label_min_scale
+        self.graduated = graduated
+        self.simplify = simplify
+
+    @classmethod
+    def from_settings(cls):
+        """Build a profile from the user's QGIS settings."""
+        settings = QgsSettings()
+        return cls(
+            label_min_scale=settings.value(SETTING_LABEL_MIN_SCALE, DEFAULT_LABEL_MIN_SCALE, type=float),
+            graduated=settings.value(SETTING_GRADUATED, True, type=bool),
+        )
+
+
+def apply_labels(layer, profile=None):
+    """Label every area of ``layer`` at its precomputed label point."""
+    profile = profile or RenderingProfile()
+    label_settings = QgsPalLayerSettings()
+    label_settings.fieldName = LABEL_EXPRESSION
+    label_settings.isExpression = True
+    label_settings.placement = QgsPalLayerSettings.OverPoint
+    label_settings.enabled = True
+
+    # Fixed positions mean the labeling engine never searches polygon interiors
+    field_names = layer.fields().names()
+    if LABEL_X_FIELD in field_names and LABEL_Y_FIELD in field_names:
+        properties = label_settings.dataDefinedProperties()
+        properties.setProperty(QgsPalLayerSettings.PositionX, QgsProperty.fromField(LABEL_X_FIELD))
+        properties.setProperty(QgsPalLayerSettings.PositionY, QgsProperty.fromField(LABEL_Y_FIELD))
+        label_settings.setDataDefinedProperties(properties)
+
+    if profile.label_min_scale:
+        label_settings.scaleVisibility = True
+        label_settings.minimumScale = profile.label_min_scale
+        label_settings.maximumScale = 0
+
+    text_format = QgsTextFormat()
+    text_format.setFont(QFont("Arial", 10))
+    text_format.setSize(10)
+    label_settings.setFormat(text_format)
+
+    layer.setLabelsEnabled(True)
+    layer.setLabeling(QgsVectorLayerSimpleLabeling(label_settings))
+    layer.triggerRepaint()
+
+
+def quantile_breaks(values, classes=GRADUATED_CLASSES):
+    """Distinct upper bounds splitting ``values`` into at most ``classes`` quantile classes."""
+    ordered = sorted(values)
+    if not ordered:
+        return []
+    breaks = []
+    for index in range(1, classes + 1):
+        value = ordered[min(len(ordered) - 1, (len(ordered) * index) // classes - 1)]
+        if not breaks or value > breaks[-1]:
+            breaks.append(value)
+    return breaks
+
+
+def graduated_renderer(layer, breaks):
+    """Graduated shortfall renderer for ``breaks``, cloned from the cache when possible."""
+    key = (layer.geometryType(), tuple(breaks))
+    if key not in _renderer_cache:
+        ramp = QgsStyle.defaultStyle().colorRamp("Reds")
+        ranges = []
+        lower = min(0, breaks[0])
+        for index, upper in enumerate(breaks):
+            symbol = QgsSymbol.defaultSymbol(layer.geometryType())
+            symbol.setColor(ramp.color(index / max(1, len(breaks) - 1)))
+            ranges.append(QgsRendererRange(lower, upper, symbol, f"{lower:g} - {upper:g}"))
+            lower = upper
+        _renderer_cache[key] = QgsGraduatedSymbolRenderer(SHORTFALL_FIELD, ranges)
+    return _renderer_cache[key].clone()
+
+
+def apply_rendering(layer, shortfalls=None, profile=None):
+    """Apply the rendering profile to an output layer.
+
+    ``shortfalls`` are the values written to the layer; passing them lets the
+    graduated renderer be built without another scan of the layer.
+    """
+    profile = profile or RenderingProfile.from_settings()
+    if profile.graduated and shortfalls:
+        layer.setRenderer(graduated_renderer(layer, quantile_breaks(shortfalls)))
+    if profile.simplify:
+        method = QgsVectorSimplifyMethod()
+        method.setSimplifyHints(QgsVectorSimplifyMethod.GeometrySimplification)
+        method.setThreshold(1.0)
+        layer.setSimplifyMethod(method)
+    apply_labels(layer, profile)
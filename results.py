@@ -0,0 +1,166 @@
+"""Columnar representation of needed-schools results.
+
+Results travel between the pipeline stages as a ``ResultTable``: one typed
+NumPy array per attribute and all geometries as WKB in a single buffer with
+an offsets array.  That is far smaller than a list of ``QgsFeature`` objects,
+and features are only built at the sink, one batch at a time.  A table can
+be saved to ``.npz`` (used by tile checkpoints) and exported to Arrow IPC or
+GeoParquet files for downstream tools when pyarrow is installed.
+"""
+import importlib.util
+import io
+
+import numpy as np
+from PyQt5.QtCore import QVariant
+from qgis.core import QgsGeometry
+
+from .output_sinks import RESULT_FIELDS, arrow_schema
+
+# Table attributes holding the RESULT_FIELDS columns, in the same order
+COLUMNS = ["area_ids", "names", "population", "expected", "existing", "shortfall", "label_x", "label_y"]
+_DTYPES = [str, str, np.float64, np.int32, np.int32, np.int32, np.float64, np.float64]
+
+
+def arrow_available():
+    """True when pyarrow is installed."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _pyarrow():
+    # pyarrow takes longer to import than the rest of the plugin, so only exports load it
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Arrow and Parquet export needs pyarrow (pip install pyarrow).")
+    return pyarrow
+
+
+class ResultTable:
+    """Result columns of a set of areas plus their WKB geometries.
+
+    ``extra`` holds further output columns by field name, such as the
+    category breakdown, written after the RESULT_FIELDS columns.
+    """
+
+    def __init__(self, area_ids, names, population, expected, existing, shortfall, label_x, label_y,
+                 wkb=b"", offsets=None, extra=None):
+        for column, values, dtype in zip(COLUMNS, (area_ids, names, population, expected, existing, shortfall,
+                                                    label_x, label_y), _DTYPES):
+            setattr(self, column, np.asarray(values, dtype=dtype))
+        self.wkb = bytes(wkb)
+        # offsets[i]:offsets[i + 1] is the WKB of area i; all zero when geometries were dropped
+        self.offsets = np.zeros(len(self.area_ids) + 1, dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+        self.extra = {name: np.asarray(values) for name, values in (extra or {}).items()}
+
+    @classmethod
+    def empty(cls):
+        return cls(*([[]] * len(COLUMNS)))
+
+    @classmethod
+    def from_areas(cls, city_features, school_counts, students_per_school):
+        """Build a table from fetched area rows and a dict of school counts keyed by area id.
+
+        ``city_features`` rows are ``(key, label, population, label_x, label_y, wkb)``.
+        """
+        if not city_features:
+            return cls.empty()
+        keys, labels, population, label_x, label_y, geometries = zip(*city_features)
+        geometries = [bytes(geometry) for geometry in geometries]
+        # numeric columns arrive as Decimal
+        population = np.array([float(value) for value in population], dtype=np.float64)
+        existing = np.array([school_counts.get(key, 0) for key in keys], dtype=np.int32)
+        expected = np.rint(population / students_per_school).astype(np.int32)
+        return cls(
+            [str(key) for key in keys],
+            [str(key) if label is None else label for key, label in zip(keys, labels)],
+            population, expected, existing, np.maximum(0, expected - existing),
+            label_x, label_y,
+            b"".join(geometries),
+            np.concatenate([[0], np.cumsum([len(geometry) for geometry in geometries])]),
+        )
+
+    @classmethod
+    def concat(cls, tables):
+        """Stack several tables into one."""
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return cls.empty()
+        offsets = [tables[0].offsets]
+        end = tables[0].offsets[-1]
+        for table in tables[1:]:
+            offsets.append(table.offsets[1:] + end)
+            end += table.offsets[-1]
+        return cls(
+            *(np.concatenate([getattr(table, column) for table in tables]) for column in COLUMNS),
+            wkb=b"".join(table.wkb for table in tables),
+            offsets=np.concatenate(offsets),
+            extra={name: np.concatenate([table.extra[name] for table in tables]) for name in tables[0].extra},
+        )
+
+    def __len__(self):
+        return len(self.area_ids)
+
+    def without_geometry(self):
+        """Same attributes with the geometry buffer dropped."""
+        return ResultTable(*(getattr(self, column) for column in COLUMNS), extra=self.extra)
+
+    def with_columns(self, extra):
+        """Same table with the ``extra`` columns added."""
+        return ResultTable(*(getattr(self, column) for column in COLUMNS), wkb=self.wkb, offsets=self.offsets,
+                           extra=dict(self.extra, **extra))
+
+    def fields(self):
+        """Output fields of the table: RESULT_FIELDS, then the extra columns."""
+        return RESULT_FIELDS + [(name, QVariant.Double if values.dtype.kind == "f" else QVariant.Int)
+                                for name, values in self.extra.items()]
+
+    def wkb_at(self, index):
+        """WKB bytes of the area at ``index``."""
+        return self.wkb[self.offsets[index]:self.offsets[index + 1]]
+
+    def geometry(self, index):
+        """QgsGeometry of the area at ``index``."""
+        geometry = QgsGeometry()
+        geometry.fromWkb(self.wkb_at(index))
+        return geometry
+
+    def rows(self, start=0, stop=None):
+        """Attribute lists, in ``fields()`` order, of the areas from ``start`` to ``stop``."""
+        columns = [getattr(self, column) for column in COLUMNS] + list(self.extra.values())
+        return [list(row) for row in zip(*(values[start:stop].tolist() for values in columns))]
+
+    def to_bytes(self):
+        """Serialise the table as an uncompressed ``.npz`` archive."""
+        buffer = io.BytesIO()
+        np.savez(buffer, wkb=np.frombuffer(self.wkb, dtype=np.uint8), offsets=self.offsets,
+                 extra_names=np.array(list(self.extra), dtype=str),
+                 **{column: getattr(self, column) for column in COLUMNS},
+                 **{f"extra_{index}": values for index, values in enumerate(self.extra.values())})
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Inverse of ``to_bytes``."""
+        with np.load(io.BytesIO(data)) as archive:
+            names = archive["extra_names"].tolist() if "extra_names" in archive.files else []
+            return cls(*(archive[column] for column in COLUMNS), wkb=archive["wkb"].tobytes(),
+                       offsets=archive["offsets"],
+                       extra={name: archive[f"extra_{index}"] for index, name in enumerate(names)})
+
+    def to_arrow(self):
+        """The table as a ``pyarrow.Table`` with ``fields()`` names and a WKB ``geometry`` column."""
+        pyarrow = _pyarrow()
+        columns = [getattr(self, column) for column in COLUMNS] + list(self.extra.values())
+        columns.append([self.wkb_at(index) for index in range(len(self))])
+        return pyarrow.table(columns, schema=arrow_schema(self.fields()))
+
+    def write_arrow(self, path):
+        """Write a GeoParquet file for ``.parquet`` paths, otherwise an Arrow IPC (Feather) file."""
+        pyarrow = _pyarrow()
+        if path.lower().endswith(".parquet"):
+            pyarrow.parquet.write_table(self.to_arrow(), path)
+        else:
+            pyarrow.feather.write_feather(self.to_arrow(), path)
+        return path
@@ -0,0 +1,123 @@
+"""Population growth scenarios evaluated over the results of one run.
+
+A run fetches each area's base population and existing schools once.  The
+scenario engine projects those base arrays over every combination of growth
+rate, target year and students-per-school policy with NumPy broadcasting, so
+a whole matrix of scenarios costs no further database work.  The shortfalls
+are written as a compact cube, one row per area and one column per scenario,
+which is joined to the output layer on its area id.
+"""
+import re
+
+import numpy as np
+from qgis.core import QgsSettings
+
+from .output_sinks import join_csv, output_directory, write_area_csv
+
+SETTING_GROWTH_RATES = "needed_schools/scenario_growth_rates"
+SETTING_YEARS = "needed_schools/scenario_years"
+SETTING_STUDENTS_PER_SCHOOL = "needed_schools/scenario_students_per_school"
+SETTING_BASE_YEAR = "needed_schools/scenario_base_year"
+SETTING_OUTPUT_DIR = "needed_schools/scenario_output_dir"
+# Year of the Malawi census the population layers are built from
+DEFAULT_BASE_YEAR = 2018
+
+
+def parse_numbers(value, cast=float):
+    """Parse a comma separated list; ``a-b`` expands to every integer from a to b."""
+    numbers = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = re.fullmatch(r"(\d+)\s*-\s*(\d+)", part)
+        if bounds:
+            numbers += [cast(number) for number in range(int(bounds.group(1)), int(bounds.group(2)) + 1)]
+        else:
+            numbers.append(cast(part))
+    return numbers
+
+
+class ScenarioMatrix:
+    """Every combination of annual growth rate, target year and students per school."""
+
+    def __init__(self, growth_rates, years, students_per_school, base_year=DEFAULT_BASE_YEAR):
+        self.growth_rates = np.asarray(growth_rates, dtype=np.float64)
+        self.years = np.asarray(years, dtype=np.int64)
+        self.students_per_school = np.asarray(students_per_school, dtype=np.float64)
+        self.base_year = int(base_year)
+        if not (len(self.growth_rates) and len(self.years) and len(self.students_per_school)):
+            raise ValueError("A scenario matrix needs at least one growth rate, year and students-per-school value.")
+        if np.any(self.students_per_school <= 0):
+            raise ValueError("Students per school must be positive in every scenario.")
+
+    @classmethod
+    def from_settings(cls, students_per_school):
+        """Matrix configured in the QGIS settings, or None when no growth rates are set.
+
+        Without configured policies the run's own ``students_per_school`` is used.
+        """
+        settings = QgsSettings()
+        growth_rates = parse_numbers(settings.value(SETTING_GROWTH_RATES, "", type=str))
+        if not growth_rates:
+            return None
+        years = parse_numbers(settings.value(SETTING_YEARS, "2025-2040", type=str), int)
+        policies = parse_numbers(settings.value(SETTING_STUDENTS_PER_SCHOOL, "", type=str)) or [students_per_school]
+        base_year = settings.value(SETTING_BASE_YEAR, DEFAULT_BASE_YEAR, type=int)
+        return cls(growth_rates, years, policies, base_year)
+
+    def __len__(self):
+        return len(self.growth_rates) * len(self.years) * len(self.students_per_school)
+
+    def labels(self):
+        """Column names of the scenarios, in cube order (growth, then year, then policy)."""
+        return [
+            f"g{rate * 100:g}_y{year}_c{capacity:g}"
+            for rate in self.growth_rates for year in self.years for capacity in self.students_per_school
+        ]
+
+
+class ScenarioCube:
+    """Expected schools and shortfall of every area under every scenario."""
+
+    def __init__(self, area_ids, labels, expected, shortfall):
+        self.area_ids = list(area_ids)
+        self.labels = labels
+        self.expected = expected
+        self.shortfall = shortfall
+
+
+def evaluate(area_ids, population, existing, matrix):
+    """Evaluate every scenario of ``matrix`` over the per-area base arrays in one broadcast.
+
+    Returns a ``ScenarioCube`` whose arrays have one row per area and one
+    column per scenario.
+    """
+    population = np.asarray(population, dtype=np.float64)
+    existing = np.asarray(existing, dtype=np.float64)
+    # growth factor per (rate, year), then projected population per (area, rate, year)
+    factors = (1 + matrix.growth_rates[:, None]) ** (matrix.years - matrix.base_year)[None, :]
+    projected = population[:, None, None] * factors[None, :, :]
+    expected = np.rint(projected[..., None] / matrix.students_per_school)
+    shortfall = np.maximum(0, expected - existing[:, None, None, None])
+    areas = len(population)
+    return ScenarioCube(
+        area_ids, matrix.labels(),
+        expected.reshape(areas, len(matrix)).astype(np.int32),
+        shortfall.reshape(areas, len(matrix)).astype(np.int32),
+    )
+
+
+def write_scenarios(table, matrix, layer_name, directory=None):
+    """Evaluate ``matrix`` over a run's ``ResultTable`` and write the cube as CSV.
+
+    Returns the path of the written file.
+    """
+    cube = evaluate(table.area_ids.tolist(), table.population, table.existing, matrix)
+    return write_area_csv(cube.area_ids, dict(zip(cube.labels, cube.shortfall.T)), "Integer", layer_name, "scenarios",
+                          output_directory(SETTING_OUTPUT_DIR, "needed_schools_scenarios", directory))
+
+
+def join_scenarios(layer, path):
+    """Join the scenario cube at ``path`` to ``layer``."""
+    return join_csv(layer, path, "scenarios")
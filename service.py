@@ -0,0 +1,299 @@
+"""Standalone JSON service answering needed-schools queries for many clients.
+
+Run it with the Python that QGIS uses, from the directory holding the plugin:
+
+    python -m needed_schools.service --port 8765 --connections 4
+
+Every client shares one connection pool and one result cache.  Identical
+requests arriving while a computation is running wait for that computation
+instead of starting their own, and answers are kept, already encoded, until
+they expire, so repeated questions are answered without touching the
+database.
+
+Endpoints:
+
+``GET /health``
+    ``{"status": "ok"}``.
+``GET /tables``
+    Tables of the analysis database.
+``GET /needed-schools?population_table=...&schools_table=...&population_field=...``
+    Also accepts ``students_per_school`` (default 1000), ``label_column``,
+    ``id_column``, ``partition_column`` with ``region``, and ``geometry=1``
+    for WKB geometries in hex.  ``POST`` takes the same keys as a JSON object.
+``GET /stats``
+    Cache hits, misses and coalesced requests.
+``DELETE /cache``
+    Forget cached results and catalog lookups, e.g. after the tables changed.
+"""
+import argparse
+import collections
+import datetime
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from .analysis import AnalysisJob, compute_needed_schools
+from .database import create_pool, metadata_cache
+from .instrumentation import RunTrace
+
+DEFAULT_PORT = 8765
+DEFAULT_CONNECTIONS = 4
+DEFAULT_CACHE_ENTRIES = 64
+DEFAULT_CACHE_SECONDS = 600
+DEFAULT_STUDENTS_PER_SCHOOL = 1000
+
+REQUIRED_PARAMETERS = ["population_table", "schools_table", "population_field"]
+OPTIONAL_PARAMETERS = ["label_column", "id_column", "partition_column", "region"]
+
+
+class ResultCache:
+    """Bounded, expiring cache that runs each distinct computation once at a time.
+
+    A caller asking for a key that is being computed blocks until that
+    computation finishes and shares its value, or its exception.  Failures
+    are not cached.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES, max_age=DEFAULT_CACHE_SECONDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (stored at, value), least recently used first
+        self._pending = {}  # key -> Future of the running computation
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_compute(self, key, compute):
+        """The cached value of ``key``, computing it with ``compute()`` when missing or expired."""
+        owner = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[0] <= self.max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self._pending.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = self._pending[key] = Future()
+                self.misses += 1
+                future.set_running_or_notify_cancel()
+                owner = True
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as error:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            del self._pending[key]
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        """Forget every stored value; running computations are unaffected."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "coalesced": self.coalesced, "running": len(self._pending)}
+
+
+def job_from_parameters(parameters):
+    """``(AnalysisJob, include geometry)`` from request parameters; raises ``ValueError`` when invalid."""
+    missing = [name for name in REQUIRED_PARAMETERS if not parameters.get(name)]
+    if missing:
+        raise ValueError(f"Missing parameter(s): {', '.join(missing)}")
+    try:
+        students_per_school = int(parameters.get("students_per_school") or DEFAULT_STUDENTS_PER_SCHOOL)
+    except (TypeError, ValueError):
+        raise ValueError("students_per_school must be an integer")
+    if students_per_school <= 0:
+        raise ValueError("students_per_school must be positive")
+    optional = {name: parameters.get(name) or None for name in OPTIONAL_PARAMETERS}
+    if (optional["partition_column"] is None) != (optional["region"] is None):
+        raise ValueError("partition_column and region go together")
+    job = AnalysisJob(parameters["population_table"], parameters["schools_table"], parameters["population_field"],
+                      students_per_school, **optional)
+    return job, str(parameters.get("geometry", "")).lower() in ("1", "true", "yes")
+
+
+def encode_table(job, table, include_geometry):
+    """JSON response body for the ``ResultTable`` of ``job``."""
+    areas = []
+    for index, (area_id, name, population, expected, existing, shortfall, label_x, label_y) in enumerate(zip(
+            table.area_ids.tolist(), table.names.tolist(), table.population.tolist(), table.expected.tolist(),
+            table.existing.tolist(), table.shortfall.tolist(), table.label_x.tolist(), table.label_y.tolist())):
+        area = {"area_id": area_id, "name": name, "population": population, "expected_schools": expected,
+                "existing_schools": existing, "shortfall": shortfall, "label_x": label_x, "label_y": label_y}
+        if include_geometry:
+            area["geometry_wkb"] = table.wkb_at(index).hex()
+        areas.append(area)
+    document = {
+        "job": job.name,
+        "students_per_school": job.students_per_school,
+        "computed_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "totals": {"areas": len(table), "population": float(table.population.sum()),
+                   "existing_schools": int(table.existing.sum()), "shortfall": int(table.shortfall.sum())},
+        "areas": areas,
+    }
+    return json.dumps(document).encode("utf-8")
+
+
+class NeededSchoolsService:
+    """The computations behind the HTTP endpoints, on a shared pool and cache."""
+
+    def __init__(self, pool, max_connections, cache=None):
+        self.pool = pool
+        self.cache = cache or ResultCache()
+        # ThreadedConnectionPool raises instead of waiting when it runs out
+        self._connections = threading.BoundedSemaphore(max_connections)
+
+    def _with_cursor(self, work):
+        with self._connections:
+            connection = self.pool.getconn()
+            try:
+                cursor = connection.cursor()
+                try:
+                    return work(cursor)
+                finally:
+                    cursor.close()
+                    connection.rollback()
+            finally:
+                self.pool.putconn(connection)
+
+    def tables(self):
+        return json.dumps({"tables": self._with_cursor(metadata_cache.tables)}).encode("utf-8")
+
+    def needed_schools(self, parameters):
+        """Encoded results of the job described by ``parameters``, from the cache when possible."""
+        job, include_geometry = job_from_parameters(parameters)
+        key = (tuple(sorted((name, value) for name, value in job.__dict__.items() if name != "name")),
+               include_geometry)
+
+        def compute():
+            table = self._with_cursor(lambda cursor: compute_needed_schools(cursor, job, RunTrace(enabled=False)))
+            return encode_table(job, table, include_geometry)
+
+        return self.cache.get_or_compute(key, compute)
+
+    def clear(self):
+        self.cache.clear()
+        metadata_cache.clear()
+
+    def close(self):
+        self.pool.closeall()
+
+
+def make_handler(service):
+    """Request handler class bound to ``service``."""
+
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "NeededSchools/1.0"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._respond(200, b'{"status": "ok"}')
+            elif url.path == "/tables":
+                self._run(service.tables)
+            elif url.path == "/needed-schools":
+                self._run(lambda: service.needed_schools(dict(parse_qsl(url.query))))
+            elif url.path == "/stats":
+                self._respond(200, json.dumps(service.cache.stats()).encode("utf-8"))
+            else:
+                self._error(404, f"No endpoint {url.path}")
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/needed-schools":
+                self._error(404, f"No endpoint {self.path}")
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                parameters = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(parameters, dict):
+                    raise ValueError("Expected a JSON object")
+            except ValueError as error:
+                self._error(400, f"Invalid request body: {error}")
+                return
+            self._run(lambda: service.needed_schools(parameters))
+
+        def do_DELETE(self):
+            if urlparse(self.path).path != "/cache":
+                self._error(404, f"No endpoint {self.path}")
+                return
+            service.clear()
+            self._respond(200, b'{"cleared": true}')
+
+        def _run(self, work):
+            try:
+                body = work()
+            except ValueError as error:
+                self._error(400, str(error))
+            except Exception as error:
+                self._error(500, f"{type(error).__name__}: {error}")
+            else:
+                self._respond(200, body)
+
+        def _error(self, status, message):
+            self._respond(status, json.dumps({"error": message}).encode("utf-8"))
+
+        def _respond(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def create_server(service, host="127.0.0.1", port=DEFAULT_PORT):
+    """Threaded HTTP server for ``service``; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    return server
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Serve needed-schools results as JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS,
+                        help="size of the shared connection pool")
+    parser.add_argument("--dsn", help="libpq connection string; defaults to the plugin's analysis database")
+    parser.add_argument("--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES)
+    parser.add_argument("--cache-seconds", type=float, default=DEFAULT_CACHE_SECONDS)
+    options = parser.parse_args(arguments)
+
+    service = NeededSchoolsService(create_pool(options.connections, options.dsn), options.connections,
+                                   ResultCache(options.cache_entries, options.cache_seconds))
+    server = create_server(service, options.host, options.port)
+    print(f"Serving needed schools on http://{options.host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
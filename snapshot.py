@@ -0,0 +1,139 @@
+"""Offline snapshots of the analysis inputs.
+
+A snapshot is one GeoPackage holding the areas of a job, reduced to the
+columns the analysis reads and already transformed to EPSG:4326, with their
+school counts, label points and an R-tree spatial index.  Field teams
+compute needed schools from it without a database connection: a snapshot
+replays the school counts taken when it was exported, so a run only reads
+one table and applies the students-per-school ratio.
+"""
+import datetime
+import os
+import pathlib
+import sqlite3
+
+from .analysis import (
+    AnalysisJob, OUTPUT_SRID, build_table, count_query, population_query, resolve_mapping, split_counts
+)
+
+AREAS_LAYER = "areas"
+INFO_LAYER = "snapshot_info"
+GEOMETRY_COLUMN = "geom"
+
+# Job settings stored with a snapshot, so it can be computed without the dialog's selections
+INFO_KEYS = ["population_table", "schools_table", "population_field", "label_column", "id_column",
+             "partition_column", "region", "exported_at"]
+
+# Size of the envelope that follows the GeoPackage binary header, by envelope indicator
+_ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def gpkg_to_wkb(blob):
+    """Strip the GeoPackage binary header from a geometry blob, leaving ISO WKB."""
+    if blob[:2] != b"GP":
+        raise ValueError("Not a GeoPackage geometry blob")
+    envelope = _ENVELOPE_SIZES.get((blob[3] >> 1) & 0x07)
+    if envelope is None:
+        raise ValueError("Invalid GeoPackage envelope indicator")
+    return bytes(blob[8 + envelope:])
+
+
+def export_snapshot(cursor, job, path, trace):
+    """Write the inputs of ``job`` to the GeoPackage ``path``, replacing an existing file.
+
+    Returns the number of areas written.
+    """
+    from osgeo import ogr, osr
+
+    # Snapshots store the total school count only
+    job = job.copy(tile=None, categories=None)
+    with trace.span("resolve columns"):
+        mapping = resolve_mapping(cursor, job)
+    with trace.span("fetch population"):
+        query, params = population_query(job, mapping)
+        cursor.execute(query, params)
+        areas = cursor.fetchall()
+    with trace.span("count schools"):
+        counting, params = count_query(job, mapping)
+        cursor.execute(counting, params)
+        school_counts, _ = split_counts(cursor.fetchall())
+
+    with trace.span("write snapshot"):
+        driver = ogr.GetDriverByName("GPKG")
+        if os.path.exists(path):
+            driver.DeleteDataSource(path)
+        datasource = driver.CreateDataSource(path)
+        if datasource is None:
+            raise IOError(f"Cannot create GeoPackage {path}")
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(OUTPUT_SRID)
+        area_layer = datasource.CreateLayer(AREAS_LAYER, srs, ogr.wkbMultiPolygon,
+                                            [f"GEOMETRY_NAME={GEOMETRY_COLUMN}", "SPATIAL_INDEX=YES"])
+        for name, field_type in [("area_id", ogr.OFTString), ("label", ogr.OFTString), ("population", ogr.OFTReal),
+                                 ("label_x", ogr.OFTReal), ("label_y", ogr.OFTReal),
+                                 ("school_count", ogr.OFTInteger)]:
+            area_layer.CreateField(ogr.FieldDefn(name, field_type))
+        definition = area_layer.GetLayerDefn()
+        area_layer.StartTransaction()
+        for area_id, label, population, label_x, label_y, wkb in areas:
+            feature = ogr.Feature(definition)
+            feature.SetField("area_id", str(area_id))
+            if label is not None:
+                feature.SetField("label", label)
+            feature.SetField("population", float(population))
+            feature.SetField("label_x", label_x)
+            feature.SetField("label_y", label_y)
+            feature.SetField("school_count", school_counts.get(area_id, 0))
+            feature.SetGeometry(ogr.ForceToMultiPolygon(ogr.CreateGeometryFromWkb(bytes(wkb))))
+            area_layer.CreateFeature(feature)
+        area_layer.CommitTransaction()
+
+        info_layer = datasource.CreateLayer(INFO_LAYER, None, ogr.wkbNone)
+        info_layer.CreateField(ogr.FieldDefn("key", ogr.OFTString))
+        info_layer.CreateField(ogr.FieldDefn("value", ogr.OFTString))
+        info = dict(job.__dict__, label_column=mapping.label_column, id_column=mapping.id_column,
+                    exported_at=datetime.datetime.now().isoformat(timespec="seconds"))
+        for key in INFO_KEYS:
+            if info.get(key) is not None:
+                feature = ogr.Feature(info_layer.GetLayerDefn())
+                feature.SetField("key", key)
+                feature.SetField("value", str(info[key]))
+                info_layer.CreateFeature(feature)
+        datasource = None
+    return len(areas)
+
+
+def _open(path):
+    # GeoPackages are SQLite databases; plain reads skip OGR's per-feature overhead
+    return sqlite3.connect(pathlib.Path(path).absolute().as_uri() + "?mode=ro", uri=True)
+
+
+def snapshot_job(path, students_per_school):
+    """The ``AnalysisJob`` a snapshot was exported for, with a new students-per-school ratio."""
+    connection = _open(path)
+    try:
+        info = dict(connection.execute(f'SELECT "key", "value" FROM "{INFO_LAYER}"').fetchall())
+    finally:
+        connection.close()
+    return AnalysisJob(info["population_table"], info["schools_table"], info["population_field"],
+                       students_per_school, partition_column=info.get("partition_column"),
+                       region=info.get("region"), label_column=info.get("label_column"),
+                       id_column=info.get("id_column"))
+
+
+def compute_from_snapshot(path, job, trace):
+    """Compute the ``ResultTable`` of ``job`` from the snapshot at ``path``."""
+    with trace.span("read snapshot"):
+        connection = _open(path)
+        try:
+            rows = connection.execute(
+                f'SELECT area_id, label, population, label_x, label_y, school_count, "{GEOMETRY_COLUMN}" '
+                f'FROM "{AREAS_LAYER}" ORDER BY fid'
+            ).fetchall()
+        finally:
+            connection.close()
+    with trace.span("parse snapshot"):
+        city_features = [(area_id, label, population, label_x, label_y, gpkg_to_wkb(blob))
+                         for area_id, label, population, label_x, label_y, _, blob in rows]
+        school_counts = {row[0]: row[5] for row in rows}
+    return build_table(job, city_features, school_counts, trace)
@@ -0,0 +1,148 @@
+"""School counts as of past dates, from the schools' opening and closing dates.
+
+One spatial query matches every school to its area and groups the matches
+by area, opening date and closing date.  Those validity intervals are then
+swept once against the sorted query dates: every interval adds one at the
+first query date on or after its opening and removes it again at the first
+one on or after its closing, and a cumulative sum along the dates gives
+every area's count on every date.  A whole annual series therefore costs
+the same single spatial query as one date.
+
+Schools without an opening date count as always open, without a closing
+date as still open.  The expected schools use the run's population, since
+the population tables have no history.
+"""
+import datetime
+import re
+
+import numpy as np
+from psycopg2 import sql
+from qgis.core import QgsSettings
+
+from .analysis import OUTPUT_SRID, area_filters, area_key_sql, geometry_sql, resolve_mapping
+from .database import metadata_cache
+from .output_sinks import output_directory, write_area_csv
+
+SETTING_OPEN_COLUMN = "needed_schools/open_date_column"
+SETTING_CLOSE_COLUMN = "needed_schools/close_date_column"
+SETTING_DATES = "needed_schools/as_of_dates"
+SETTING_OUTPUT_DIR = "needed_schools/as_of_output_dir"
+
+# Day ordinals standing in for a missing opening or closing date
+ALWAYS = np.iinfo(np.int64).min
+NEVER = np.iinfo(np.int64).max
+
+
+def parse_dates(value):
+    """Dates from ``"2015-2020, 2024-06-30"``; a year means its last day and ``a-b`` every year from a to b."""
+    dates = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        years = re.fullmatch(r"(\d{4})(?:\s*-\s*(\d{4}))?", part)
+        if years:
+            last = int(years.group(2) or years.group(1))
+            dates += [datetime.date(year, 12, 31) for year in range(int(years.group(1)), last + 1)]
+        else:
+            dates.append(datetime.date.fromisoformat(part))
+    return dates
+
+
+def as_of_settings():
+    """``(opening column, closing column, dates)``; no dates means off."""
+    settings = QgsSettings()
+    return (settings.value(SETTING_OPEN_COLUMN, "", type=str) or None,
+            settings.value(SETTING_CLOSE_COLUMN, "", type=str) or None,
+            parse_dates(settings.value(SETTING_DATES, "", type=str)))
+
+
+def _ordinals(dates, missing):
+    return np.array([missing if date is None else date.toordinal() for date in dates], dtype=np.int64)
+
+
+class SchoolIntervals:
+    """Validity intervals of the schools matched to each area, as day ordinals."""
+
+    def __init__(self, area_index, opened, closed, schools, areas):
+        self.area_index = np.asarray(area_index, dtype=np.int64)
+        self.opened = np.asarray(opened, dtype=np.int64)
+        self.closed = np.asarray(closed, dtype=np.int64)
+        self.schools = np.asarray(schools, dtype=np.int64)
+        self.areas = areas
+
+    @classmethod
+    def from_rows(cls, rows, area_ids):
+        """Intervals from ``(area key, opened, closed, schools)`` rows, for the areas ``area_ids`` in order."""
+        positions = {area_id: index for index, area_id in enumerate(area_ids)}
+        rows = [row for row in rows if str(row[0]) in positions]
+        return cls([positions[str(row[0])] for row in rows],
+                   _ordinals([row[1] for row in rows], ALWAYS), _ordinals([row[2] for row in rows], NEVER),
+                   [row[3] for row in rows], len(positions))
+
+    def counts(self, dates):
+        """``(areas, dates)`` array of the schools open in every area on every date, in one sweep."""
+        days = _ordinals(dates, NEVER)
+        order = np.argsort(days, kind="stable")
+        sorted_days = days[order]
+        slots = len(days) + 1
+        start = np.searchsorted(sorted_days, self.opened, side="left")
+        # A closing date before the opening date is read as never opened
+        stop = np.maximum(np.searchsorted(sorted_days, self.closed, side="left"), start)
+        changes = (np.bincount(self.area_index * slots + start, weights=self.schools, minlength=self.areas * slots)
+                   - np.bincount(self.area_index * slots + stop, weights=self.schools, minlength=self.areas * slots))
+        counts = np.cumsum(changes.reshape(self.areas, slots), axis=1)[:, :-1]
+        result = np.empty_like(counts)
+        result[:, order] = counts
+        return np.rint(result).astype(np.int32)
+
+
+def _date_sql(column):
+    return sql.SQL("{}::date").format(sql.Identifier("s", column)) if column else sql.SQL("NULL::date")
+
+
+def fetch_intervals(cursor, job, open_column, close_column):
+    """``(area key, opened, closed, schools)`` rows of ``job`` from one spatial join."""
+    mapping = resolve_mapping(cursor, job)
+    columns = metadata_cache.columns(cursor, job.schools_table)
+    for column in (open_column, close_column):
+        if column is not None and column not in columns:
+            raise ValueError(f"Column {column} does not exist in {job.schools_table}")
+    where, params = area_filters(job, sql.SQL("g.label_point"))
+    schools_srid = mapping.schools_srid or OUTPUT_SRID
+    label_point = sql.SQL("")
+    if job.tile is not None:
+        label_point = sql.SQL("CROSS JOIN LATERAL (SELECT ST_PointOnSurface({}) AS label_point) g").format(
+            geometry_sql("p", mapping.geometry_column, mapping.srid, OUTPUT_SRID))
+    query = sql.SQL("""
+        SELECT {key}, {opened}, {closed}, COUNT(*) FROM {population_layer} p
+        {label_point}
+        JOIN {schools_layer} s ON ST_Within({school_geom}, {area_geom})
+    """).format(
+        key=area_key_sql(mapping),
+        opened=_date_sql(open_column),
+        closed=_date_sql(close_column),
+        population_layer=sql.Identifier(job.population_table),
+        label_point=label_point,
+        schools_layer=sql.Identifier(job.schools_table),
+        school_geom=geometry_sql("s", mapping.schools_geometry_column, mapping.schools_srid, schools_srid),
+        area_geom=geometry_sql("p", mapping.geometry_column, mapping.srid, schools_srid),
+    ) + where + sql.SQL(" GROUP BY 1, 2, 3")
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def as_of_columns(table, intervals, dates):
+    """``{field name: column}`` with the existing schools and shortfall of ``table``'s areas on every date."""
+    counts = intervals.counts(dates)
+    columns = {}
+    for index, date in enumerate(dates):
+        columns[f"Existing_{date:%Y%m%d}"] = counts[:, index]
+        columns[f"Shortfall_{date:%Y%m%d}"] = np.maximum(0, table.expected - counts[:, index]).astype(np.int32)
+    return columns
+
+
+def write_as_of(table, columns, layer_name, directory=None):
+    """Write the as-of columns of every area as CSV, returning its path."""
+    return write_area_csv(table.area_ids.tolist(), columns, "Integer", layer_name, "as_of",
+                          output_directory(SETTING_OUTPUT_DIR, "needed_schools_as_of", directory))
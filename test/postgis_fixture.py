@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Disposable PostGIS database with synthetic data for query-plan tests.
+
+Set ``NEEDED_SCHOOLS_TEST_DSN`` to a libpq connection string of a scratch
+database with PostGIS available.  Otherwise a temporary cluster is created
+with ``initdb``/``pg_ctl`` from ``pg_config --bindir`` or the PATH, and
+removed again afterwards.  Tests using it are skipped when neither works.
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import unittest
+
+DSN_VARIABLE = "NEEDED_SCHOOLS_TEST_DSN"
+
+# A 40 x 40 grid of square areas in EPSG:4326 and schools scattered over it,
+# stored in UTM 36S like the real schools layer
+AREA_GRID = 40
+SCHOOL_COUNT = 20000
+
+SYNTHETIC_DATA = """
+    DROP TABLE IF EXISTS test_areas, test_schools, test_areas_nokey;
+    CREATE TABLE test_areas (
+        gid serial PRIMARY KEY, adm3_en text, adm2_en text, pop2024 numeric, geom geometry(Polygon, 4326)
+    );
+    INSERT INTO test_areas (adm3_en, adm2_en, pop2024, geom)
+    SELECT 'Area ' || x || '-' || y, 'District ' || (x / 10), 1000 + (x * 37 + y * 11) % 5000,
+           ST_MakeEnvelope(34 + x * 0.05, -16 + y * 0.05, 34 + (x + 1) * 0.05, -16 + (y + 1) * 0.05, 4326)
+    FROM generate_series(0, {grid} - 1) x, generate_series(0, {grid} - 1) y;
+    CREATE TABLE test_schools (id serial PRIMARY KEY, geom geometry(Point, 32736));
+    INSERT INTO test_schools (geom)
+    SELECT ST_Transform(ST_SetSRID(ST_MakePoint(34 + random() * {grid} * 0.05, -16 + random() * {grid} * 0.05), 4326), 32736)
+    FROM generate_series(1, {schools});
+    CREATE TABLE test_areas_nokey AS SELECT adm3_en, pop2024, geom FROM test_areas;
+    CREATE INDEX test_areas_geom_gist ON test_areas USING gist (geom);
+    CREATE INDEX test_schools_geom_gist ON test_schools USING gist (geom);
+    ANALYZE test_areas;
+    ANALYZE test_schools;
+    ANALYZE test_areas_nokey;
+""".format(grid=AREA_GRID, schools=SCHOOL_COUNT)
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _bindir():
+    try:
+        return subprocess.check_output(["pg_config", "--bindir"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        initdb = shutil.which("initdb")
+        return os.path.dirname(initdb) if initdb else None
+
+
+class DisposablePostgis(object):
+    """Owns the scratch database for one test module."""
+
+    def __init__(self):
+        self.directory = None
+        self.pg_ctl = None
+        self.dsn = os.environ.get(DSN_VARIABLE)
+
+    def start(self):
+        """Connect to, or create, the database and load the synthetic tables.
+
+        Raises ``unittest.SkipTest`` when no PostGIS database can be had.
+        """
+        try:
+            import psycopg2
+        except ImportError:
+            raise unittest.SkipTest("psycopg2 is not installed")
+        if self.dsn is None:
+            self._start_cluster()
+        try:
+            self.connection = psycopg2.connect(self.dsn)
+        except psycopg2.Error as error:
+            self.stop()
+            raise unittest.SkipTest(f"Cannot connect to the test database: {error}")
+        self.connection.autocommit = True
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        except psycopg2.Error as error:
+            self.stop()
+            raise unittest.SkipTest(f"PostGIS is not available: {error}")
+        cursor.execute(SYNTHETIC_DATA)
+        cursor.close()
+        self.connection.autocommit = False
+        return self.connection
+
+    def _start_cluster(self):
+        bindir = _bindir()
+        if bindir is None or not os.path.exists(os.path.join(bindir, "initdb")):
+            raise unittest.SkipTest(f"Set {DSN_VARIABLE} or install PostgreSQL server binaries")
+        self.directory = tempfile.mkdtemp(prefix="needed_schools_pg_")
+        data = os.path.join(self.directory, "data")
+        port = _free_port()
+        try:
+            subprocess.run([os.path.join(bindir, "initdb"), "-D", data, "-U", "postgres", "-A", "trust"],
+                           check=True, capture_output=True)
+            self.pg_ctl = os.path.join(bindir, "pg_ctl")
+            subprocess.run([self.pg_ctl, "-D", data, "-w", "-l", os.path.join(self.directory, "log"), "-o",
+                            f"-p {port} -k {self.directory} -c listen_addresses=''", "start"],
+                           check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as error:
+            self.stop()
+            raise unittest.SkipTest(f"Cannot start a temporary PostgreSQL cluster: {error}")
+        self.dsn = f"host={self.directory} port={port} user=postgres dbname=postgres"
+
+    def stop(self):
+        """Close the connection and remove a temporary cluster."""
+        connection = getattr(self, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.connection = None
+        if self.pg_ctl is not None:
+            subprocess.run([self.pg_ctl, "-D", os.path.join(self.directory, "data"), "-m", "immediate", "stop"],
+                           capture_output=True)
+            self.pg_ctl = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -0,0 +1,60 @@
+# coding=utf-8
+"""Tests for the table health advisor."""
+
+import datetime
+import unittest
+
+from ..advisor import TableHealth, summarize_plan
+
+ANALYZED = datetime.datetime(2024, 1, 1)
+
+PLAN = [{
+    "Plan": {
+        "Node Type": "HashAggregate", "Total Cost": 1520.5,
+        "Plans": [{
+            "Node Type": "Nested Loop", "Total Cost": 1400.0,
+            "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "zomba_adm3", "Total Cost": 12.0},
+                {"Node Type": "Index Scan", "Relation Name": "zomba_schools",
+                 "Index Name": "zomba_schools_geom_gist", "Total Cost": 8.0},
+            ],
+        }],
+    },
+    "Execution Time": 42.5,
+}]
+
+
+class AdvisorTest(unittest.TestCase):
+    """Test the recommendation rules and plan summaries."""
+
+    def test_healthy_table_needs_nothing(self):
+        """Indexed, clustered and recently analyzed tables get no recommendation."""
+        health = TableHealth("zomba_schools", "geom", 32736, 50000, 50000, 10, ANALYZED,
+                             "zomba_schools_geom_gist", True)
+        self.assertEqual(health.recommendations(), [])
+
+    def test_missing_index_comes_before_cluster_and_analyze(self):
+        """A new index is created, then clustered on, then the table is analyzed."""
+        health = TableHealth("zomba_schools", "geom", 32736, 50000, 50000, 10, ANALYZED, None, False)
+        self.assertEqual([found.kind for found in health.recommendations()], ["index", "cluster", "analyze"])
+
+    def test_stale_statistics_and_missing_srid(self):
+        """Many changed rows call for ANALYZE; a missing SRID is only reported."""
+        health = TableHealth("zomba_adm3", "geom", 0, 200, 200, 150, ANALYZED, "zomba_adm3_geom_idx", False)
+        found = health.recommendations()
+        self.assertEqual([item.kind for item in found], ["srid", "analyze"])
+        self.assertIsNone(found[0].statement)
+        self.assertIn("150 of 200", found[1].reason)
+
+    def test_summarize_plan(self):
+        """Index and sequential scans are collected from the whole tree."""
+        summary = summarize_plan(PLAN)
+        self.assertEqual(summary["total_cost"], 1520.5)
+        self.assertEqual(summary["execution_ms"], 42.5)
+        self.assertEqual(summary["index_scans"], ["zomba_schools_geom_gist"])
+        self.assertEqual(summary["seq_scans"], ["zomba_adm3"])
+        self.assertEqual(summary["node_types"], ["HashAggregate", "Nested Loop", "Seq Scan", "Index Scan"])
+
+
+if __name__ == "__main__":
+    unittest.main()
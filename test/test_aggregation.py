@@ -0,0 +1,32 @@
+# coding=utf-8
+"""Tests for rolling results up to parent admin levels."""
+
+import unittest
+
+from ..aggregation import roll_up
+
+
+class AggregationTest(unittest.TestCase):
+    """Test the vectorised group-by used for parent levels."""
+
+    def test_roll_up_sums_children(self):
+        """Population and schools are summed; expected schools use the summed population."""
+        totals = roll_up(
+            ["Zomba", "Zomba", "Machinga"],
+            population=[1400, 1400, 500],
+            existing=[1, 0, 2],
+            child_shortfall=[0, 1, 0],
+            students_per_school=1000,
+        )
+        self.assertEqual(list(totals["ids"]), ["Machinga", "Zomba"])
+        self.assertEqual(list(totals["population"]), [500, 2800])
+        self.assertEqual(list(totals["expected"]), [0, 3])
+        self.assertEqual(list(totals["existing"]), [2, 1])
+        self.assertEqual(list(totals["shortfall"]), [0, 2])
+        self.assertEqual(list(totals["summed_shortfall"]), [0, 1])
+        self.assertEqual(list(totals["children"]), [1, 2])
+        self.assertEqual(list(totals["inverse"]), [1, 1, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
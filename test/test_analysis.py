@@ -0,0 +1,53 @@
+# coding=utf-8
+"""Tests for the shared needed-schools computation."""
+
+import unittest
+
+from ..analysis import AnalysisJob, compute_needed_schools, resolve_mapping
+from ..database import metadata_cache
+from ..instrumentation import RunTrace
+from .utilities import ScriptedCursor
+
+
+def catalog_answers(primary_key="gid"):
+    """Answers to the catalog lookups of resolve_mapping, in query order."""
+    return [
+        [("gid",), ("adm3_en",), ("pop2024",), ("geom",)],   # population table columns
+        [("geom", 4326)],                                     # population geometry column
+        [("geom", 32736)],                                    # schools geometry column
+        [(primary_key,)] if primary_key else [],              # primary key
+    ]
+
+
+class AnalysisTest(unittest.TestCase):
+    """Test column mapping and the keyed merge of counts."""
+
+    def setUp(self):
+        metadata_cache.clear()
+
+    def test_resolve_mapping_defaults(self):
+        """The primary key, adm3_en and registered geometry columns are picked up."""
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000)
+        mapping = resolve_mapping(ScriptedCursor(catalog_answers()), job)
+        self.assertEqual(mapping.id_column, "gid")
+        self.assertEqual(mapping.label_column, "adm3_en")
+        self.assertEqual(mapping.schools_srid, 32736)
+
+    def test_resolve_mapping_rejects_unknown_column(self):
+        """A configured label column must exist."""
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000, label_column="name")
+        self.assertRaises(ValueError, resolve_mapping, ScriptedCursor(catalog_answers()), job)
+
+    def test_counts_are_joined_by_key(self):
+        """Areas without schools get zero; shortfalls never go negative."""
+        rows = [(1, "Likangala", 4600, 35.3, -15.4, b""), (2, "Chingale", 900, 35.5, -15.6, b"")]
+        counts = [(1, 2)]
+        cursor = ScriptedCursor(catalog_answers() + [rows, counts])
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000)
+        results = compute_needed_schools(cursor, job, RunTrace(enabled=False)).rows()
+        self.assertEqual(results[0], ["1", "Likangala", 4600, 5, 2, 3, 35.3, -15.4])
+        self.assertEqual(results[1], ["2", "Chingale", 900, 1, 0, 1, 35.5, -15.6])
+
+
+if __name__ == "__main__":
+    unittest.main()
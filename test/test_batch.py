@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Tests for batch job loading and partition expansion."""
+
+import os
+import tempfile
+import unittest
+
+from ..batch import expand_partitions, load_jobs_csv, summarize, JobResult
+from ..analysis import AnalysisJob
+from ..results import ResultTable
+
+
+class PartitionCursor(object):
+    """Cursor stand-in that returns a fixed list of partition values."""
+
+    def __init__(self, values):
+        self.values = values
+        self.queries = 0
+
+    def execute(self, query, params=None):
+        self.queries += 1
+
+    def fetchall(self):
+        return [(value,) for value in self.values]
+
+    def close(self):
+        pass
+
+
+class BatchTest(unittest.TestCase):
+    """Test the batch helpers that do not need a database."""
+
+    def test_load_jobs_csv(self):
+        """Rows become jobs; an empty partition column means no partitioning."""
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(handle, "w") as csv_file:
+            csv_file.write("population_table,schools_table,population_field,students_per_school,partition_column\n")
+            csv_file.write("zomba_adm3,zomba_schools,pop2024,800,\n")
+            csv_file.write("malawi_adm3,schools,pop2024,1000,adm1_en\n")
+        try:
+            jobs = load_jobs_csv(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(len(jobs), 2)
+        self.assertIsNone(jobs[0].partition_column)
+        self.assertEqual(jobs[0].students_per_school, 800)
+        self.assertEqual(jobs[1].partition_column, "adm1_en")
+
+    def test_load_jobs_csv_missing_column(self):
+        """A file without the required columns is rejected."""
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(handle, "w") as csv_file:
+            csv_file.write("population_table,schools_table\nzomba_adm3,zomba_schools\n")
+        try:
+            self.assertRaises(ValueError, load_jobs_csv, path)
+        finally:
+            os.remove(path)
+
+    def test_expand_partitions(self):
+        """A partitioned job turns into one job per region, others pass through."""
+        cursor = PartitionCursor(["Central", "Northern", "Southern"])
+        jobs = [
+            AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 800),
+            AnalysisJob("malawi_adm3", "schools", "pop2024", 1000, partition_column="adm1_en"),
+        ]
+        expanded = expand_partitions(cursor, jobs)
+        self.assertEqual(cursor.queries, 1)
+        self.assertEqual([job.region for job in expanded], [None, "Central", "Northern", "Southern"])
+        self.assertEqual(expanded[2].name, "malawi_adm3 Northern")
+
+    def test_summarize_reports_failures(self):
+        """The summary counts failed jobs."""
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 800)
+        text = summarize([JobResult(job, ResultTable.empty()), JobResult(job, error=ValueError("boom"))])
+        self.assertIn("1 of 2", text)
+        self.assertIn("boom", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
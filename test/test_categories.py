@@ -0,0 +1,79 @@
+# coding=utf-8
+"""Tests for the per-category breakdown of the school counts."""
+
+import unittest
+
+import numpy as np
+
+from ..analysis import AnalysisJob, compute_needed_schools
+from ..categories import CategoryBreakdown, category_text, parse_categories
+from ..database import metadata_cache
+from ..instrumentation import RunTrace
+from ..results import ResultTable
+from .utilities import ScriptedCursor
+
+
+CATALOG = [
+    [("gid",), ("adm3_en",), ("pop2024",), ("geom",)],   # population table columns
+    [("geom", 4326)],                                     # population geometry column
+    [("geom", 32736)],                                    # schools geometry column
+    [("gid",)],                                           # primary key
+    [("id",), ("level",), ("enrolment",), ("geom",)],     # schools table columns
+]
+AREAS = [(1, "Likangala", 4600, 35.3, -15.4, b""), (2, "Chingale", 900, 35.5, -15.6, b"")]
+
+
+class CategoryTest(unittest.TestCase):
+    """Test the single-pass filtered counts and their output columns."""
+
+    def setUp(self):
+        metadata_cache.clear()
+
+    def test_parse_categories(self):
+        self.assertEqual(parse_categories("primary:800, secondary ,, private:1200"),
+                         [("primary", 800), ("secondary", None), ("private", 1200)])
+        self.assertRaises(ValueError, parse_categories, "primary:0")
+
+    def test_category_text_matches_the_sql_cast(self):
+        self.assertEqual([category_text(value) for value in (0, 0.0, 2.0, 2.5, False, "primary")],
+                         ["0", "0", "2", "2.5", "false", "primary"])
+        self.assertIsNone(category_text(None))
+
+    def test_counts_come_from_the_counting_query(self):
+        breakdown = CategoryBreakdown("level", [("primary", 800), ("secondary", 2000)])
+        # key, all schools, primary, secondary
+        counts = [(1, 4, 3, 1)]
+        cursor = ScriptedCursor(CATALOG + [AREAS, counts])
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000, categories=breakdown)
+        table = compute_needed_schools(cursor, job, RunTrace(enabled=False))
+        self.assertEqual(cursor.params[-1], ["primary", "secondary"])
+        self.assertEqual([name for name, _ in table.fields()[-6:]],
+                         [name for name, _ in breakdown.fields()])
+        self.assertEqual(table.rows()[0][8:], [6, 3, 3, 2, 1, 1])
+        self.assertEqual(table.rows()[1][8:], [1, 0, 1, 0, 0, 0])
+
+    def test_unknown_category_column(self):
+        breakdown = CategoryBreakdown("ownership", [("public", None)])
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000, categories=breakdown)
+        self.assertRaises(ValueError, compute_needed_schools, ScriptedCursor(CATALOG), job, RunTrace(enabled=False))
+
+    def test_local_aggregates_match_sql_layout(self):
+        breakdown = CategoryBreakdown("level", [("primary", None), ("secondary", None)], capacity_column="enrolment")
+        # Three matched pairs in area 0, one in area 2; the last school is in no category
+        aggregates = breakdown.aggregate_local([0, 0, 0, 2, 2], [0, 1, 0, 1, -1], [300, 900, 200, 1000, 50], 3)
+        np.testing.assert_array_equal(aggregates, [[2, 500, 1, 900], [0, 0, 0, 0], [0, 0, 1, 1000]])
+        columns = breakdown.columns(["a", "b", "c"], dict(zip("abc", aggregates.tolist())), [2000, 0, 1000], 1000)
+        self.assertEqual(columns["Current_primary"].tolist(), [2, 0, 0])
+        self.assertEqual(columns["Capacity_secondary"].tolist(), [900, 0, 1000])
+        self.assertEqual(columns["Shortfall_secondary"].tolist(), [1, 0, 0])
+
+    def test_extra_columns_survive_serialisation(self):
+        table = ResultTable.from_areas(AREAS, {1: 2}, 1000).with_columns(
+            {"Current_primary": np.array([2, 0], dtype=np.int32)})
+        restored = ResultTable.from_bytes(ResultTable.concat([table, table]).to_bytes())
+        self.assertEqual(restored.extra["Current_primary"].tolist(), [2, 0, 2, 0])
+        self.assertEqual(restored.without_geometry().rows()[0][-1], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
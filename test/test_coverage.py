@@ -0,0 +1,74 @@
+# coding=utf-8
+"""Tests for the coverage grid and nearest-school distances."""
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..coverage import CoverageGrid, nearest_distances
+from ..demand import demand_points, grid_spacing
+from ..output_sinks import ResultCollector
+from ..results import ResultTable
+from .test_demand import AREAS
+from .utilities import DiscardingSink
+
+
+class CoverageTest(unittest.TestCase):
+    """Test the pruned distance search and the grid layout."""
+
+    def test_nearest_distances_match_brute_force(self):
+        generator = np.random.default_rng(7)
+        for schools in (1, 5, 500):
+            school_x, school_y = generator.uniform(0, 50000, (2, schools))
+            # A compact tile well inside the schools, and one far outside them
+            for origin in (20000, 90000):
+                cell_x, cell_y = generator.uniform(origin, origin + 3000, (2, 400))
+                expected = np.sqrt(((cell_x[:, None] - school_x) ** 2 + (cell_y[:, None] - school_y) ** 2).min(axis=1))
+                np.testing.assert_allclose(nearest_distances(cell_x, cell_y, school_x, school_y), expected)
+
+    def test_nearest_distances_without_schools(self):
+        distances = nearest_distances(np.zeros(3), np.zeros(3), np.zeros(0), np.zeros(0))
+        self.assertTrue(np.isinf(distances).all())
+
+    def test_grid_cells_coincide_with_demand_lattice(self):
+        grid = CoverageGrid((35.01, -15.09, 35.2, -14.9), 1000, -15.0)
+        step_x, step_y = grid_spacing(1000, -15.0)
+        x, y = grid.cell_centres(0, grid.rows, 0, grid.columns)
+        for centres, step in ((x, step_x), (y, step_y)):
+            offsets = centres / step - 0.5
+            np.testing.assert_allclose(offsets, np.round(offsets), atol=1e-9)
+        # Row 0 is the northernmost row
+        self.assertGreater(y[0, 0], y[-1, 0])
+        self.assertLessEqual(x.min() - step_x / 2, 35.01)
+        self.assertGreaterEqual(y.max() + step_y / 2, -14.9)
+
+    def test_bin_population_keeps_totals_and_orientation(self):
+        grid = CoverageGrid((35.0, -15.1, 35.1, -15.0), 1000, -15.05)
+        x, y = grid.cell_centres(0, grid.rows, 0, grid.columns)
+        population = np.arange(x.size, dtype=np.float64)
+        binned = grid.bin_population(x.ravel(), y.ravel(), population)
+        self.assertEqual(binned.shape, (grid.rows, grid.columns))
+        np.testing.assert_allclose(binned.ravel(), population)
+        # Points outside the grid are dropped
+        self.assertEqual(grid.bin_population(np.array([40.0]), np.array([-15.05]), np.array([5.0])).sum(), 0)
+
+    def test_coverage_population_from_collected_results(self):
+        """A run with only coverage enabled still has the polygons to spread its population."""
+        directory = tempfile.mkdtemp()
+        try:
+            collector = ResultCollector(DiscardingSink(), keep_geometries=True)
+            collector.write_table(ResultTable.from_areas(AREAS, {}, 1000))
+            results = collector.table()
+            points = demand_points(results, "zomba_adm3", 1000, directory=directory)
+            grid = CoverageGrid((points.x.min(), points.y.min(), points.x.max(), points.y.max()), 1000,
+                                float(np.mean(results.label_y)))
+            binned = grid.bin_population(points.x, points.y, points.population(results.population))
+            self.assertAlmostEqual(binned.sum(), 1300)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
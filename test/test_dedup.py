@@ -0,0 +1,119 @@
+# coding=utf-8
+"""Tests for the spatial deduplication of school registries.
+
+The canonical table tests run against a disposable PostGIS database (see
+``postgis_fixture``) and are skipped when none is available.
+"""
+
+import unittest
+
+import numpy as np
+
+from ..aggregation import fetch_parent_ids
+from ..analysis import AnalysisJob, compute_needed_schools
+from ..coverage import fetch_school_points
+from ..database import metadata_cache
+from ..dedup import SchoolRegistry, candidate_pairs, cluster_points, fetch_registry, similar_names, \
+    write_canonical_table
+from ..instrumentation import RunTrace
+from .postgis_fixture import SCHOOL_COUNT, DisposablePostgis
+from .utilities import ScriptedCursor
+
+
+def brute_force_pairs(x, y, tolerance):
+    pairs = set()
+    for i in range(len(x)):
+        for j in range(i + 1, len(x)):
+            if np.hypot(x[i] - x[j], y[i] - y[j]) <= tolerance:
+                pairs.add((i, j))
+    return pairs
+
+
+class DedupTest(unittest.TestCase):
+    """Test the grid-hash clustering and the canonical schools."""
+
+    def setUp(self):
+        metadata_cache.clear()
+
+    def test_grid_hash_finds_every_close_pair(self):
+        generator = np.random.default_rng(7)
+        x = generator.uniform(0, 500, 400)
+        y = generator.uniform(-250, 250, 400)
+        first, second = candidate_pairs(x, y, 20.0)
+        found = {(min(i, j), max(i, j)) for i, j in zip(first.tolist(), second.tolist())}
+        self.assertEqual(len(found), len(first))
+        self.assertEqual(found, brute_force_pairs(x, y, 20.0))
+
+    def test_chains_form_one_cluster(self):
+        # 0-1-2 chain within 10 m steps, 3 alone, 4 duplicates 3 only when names agree
+        x = [0, 9, 18, 100, 105]
+        y = [0, 0, 0, 0, 0]
+        np.testing.assert_array_equal(cluster_points(x, y, 10), [0, 0, 0, 3, 3])
+        names = ["Likangala", "Likangala School", "Likangala F.P. School", "Chingale", "Mpondabwino"]
+        np.testing.assert_array_equal(cluster_points(x, y, 10, names), [0, 0, 0, 3, 4])
+        np.testing.assert_array_equal(cluster_points(x, y, 0), np.arange(5))
+
+    def test_similar_names(self):
+        self.assertTrue(similar_names("Chingale Primary School", "CHINGALE F.P."))
+        self.assertTrue(similar_names("Chingale", None))
+        self.assertFalse(similar_names("Chingale", "Mpondabwino"))
+
+    def test_canonical_keys(self):
+        # Two records 3 m apart at the equator, one far away
+        registry = SchoolRegistry(["a", "b", "c"], [35.0, 35.00002, 35.1], [0.0, 0.0, 0.0]).cluster(5)
+        self.assertEqual(registry.canonical(), ["a", "c"])
+        self.assertEqual(registry.duplicate_count(), 1)
+
+    def test_registry_and_canonical_table_from_database(self):
+        catalog = [
+            [("gid",), ("adm3_en",), ("pop2024",), ("geom",)],   # population table columns
+            [("geom", 4326)],                                     # population geometry column
+            [("geom", 32736)],                                    # schools geometry column
+            [("gid",)],                                           # population primary key
+            [("id",)],                                            # schools primary key
+            [("id",), ("name",), ("geom",)],                      # schools table columns
+        ]
+        rows = [("1", 35.0, -15.0, "Likangala"), ("2", 35.00001, -15.0, "Likangala School")]
+        cursor = ScriptedCursor(catalog + [rows, None, None, None, None, None])
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000)
+        registry = fetch_registry(cursor, job, "name").cluster(10)
+        self.assertEqual(registry.canonical(), ["1"])
+        self.assertEqual(write_canonical_table(cursor, job, registry.canonical()), "zomba_schools_canonical")
+        self.assertEqual(cursor.params[-4], [["1"]])
+        # The temporary copy is known to the catalog cache like its source table
+        self.assertEqual(metadata_cache.geometry(None, "zomba_schools_canonical"), ("geom", 32736))
+        self.assertRaises(ValueError, fetch_registry, ScriptedCursor([]), job, "headteacher")
+
+
+class CanonicalTableTest(unittest.TestCase):
+    """Test the temporary canonical table over the later stages of a run."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database = DisposablePostgis()
+        cls.connection = cls.database.start()
+        metadata_cache.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.database.stop()
+        metadata_cache.clear()
+
+    def test_later_stages_after_the_cache_is_cleared(self):
+        """A sink closing clears the cache; roll-ups and school points still find the temporary table."""
+        cursor = self.connection.cursor()
+        job = AnalysisJob("test_areas", "test_schools", "pop2024", 1000)
+        registry = fetch_registry(cursor, job).cluster(50)
+        job = job.copy(schools_table=write_canonical_table(cursor, job, registry.canonical()))
+        table = compute_needed_schools(cursor, job, RunTrace(enabled=False))
+
+        metadata_cache.clear()
+        parent_ids = fetch_parent_ids(cursor, job, ["adm2_en"])
+        self.assertEqual(len(parent_ids), len(table))
+        school_x, _ = fetch_school_points(cursor, job)
+        self.assertEqual(len(school_x), SCHOOL_COUNT - registry.duplicate_count())
+        self.connection.rollback()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""Tests for dasymetric demand points."""
+
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..demand import DemandPoints, build_demand_points, demand_points, points_in_rings, wkb_rings
+from ..output_sinks import ResultCollector
+from ..results import ResultTable
+from .utilities import DiscardingSink
+
+
+def polygon_wkb(*rings):
+    """Little-endian WKB polygon from rings of (x, y) tuples."""
+    data = b"\x01" + struct.pack("<II", 3, len(rings))
+    for ring in rings:
+        data += struct.pack("<I", len(ring)) + b"".join(struct.pack("<dd", x, y) for x, y in ring)
+    return data
+
+
+def square(xmin, ymin, size):
+    return [(xmin, ymin), (xmin + size, ymin), (xmin + size, ymin + size), (xmin, ymin + size), (xmin, ymin)]
+
+
+# A 0.1 degree square with a 0.05 degree hole, and a square far smaller than a cell
+AREAS = [
+    ("1", "Holed", 1000, 35.02, -15.02, polygon_wkb(square(35.0, -15.1, 0.1), square(35.025, -15.075, 0.05))),
+    ("2", "Tiny", 300, 36.0005, -15.0005, polygon_wkb(square(36.0, -15.001, 0.001))),
+]
+
+
+class DemandTest(unittest.TestCase):
+    """Test WKB parsing, ray casting and the population shares."""
+
+    def setUp(self):
+        self.table = ResultTable.from_areas(AREAS, {}, 1000)
+
+    def test_points_in_rings_respects_holes(self):
+        """Points in a hole are outside; points between the rings are inside."""
+        rings = wkb_rings(AREAS[0][5])
+        self.assertEqual(len(rings), 2)
+        inside = points_in_rings(np.array([35.01, 35.05, 35.2]), np.array([-15.05, -15.05, -15.05]), rings)
+        self.assertEqual(inside.tolist(), [True, False, False])
+
+    def test_shares_sum_to_one_per_area(self):
+        """Every area's points carry exactly its population; tiny areas keep one point."""
+        points = build_demand_points(self.table, 1000)
+        population = points.population(self.table.population)
+        totals = np.bincount(points.area_index, weights=population)
+        self.assertTrue(np.allclose(totals, [1000, 300]))
+        self.assertEqual(int(np.sum(points.area_index == 1)), 1)
+        holed = points.area_index == 0
+        self.assertFalse(np.any((points.x[holed] > 35.025) & (points.x[holed] < 35.075)
+                                & (points.y[holed] > -15.075) & (points.y[holed] < -15.025)))
+
+    def test_cache_is_reused_and_checked(self):
+        """A second call loads the cache; changed areas rebuild it."""
+        directory = tempfile.mkdtemp()
+        try:
+            first = demand_points(self.table, "zomba_adm3", 1000, directory=directory)
+            again = demand_points(self.table, "zomba_adm3", 1000, directory=directory)
+            self.assertTrue(np.array_equal(first.x, again.x))
+            changed = ResultTable.from_areas(AREAS[:1], {}, 1000)
+            rebuilt = demand_points(changed, "zomba_adm3", 1000, directory=directory)
+            self.assertEqual(rebuilt.area_ids, ["1"])
+            self.assertIsInstance(rebuilt, DemandPoints)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_points_from_collected_results(self):
+        """The collected table of a run keeps the polygons that demand points need."""
+        directory = tempfile.mkdtemp()
+        try:
+            collector = ResultCollector(DiscardingSink(), keep_geometries=True)
+            for start in range(len(self.table)):
+                collector.write_table(ResultTable.from_areas(AREAS[start:start + 1], {}, 1000))
+            points = demand_points(collector.table(), "zomba_adm3", 1000, directory=directory)
+            self.assertTrue(np.array_equal(points.x, build_demand_points(self.table, 1000).x))
+
+            stripped = ResultCollector(DiscardingSink())
+            stripped.write_table(self.table)
+            self.assertRaises(ValueError, build_demand_points, stripped.table(), 1000)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# coding=utf-8
+"""Import-time budget of the plugin package.
+
+QGIS imports every enabled plugin at startup, so the plugin entry point
+should cost next to nothing: database drivers, numeric libraries and the
+generated UI are only loaded when the dialog is first opened.  The check
+runs a fresh interpreter with ``-X importtime`` and reads the cumulative
+import time of the plugin's own modules, with QGIS and Qt already loaded.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+PLUGIN_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_PACKAGE = os.path.basename(PLUGIN_DIRECTORY)
+# Override with NEEDED_SCHOOLS_IMPORT_BUDGET_MS on slow machines
+IMPORT_BUDGET_MS = float(os.environ.get("NEEDED_SCHOOLS_IMPORT_BUDGET_MS", 50))
+# Modules that loading the plugin must not pull in
+LAZY_MODULES = ["psycopg2", "psycopg", "numpy", "pyarrow", "scipy", "osgeo",
+                f"{PLUGIN_PACKAGE}.needed_schools_dialog", f"{PLUGIN_PACKAGE}.needed_schools_dialog_ui"]
+
+PROBE = """
+import json, sys
+import qgis.core, qgis.PyQt.QtCore, qgis.PyQt.QtWidgets
+import {package}
+{package}.classFactory
+import {package}.needed_schools
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def import_profile():
+    """Modules loaded by importing the plugin, and the cumulative import time in ms of each module."""
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(PLUGIN_DIRECTORY)] + [path for path in [environment.get("PYTHONPATH")] if path])
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(package=PLUGIN_PACKAGE)],
+                               capture_output=True, text=True, env=environment)
+    if completed.returncode != 0:
+        if "No module named 'qgis" in completed.stderr:
+            raise unittest.SkipTest("QGIS Python bindings are not available")
+        raise AssertionError(completed.stderr[-2000:])
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total) / 1000
+    return json.loads(completed.stdout.splitlines()[-1]), cumulative
+
+
+class ImportTimeTest(unittest.TestCase):
+    """Test that loading the plugin stays cheap."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.modules, cls.cumulative = import_profile()
+
+    def test_heavy_modules_are_not_imported(self):
+        loaded = [name for name in LAZY_MODULES if name in self.modules]
+        self.assertEqual(loaded, [], "imported when the plugin loads")
+
+    def test_import_budget(self):
+        spent = sum(self.cumulative.get(name, 0) for name in (PLUGIN_PACKAGE, f"{PLUGIN_PACKAGE}.needed_schools"))
+        self.assertLessEqual(spent, IMPORT_BUDGET_MS,
+                             f"loading the plugin took {spent:.1f} ms, over its {IMPORT_BUDGET_MS:g} ms budget")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# coding=utf-8
+"""Tests for the run instrumentation helpers."""
+
+import unittest
+
+from ..instrumentation import RunTrace
+
+
+class FakeCursor(object):
+    """Minimal stand-in for a psycopg2 cursor."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+class RunTraceTest(unittest.TestCase):
+    """Test timing spans and query counting."""
+
+    def test_cursor_counts_round_trips_and_rows(self):
+        """Each execute is a round trip; fetched rows and sizes are tallied."""
+        trace = RunTrace(enabled=True)
+        cursor = trace.cursor(FakeCursor([("Area A", 1200, "POLYGON((0 0,1 0,1 1,0 0))")]))
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.execute("SELECT 2")
+        cursor.fetchone()
+        self.assertEqual(trace.queries, 2)
+        self.assertEqual(trace.rows, 2)
+        self.assertGreater(trace.bytes, 0)
+
+    def test_spans_accumulate_per_stage(self):
+        """Repeated spans with the same name are merged."""
+        trace = RunTrace(enabled=True)
+        for _ in range(3):
+            with trace.span("count schools"):
+                pass
+        stages = trace.summary()["stages"]
+        self.assertEqual(len(stages), 1)
+        self.assertEqual(stages[0]["calls"], 3)
+
+    def test_disabled_trace_leaves_cursor_untouched(self):
+        """A disabled trace returns the raw cursor and records nothing."""
+        trace = RunTrace(enabled=False)
+        raw = FakeCursor([(1,)])
+        self.assertIs(trace.cursor(raw), raw)
+        with trace.span("fetch population"):
+            pass
+        self.assertEqual(trace.stages, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# coding=utf-8
+"""Tests for counting schools over project layers."""
+
+import unittest
+
+from qgis.core import QgsFeature, QgsGeometry, QgsVectorLayer
+
+from ..analysis import AnalysisJob
+from ..categories import CategoryBreakdown
+from ..instrumentation import RunTrace
+from ..layer_analysis import compute_from_layers, layer_school_points, school_categories
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+def memory_layer(uri, rows):
+    """Memory layer from ``(wkt, attributes)`` rows."""
+    layer = QgsVectorLayer(uri, "test", "memory")
+    features = []
+    for wkt, attributes in rows:
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        feature.setAttributes(attributes)
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+class LayerAnalysisTest(unittest.TestCase):
+    """Test the spatial-index counting path against known counts."""
+
+    def setUp(self):
+        self.areas = memory_layer(
+            "Polygon?crs=EPSG:4326&field=adm3_en:string&field=pop:double",
+            [("POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))", ["West", 3000]),
+             ("POLYGON((1 0, 2 0, 2 1, 1 1, 1 0))", ["East", 500]),
+             ("POLYGON((0 1, 1 1, 0.5 2, 0 1))", ["North", 1000])]
+        )
+        # Two schools in the west square, one in the east and one in the north square's bounding box only
+        self.schools = memory_layer(
+            "Point?crs=EPSG:4326",
+            [("POINT(0.2 0.2)", []), ("POINT(0.8 0.5)", []), ("POINT(1.5 0.5)", []), ("POINT(0.05 1.9)", [])]
+        )
+
+    def test_counts_schools_inside_areas(self):
+        job = AnalysisJob("areas", "schools", "pop", 1000)
+        table = compute_from_layers(self.areas, self.schools, job, RunTrace(enabled=False))
+        self.assertEqual(table.names.tolist(), ["West", "East", "North"])
+        self.assertEqual(table.existing.tolist(), [2, 1, 0])
+        self.assertEqual(table.expected.tolist(), [3, 0, 1])
+        self.assertEqual(table.shortfall.tolist(), [1, 0, 1])
+
+    def test_missing_field(self):
+        job = AnalysisJob("areas", "schools", "missing", 1000)
+        with self.assertRaises(ValueError):
+            compute_from_layers(self.areas, self.schools, job, RunTrace(enabled=False))
+
+    def test_school_points(self):
+        x, y = layer_school_points(self.schools)
+        self.assertEqual(x.tolist(), [0.2, 0.8, 1.5, 0.05])
+        self.assertEqual(y.tolist(), [0.2, 0.5, 0.5, 1.9])
+
+    def test_numeric_categories(self):
+        # A 0 category is a value, not a NULL; integral floats compare like PostgreSQL's text cast
+        schools = memory_layer(
+            "Point?crs=EPSG:4326&field=level:integer&field=grade:double",
+            [("POINT(0.2 0.2)", [0, 1.0]), ("POINT(0.8 0.5)", [1, 2.5]), ("POINT(1.5 0.5)", [None, None])]
+        )
+        levels = school_categories(schools, CategoryBreakdown("level", [("0", None), ("1", None)]))
+        self.assertEqual([index for index, _ in levels.values()], [0, 1, -1])
+        grades = school_categories(schools, CategoryBreakdown("grade", [("1", None), ("2.5", None)]))
+        self.assertEqual([index for index, _ in grades.values()], [0, 1, -1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+# coding=utf-8
+"""Tests for the road graph and network access."""
+
+import struct
+import unittest
+
+import numpy as np
+
+from ..demand import DemandPoints, METRES_PER_DEGREE
+from ..network import RoadGraph, _dijkstra, _snap_grid, area_access, wkb_lines
+
+# Grid spacing of the test networks, in degrees of latitude
+STEP = 0.001
+
+
+def linestring_wkb(points):
+    return b"\x01" + struct.pack("<II", 2, len(points)) + b"".join(struct.pack("<dd", x, y) for x, y in points)
+
+
+def street_grid(size, speed=3.6):
+    """``size`` x ``size`` nodes joined by horizontal and vertical streets, near the equator."""
+    lines = [np.array([(column * STEP, row * STEP) for column in range(size)]) for row in range(size)]
+    lines += [np.array([(column * STEP, row * STEP) for row in range(size)]) for column in range(size)]
+    return RoadGraph.from_lines(lines, [speed] * len(lines))
+
+
+class NetworkTest(unittest.TestCase):
+    """Test graph construction, the shortest path search and snapping."""
+
+    def test_wkb_lines_reads_multilinestrings(self):
+        first, second = [(0, 0), (1, 1)], [(2, 2), (3, 3), (4, 4)]
+        multi = b"\x01" + struct.pack("<II", 5, 2) + linestring_wkb(first) + linestring_wkb(second)
+        lines = wkb_lines(multi)
+        self.assertEqual([line.tolist() for line in lines], [[[0, 0], [1, 1]], [[2, 2], [3, 3], [4, 4]]])
+
+    def test_shared_vertices_become_one_node(self):
+        graph = street_grid(4)
+        self.assertEqual(len(graph), 16)
+        # 2 x 4 streets of 3 segments each, both ways
+        self.assertEqual(graph.edge_count, 2 * 24)
+        self.assertEqual(graph.indptr[-1], graph.edge_count)
+
+    def test_travel_times_follow_manhattan_distance(self):
+        size = 30
+        graph = street_grid(size)
+        # 1 m/s, so seconds equal metres along the streets
+        sources = np.array([0])
+        times = graph.travel_times(sources, np.zeros(1))
+        metres_x = METRES_PER_DEGREE * np.cos(np.radians(graph.latitude))
+        expected = graph.x * metres_x + graph.y * METRES_PER_DEGREE
+        np.testing.assert_allclose(times, expected, rtol=1e-9)
+
+    def test_multi_source_takes_nearest_source_and_limit(self):
+        graph = street_grid(10)
+        corner, opposite = 0, len(graph) - 1
+        times = _dijkstra(graph.indptr, graph.indices, graph.seconds, [corner, opposite], [0.0, 50.0], 500.0,
+                          len(graph))
+        self.assertEqual(times[corner], 0.0)
+        self.assertEqual(times[opposite], 50.0)
+        self.assertTrue(np.isinf(times).any())
+        self.assertLessEqual(times[np.isfinite(times)].max(), 500.0)
+
+    def test_snap_grid_matches_brute_force(self):
+        generator = np.random.default_rng(3)
+        nodes_x, nodes_y = generator.uniform(0, 10000, (2, 2000))
+        points_x, points_y = generator.uniform(-500, 10500, (2, 300))
+        node, distance = _snap_grid(nodes_x, nodes_y, points_x, points_y, 400.0)
+        gaps = np.hypot(points_x[:, None] - nodes_x, points_y[:, None] - nodes_y)
+        nearest = gaps.min(axis=1)
+        within = nearest <= 400.0
+        np.testing.assert_allclose(distance[within], nearest[within])
+        self.assertTrue((node[~within] == -1).all())
+
+    def test_area_access_splits_population(self):
+        graph = street_grid(50)
+        # One school at the south-west corner; one area beside it, one at the far corner
+        points = DemandPoints(["near", "far"], [0.0005, 0.049], [0.0, 0.049], [0, 1], [1.0, 1.0])
+        served, unserved = area_access(graph, points, [100.0, 40.0], 2, np.array([0.0]), np.array([0.0]),
+                                       speed=5.0, max_minutes=30, snap_distance=200)
+        np.testing.assert_allclose(served, [100.0, 0.0])
+        np.testing.assert_allclose(unserved, [0.0, 40.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
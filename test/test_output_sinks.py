@@ -0,0 +1,67 @@
+# coding=utf-8
+"""Tests for the result sink encoders."""
+
+import csv
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+from qgis.PyQt.QtCore import QVariant
+
+from ..output_sinks import encode_copy_binary, to_ewkb, write_area_csv
+
+# POINT(1 2) as little-endian WKB
+POINT_WKB = b"\x01" + struct.pack("<Idd", 1, 1.0, 2.0)
+
+
+class OutputSinksTest(unittest.TestCase):
+    """Test the binary encoders used by the PostGIS sink."""
+
+    def test_to_ewkb_sets_srid_flag(self):
+        """The SRID flag and value are inserted after the type word."""
+        ewkb = to_ewkb(POINT_WKB, 4326)
+        geometry_type, srid = struct.unpack_from("<II", ewkb, 1)
+        self.assertEqual(geometry_type, 1 | 0x20000000)
+        self.assertEqual(srid, 4326)
+        self.assertEqual(ewkb[9:], POINT_WKB[5:])
+
+    def test_encode_copy_binary_layout(self):
+        """Header, tuple layout and trailer follow the PGCOPY format."""
+        buffer = encode_copy_binary([["Area A", 3, POINT_WKB]], [QVariant.String, QVariant.Int])
+        data = buffer.getvalue()
+        self.assertTrue(data.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        self.assertTrue(data.endswith(struct.pack("!h", -1)))
+        offset = 19
+        (columns,) = struct.unpack_from("!h", data, offset)
+        self.assertEqual(columns, 3)
+        (length,) = struct.unpack_from("!i", data, offset + 2)
+        self.assertEqual(data[offset + 6:offset + 6 + length], b"Area A")
+
+    def test_encode_copy_binary_null(self):
+        """None is written as a -1 length."""
+        data = encode_copy_binary([[None, None, POINT_WKB]], [QVariant.String, QVariant.Int]).getvalue()
+        self.assertEqual(struct.unpack_from("!ii", data, 21), (-1, -1))
+
+
+class AreaCsvTest(unittest.TestCase):
+    """Test the per-area CSV files joined to the output layers."""
+
+    def test_reruns_get_files_of_their_own(self):
+        """A second run under the same layer name leaves the first run's CSV alone."""
+        with tempfile.TemporaryDirectory() as directory:
+            first = write_area_csv(["1", "2"], {"Served": np.array([10, 20])}, "Integer", "Needed Schools", "access",
+                                   directory)
+            second = write_area_csv(["1", "2"], {"Served": np.array([30, 40])}, "Integer", "Needed Schools", "access",
+                                    directory)
+            self.assertNotEqual(first, second)
+            self.assertTrue(os.path.basename(first).startswith("needed_schools_"))
+            with open(first, newline="", encoding="utf-8") as handle:
+                self.assertEqual(list(csv.reader(handle)), [["Area_Id", "Served"], ["1", "10"], ["2", "20"]])
+            with open(os.path.splitext(second)[0] + ".csvt", encoding="utf-8") as handle:
+                self.assertEqual(handle.read(), '"String","Integer"')
+
+
+if __name__ == "__main__":
+    unittest.main()
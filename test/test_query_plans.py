@@ -0,0 +1,98 @@
+# coding=utf-8
+"""Query-plan regression tests for the generated SQL.
+
+They run against a disposable PostGIS database (see ``postgis_fixture``)
+and are skipped when none is available.  Index usability is checked with
+sequential scans disabled, so a change that wraps an indexed column in a
+function shows up as a sequential scan whatever the table sizes.
+"""
+
+import unittest
+
+from psycopg2 import sql
+
+from ..advisor import summarize_plan
+from ..analysis import AnalysisJob, compute_needed_schools, count_query, population_query, resolve_mapping
+from ..database import metadata_cache
+from ..instrumentation import RunTrace
+from .postgis_fixture import AREA_GRID, SCHOOL_COUNT, DisposablePostgis
+
+DATABASE = DisposablePostgis()
+
+# Catalog lookups of a cold metadata cache (columns, two geometry columns,
+# primary key) plus the population and counting queries
+COLD_ROUND_TRIPS = 6
+WARM_ROUND_TRIPS = 2
+
+
+def setUpModule():
+    DATABASE.start()
+
+
+def tearDownModule():
+    DATABASE.stop()
+
+
+class QueryPlanTest(unittest.TestCase):
+    """Assert on EXPLAIN (FORMAT JSON) of the queries the analysis sends."""
+
+    def setUp(self):
+        metadata_cache.clear()
+        self.connection = DATABASE.connection
+        self.cursor = self.connection.cursor()
+
+    def tearDown(self):
+        self.cursor.close()
+        self.connection.rollback()
+        metadata_cache.clear()
+
+    def job(self, population_table="test_areas", **changes):
+        return AnalysisJob(population_table, "test_schools", "pop2024", 1000, **changes)
+
+    def explain(self, job, build_query, allow_seqscan=False):
+        """Plan summary of the query ``build_query(job, mapping)`` returns."""
+        query, params = build_query(job, resolve_mapping(self.cursor, job))
+        if not allow_seqscan:
+            self.cursor.execute("SET LOCAL enable_seqscan = off")
+        self.cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) ") + query, params)
+        return summarize_plan(self.cursor.fetchone()[0])
+
+    def test_count_query_uses_schools_index(self):
+        """Schools are found through their GiST index although they are in another SRID."""
+        summary = self.explain(self.job(), count_query)
+        self.assertIn("test_schools_geom_gist", summary["index_scans"])
+        self.assertNotIn("test_schools", summary["seq_scans"])
+
+    def test_tiled_count_query_uses_schools_index(self):
+        """The label point filter of a tile does not hide the index."""
+        summary = self.explain(self.job(tile=(34.0, -16.0, 35.0, -15.0)), count_query)
+        self.assertIn("test_schools_geom_gist", summary["index_scans"])
+        self.assertNotIn("test_schools", summary["seq_scans"])
+
+    def test_count_query_without_primary_key(self):
+        """Areas keyed by ctid still count through the index."""
+        summary = self.explain(self.job("test_areas_nokey"), count_query)
+        self.assertIn("test_schools_geom_gist", summary["index_scans"])
+
+    def test_population_query_reads_only_areas(self):
+        """Fetching areas is one scan of the population table, without joins."""
+        summary = self.explain(self.job(), population_query, allow_seqscan=True)
+        self.assertEqual(summary["seq_scans"], ["test_areas"])
+        for join in ("Hash Join", "Merge Join"):
+            self.assertNotIn(join, summary["node_types"])
+
+    def test_round_trips_per_run(self):
+        """A run costs the catalog lookups once, then two queries."""
+        trace = RunTrace(enabled=True)
+        table = compute_needed_schools(trace.cursor(self.cursor), self.job(), trace)
+        self.assertEqual(trace.queries, COLD_ROUND_TRIPS)
+        self.assertEqual(len(table), AREA_GRID * AREA_GRID)
+        self.assertEqual(int(table.existing.sum()), SCHOOL_COUNT)
+
+        trace = RunTrace(enabled=True)
+        compute_needed_schools(trace.cursor(self.cursor), self.job(), trace)
+        self.assertEqual(trace.queries, WARM_ROUND_TRIPS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+# coding=utf-8
+"""Tests for the output rendering profile helpers."""
+
+import unittest
+
+from ..rendering import quantile_breaks
+
+
+class RenderingTest(unittest.TestCase):
+    """Test class breaks computed for the graduated renderer."""
+
+    def test_quantile_breaks(self):
+        """Upper bounds split the values into equal-sized classes."""
+        self.assertEqual(quantile_breaks(list(range(1, 11)), classes=5), [2, 4, 6, 8, 10])
+
+    def test_quantile_breaks_collapse_duplicates(self):
+        """Repeated values do not produce empty classes."""
+        self.assertEqual(quantile_breaks([0, 0, 0, 0, 3], classes=5), [0, 3])
+
+    def test_quantile_breaks_empty(self):
+        """No values means no classes."""
+        self.assertEqual(quantile_breaks([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
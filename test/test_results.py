@@ -0,0 +1,54 @@
+# coding=utf-8
+"""Tests for the columnar result table."""
+
+import struct
+import unittest
+
+from ..results import ResultTable
+
+
+def point_wkb(x, y):
+    """POINT(x y) as little-endian WKB."""
+    return b"\x01" + struct.pack("<Idd", 1, x, y)
+
+
+AREAS = [
+    (1, "Likangala", 4600, 35.3, -15.4, point_wkb(35.3, -15.4)),
+    (2, None, 900, 35.5, -15.6, point_wkb(35.5, -15.6)),
+]
+
+
+class ResultTableTest(unittest.TestCase):
+    """Test building, slicing and serialising result tables."""
+
+    def test_from_areas(self):
+        """Counts are joined by key, missing labels fall back to the id."""
+        table = ResultTable.from_areas(AREAS, {1: 2}, 1000)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.rows(), [
+            ["1", "Likangala", 4600.0, 5, 2, 3, 35.3, -15.4],
+            ["2", "2", 900.0, 1, 0, 1, 35.5, -15.6],
+        ])
+        self.assertEqual(table.wkb_at(1), point_wkb(35.5, -15.6))
+
+    def test_concat_keeps_geometry_offsets(self):
+        """Geometries of later tables stay addressable after stacking."""
+        first = ResultTable.from_areas(AREAS[:1], {}, 1000)
+        second = ResultTable.from_areas(AREAS[1:], {}, 1000)
+        table = ResultTable.concat([first, ResultTable.empty(), second])
+        self.assertEqual(table.area_ids.tolist(), ["1", "2"])
+        self.assertEqual(table.wkb_at(0), point_wkb(35.3, -15.4))
+        self.assertEqual(table.wkb_at(1), point_wkb(35.5, -15.6))
+        self.assertEqual(table.rows(1, 2)[0][0], "2")
+
+    def test_bytes_round_trip(self):
+        """A table survives serialisation unchanged."""
+        table = ResultTable.from_areas(AREAS, {2: 3}, 500)
+        restored = ResultTable.from_bytes(table.to_bytes())
+        self.assertEqual(restored.rows(), table.rows())
+        self.assertEqual(restored.wkb, table.wkb)
+        self.assertEqual(len(restored.without_geometry().wkb), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# coding=utf-8
+"""Tests for the growth scenario engine."""
+
+import unittest
+
+from ..scenarios import ScenarioMatrix, evaluate, parse_numbers
+
+
+class ScenarioTest(unittest.TestCase):
+    """Test scenario parsing and the broadcast evaluation."""
+
+    def test_parse_numbers_expands_ranges(self):
+        """Year ranges expand to every year; plain values are cast."""
+        self.assertEqual(parse_numbers("2025-2027, 2030", int), [2025, 2026, 2027, 2030])
+        self.assertEqual(parse_numbers("0.02,0.03"), [0.02, 0.03])
+        self.assertEqual(parse_numbers(""), [])
+
+    def test_evaluate_matches_per_scenario_formula(self):
+        """Every cube column equals a single run at the projected population."""
+        matrix = ScenarioMatrix([0.0, 0.1], [2018, 2020], [500, 1000], base_year=2018)
+        cube = evaluate(["a", "b"], [1000, 4000], [1, 5], matrix)
+        self.assertEqual(cube.shortfall.shape, (2, 8))
+        self.assertEqual(cube.labels[5], "g10_y2018_c1000")
+        for column, label in enumerate(cube.labels):
+            rate = float(label.split("_")[0][1:]) / 100
+            year = int(label.split("_")[1][1:])
+            capacity = float(label.split("_")[2][1:])
+            for row, (population, existing) in enumerate([(1000, 1), (4000, 5)]):
+                expected = round(population * (1 + rate) ** (year - 2018) / capacity)
+                self.assertEqual(cube.expected[row, column], expected)
+                self.assertEqual(cube.shortfall[row, column], max(0, expected - existing))
+
+    def test_matrix_rejects_empty_axes(self):
+        """A matrix without years cannot be evaluated."""
+        with self.assertRaises(ValueError):
+            ScenarioMatrix([0.02], [], [1000])
+
+
+if __name__ == "__main__":
+    unittest.main()
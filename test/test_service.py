@@ -0,0 +1,137 @@
+# coding=utf-8
+"""Tests for the JSON service and its shared result cache.
+
+The HTTP tests run against a disposable PostGIS database (see
+``postgis_fixture``) and are skipped when none is available.
+"""
+
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from ..database import create_pool, metadata_cache
+from ..service import NeededSchoolsService, ResultCache, create_server, job_from_parameters
+from .postgis_fixture import AREA_GRID, DisposablePostgis
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Test expiry, eviction and coalescing of the cache."""
+
+    def test_hits_until_expired(self):
+        now = [0.0]
+        cache = ResultCache(max_entries=4, max_age=10, clock=lambda: now[0])
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)
+        self.assertEqual(cache.get_or_compute("a", compute), 1)
+        now[0] = 10
+        self.assertEqual(cache.get_or_compute("a", compute), 1)
+        now[0] = 10.5
+        self.assertEqual(cache.get_or_compute("a", compute), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(max_entries=2)
+        cache.get_or_compute("a", lambda: "a")
+        cache.get_or_compute("b", lambda: "b")
+        cache.get_or_compute("a", lambda: "recomputed")
+        cache.get_or_compute("c", lambda: "c")
+        self.assertEqual(cache.get_or_compute("a", lambda: "recomputed"), "a")
+        self.assertEqual(cache.get_or_compute("b", lambda: "recomputed"), "recomputed")
+
+    def test_concurrent_requests_share_one_computation(self):
+        cache = ResultCache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "value"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("key", compute)))
+                   for _ in range(8)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while cache.stats()["coalesced"] < 7:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 8)
+
+    def test_failures_are_shared_but_not_cached(self):
+        cache = ResultCache()
+
+        def fail():
+            raise RuntimeError("database down")
+
+        self.assertRaises(RuntimeError, cache.get_or_compute, "key", fail)
+        self.assertEqual(cache.get_or_compute("key", lambda: "value"), "value")
+        self.assertEqual(cache.stats()["running"], 0)
+
+    def test_job_parameters(self):
+        job, geometry = job_from_parameters({"population_table": "areas", "schools_table": "schools",
+                                             "population_field": "pop", "students_per_school": "800",
+                                             "geometry": "true"})
+        self.assertEqual((job.students_per_school, geometry), (800, True))
+        self.assertRaises(ValueError, job_from_parameters, {"population_table": "areas"})
+        self.assertRaises(ValueError, job_from_parameters, {"population_table": "a", "schools_table": "s",
+                                                            "population_field": "p", "region": "North"})
+
+
+class ServiceTest(unittest.TestCase):
+    """Test the HTTP endpoints against the synthetic tables."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database = DisposablePostgis()
+        cls.database.start()
+        metadata_cache.clear()
+        cls.service = NeededSchoolsService(create_pool(4, cls.database.dsn), 4)
+        cls.server = create_server(cls.service, port=0)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.service.close()
+        cls.database.stop()
+        metadata_cache.clear()
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path, timeout=60) as response:
+            return json.loads(response.read())
+
+    def test_needed_schools_is_cached(self):
+        path = "/needed-schools?population_table=test_areas&schools_table=test_schools&population_field=pop2024"
+        first = self.get(path)
+        second = self.get(path)
+        self.assertEqual(first["totals"]["areas"], AREA_GRID * AREA_GRID)
+        self.assertEqual(first, second)
+        self.assertGreaterEqual(self.get("/stats")["hits"], 1)
+
+    def test_post_and_errors(self):
+        request = urllib.request.Request(
+            self.url + "/needed-schools", method="POST",
+            data=json.dumps({"population_table": "test_areas", "schools_table": "test_schools",
+                             "population_field": "pop2024", "students_per_school": 500}).encode("utf-8"))
+        with urllib.request.urlopen(request, timeout=60) as response:
+            self.assertEqual(json.loads(response.read())["students_per_school"], 500)
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            self.get("/needed-schools?population_table=test_areas")
+        self.assertEqual(raised.exception.code, 400)
+        self.assertIn("test_areas", self.get("/tables")["tables"])
+
+
+if __name__ == "__main__":
+    unittest.main()
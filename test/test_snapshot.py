@@ -0,0 +1,67 @@
+# coding=utf-8
+"""Tests for reading offline snapshots."""
+
+import os
+import sqlite3
+import struct
+import tempfile
+import unittest
+
+from ..instrumentation import RunTrace
+from ..snapshot import compute_from_snapshot, gpkg_to_wkb, snapshot_job
+
+# POINT(1 2) as little-endian WKB
+POINT_WKB = b"\x01" + struct.pack("<Idd", 1, 1.0, 2.0)
+
+
+def gpkg_blob(wkb, envelope=1):
+    """GeoPackage geometry blob with an XY envelope (indicator 1) or none (0)."""
+    header = b"GP\x00" + bytes([0x01 | (envelope << 1)]) + struct.pack("<i", 4326)
+    return header + (struct.pack("<4d", 1.0, 1.0, 2.0, 2.0) if envelope else b"") + wkb
+
+
+class SnapshotTest(unittest.TestCase):
+    """Test the SQLite reader used for DB-free runs."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".gpkg")
+        os.close(handle)
+        connection = sqlite3.connect(self.path)
+        connection.executescript("""
+            CREATE TABLE areas (fid INTEGER PRIMARY KEY, geom BLOB, area_id TEXT, label TEXT, population REAL,
+                                label_x REAL, label_y REAL, school_count INTEGER);
+            CREATE TABLE snapshot_info (fid INTEGER PRIMARY KEY, "key" TEXT, "value" TEXT);
+        """)
+        connection.executemany("INSERT INTO areas VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+            (1, gpkg_blob(POINT_WKB), "10", "Likangala", 4600.0, 1.0, 2.0, 2),
+            (2, gpkg_blob(POINT_WKB, 0), "11", None, 900.0, 1.0, 2.0, 0),
+        ])
+        connection.executemany('INSERT INTO snapshot_info ("key", "value") VALUES (?, ?)', [
+            ("population_table", "zomba_adm3"), ("schools_table", "zomba_schools"), ("population_field", "pop2024"),
+        ])
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_gpkg_to_wkb_skips_envelope(self):
+        """The header and envelope are stripped whatever the envelope size."""
+        self.assertEqual(gpkg_to_wkb(gpkg_blob(POINT_WKB)), POINT_WKB)
+        self.assertEqual(gpkg_to_wkb(gpkg_blob(POINT_WKB, 0)), POINT_WKB)
+        self.assertRaises(ValueError, gpkg_to_wkb, POINT_WKB)
+
+    def test_compute_from_snapshot(self):
+        """Stored counts and populations give the same rows as a database run."""
+        job = snapshot_job(self.path, 1000)
+        self.assertEqual(job.population_table, "zomba_adm3")
+        table = compute_from_snapshot(self.path, job, RunTrace(enabled=False))
+        self.assertEqual(table.rows(), [
+            ["10", "Likangala", 4600.0, 5, 2, 3, 1.0, 2.0],
+            ["11", "11", 900.0, 1, 0, 1, 1.0, 2.0],
+        ])
+        self.assertEqual(table.wkb_at(0), POINT_WKB)
+
+
+if __name__ == "__main__":
+    unittest.main()
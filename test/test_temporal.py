@@ -0,0 +1,82 @@
+# coding=utf-8
+"""Tests for the as-of-date school counts."""
+
+import csv
+import datetime
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..analysis import AnalysisJob
+from ..database import metadata_cache
+from ..results import ResultTable
+from ..temporal import SchoolIntervals, as_of_columns, fetch_intervals, parse_dates, write_as_of
+from .utilities import ScriptedCursor
+
+
+CATALOG = [
+    [("gid",), ("adm3_en",), ("pop2024",), ("geom",)],   # population table columns
+    [("geom", 4326)],                                     # population geometry column
+    [("geom", 32736)],                                    # schools geometry column
+    [("gid",)],                                           # primary key
+    [("id",), ("opened",), ("closed",), ("geom",)],       # schools table columns
+]
+AREAS = [(1, "Likangala", 4600, 35.3, -15.4, b""), (2, "Chingale", 900, 35.5, -15.6, b"")]
+D = datetime.date
+
+
+class TemporalTest(unittest.TestCase):
+    """Test the interval sweep against a per-date count."""
+
+    def setUp(self):
+        metadata_cache.clear()
+
+    def test_parse_dates(self):
+        self.assertEqual(parse_dates("2018-2019, 2024-06-30"), [D(2018, 12, 31), D(2019, 12, 31), D(2024, 6, 30)])
+        self.assertRaises(ValueError, parse_dates, "June 2024")
+
+    def test_sweep_matches_counting_every_date(self):
+        generator = np.random.default_rng(3)
+        rows = []
+        for _ in range(300):
+            opened = D(2000, 1, 1) + datetime.timedelta(days=int(generator.integers(0, 9000)))
+            closed = opened + datetime.timedelta(days=int(generator.integers(-100, 6000)))
+            rows.append((int(generator.integers(1, 6)), None if generator.random() < 0.1 else opened,
+                         None if generator.random() < 0.5 else closed, int(generator.integers(1, 3))))
+        dates = parse_dates("2024, 2003-2010") + [D(2005, 3, 1)]
+        counts = SchoolIntervals.from_rows(rows, ["1", "2", "3", "4", "5"]).counts(dates)
+        for area in range(5):
+            for index, date in enumerate(dates):
+                expected = sum(schools for key, opened, closed, schools in rows
+                               if key == area + 1 and (opened is None or opened <= date)
+                               and (closed is None or date < closed) and (opened is None or closed is None
+                                                                          or opened < closed))
+                self.assertEqual(counts[area, index], expected, (area, date))
+
+    def test_columns_from_the_database(self):
+        rows = [(1, D(2010, 1, 10), None, 2), (1, D(2020, 5, 1), None, 1), (1, None, D(2015, 1, 1), 1),
+                (2, D(2019, 1, 1), D(2019, 6, 1), 1)]
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000)
+        fetched = fetch_intervals(ScriptedCursor(CATALOG + [rows]), job, "opened", "closed")
+        table = ResultTable.from_areas(AREAS, {1: 3}, 1000)
+        intervals = SchoolIntervals.from_rows(fetched, table.area_ids.tolist())
+        columns = as_of_columns(table, intervals, [D(2012, 12, 31), D(2019, 3, 1), D(2024, 12, 31)])
+        self.assertEqual(columns["Existing_20121231"].tolist(), [3, 0])
+        self.assertEqual(columns["Existing_20190301"].tolist(), [2, 1])
+        self.assertEqual(columns["Shortfall_20190301"].tolist(), [3, 0])
+        self.assertEqual(columns["Existing_20241231"].tolist(), [3, 0])
+        self.assertRaises(ValueError, fetch_intervals, ScriptedCursor([]), job, "founded", None)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_as_of(table, columns, "Needed Schools", directory)
+            with open(path, newline="", encoding="utf-8") as handle:
+                rows = list(csv.reader(handle))
+            self.assertEqual(rows[0][1:3], ["Existing_20121231", "Shortfall_20121231"])
+            self.assertEqual(rows[1][:3], ["1", "3", "2"])
+            self.assertTrue(os.path.exists(os.path.splitext(path)[0] + ".csvt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# coding=utf-8
+"""Tests for tile planning and checkpoints."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..analysis import AnalysisJob
+from ..results import ResultTable
+from ..tiling import TileCheckpoint, grid_tiles, split_tile
+
+
+class TilingTest(unittest.TestCase):
+    """Test tile geometry helpers and the checkpoint store."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_grid_tiles_cover_extent(self):
+        """Tiles share edges and the last row/column reach the extent's maximum."""
+        tiles = grid_tiles((0.0, 0.0, 4.0, 2.0), 2)
+        self.assertEqual(len(tiles), 4)
+        self.assertEqual(tiles[0], (0.0, 0.0, 2.0, 1.0))
+        self.assertEqual(tiles[-1], (2.0, 1.0, 4.0, 2.0))
+
+    def test_split_tile(self):
+        """A tile splits into four quadrants."""
+        quadrants = split_tile((0.0, 0.0, 2.0, 2.0))
+        self.assertIn((1.0, 1.0, 2.0, 2.0), quadrants)
+        self.assertEqual(len(quadrants), 4)
+
+    def test_checkpoint_resumes_same_run(self):
+        """Finished tiles survive reopening, and another tiling gets another file."""
+        job = AnalysisJob("zomba_adm3", "zomba_schools", "pop2024", 1000)
+        tiles = grid_tiles((0.0, 0.0, 1.0, 1.0), 2)
+        checkpoint = TileCheckpoint.for_run(job, tiles, self.directory)
+        checkpoint.save(0, ResultTable.empty())
+        checkpoint.save(2, ResultTable.empty())
+        checkpoint.connection.close()
+
+        resumed = TileCheckpoint.for_run(job, tiles, self.directory)
+        self.assertEqual(resumed.finished_tiles(), {0, 2})
+        other = TileCheckpoint.for_run(job, grid_tiles((0.0, 0.0, 1.0, 1.0), 3), self.directory)
+        self.assertNotEqual(other.path, resumed.path)
+        self.assertEqual(other.finished_tiles(), set())
+        other.remove()
+        resumed.remove()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# coding=utf-8
+"""Tests for the Monte Carlo shortfall bands."""
+
+import csv
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..results import ResultTable
+from ..uncertainty import shortfall_bands, write_bands
+
+AREAS = [(1, "Likangala", 46000, 35.3, -15.4, b""), (2, "Chingale", 900, 35.5, -15.6, b"")]
+
+
+class UncertaintyTest(unittest.TestCase):
+    """Test the sampled percentiles against known distributions."""
+
+    def test_no_uncertainty_gives_the_point_estimate(self):
+        """Zero spread gives the point estimate in every band."""
+        bands = shortfall_bands([46000, 900], [3, 0], 1000, 0, 0, samples=50)
+        np.testing.assert_array_equal(bands.areas, [[43, 43, 43], [1, 1, 1]])
+        np.testing.assert_array_equal(bands.total, [44, 44, 44])
+
+    def test_bands_follow_the_lognormal_quantiles(self):
+        """Bands follow the quantiles of a mean-one lognormal population."""
+        population_sd = 0.2
+        bands = shortfall_bands([1e6], [0], 1, population_sd, 0, samples=20000, seed=1)
+        sigma = np.sqrt(np.log1p(population_sd ** 2))
+        # Quantiles of a mean-one lognormal at z = -1.2816, 0 and 1.2816
+        expected = 1e6 * np.exp(np.array([-1.2816, 0, 1.2816]) * sigma - sigma ** 2 / 2)
+        np.testing.assert_allclose(bands.areas[0], expected, rtol=0.01)
+        self.assertTrue(np.all(np.diff(bands.areas[0]) > 0))
+
+    def test_reproducible_and_written(self):
+        """A fixed seed repeats the bands, and they are written as CSV."""
+        table = ResultTable.from_areas(AREAS, {1: 40}, 1000)
+        first = shortfall_bands(table.population, table.existing, 1000, 0.1, 0.1, samples=500, seed=5)
+        second = shortfall_bands(table.population, table.existing, 1000, 0.1, 0.1, samples=500, seed=5)
+        np.testing.assert_array_equal(first.areas, second.areas)
+        with tempfile.TemporaryDirectory() as directory:
+            with open(write_bands(table, first, "Needed Schools", directory), newline="", encoding="utf-8") as handle:
+                rows = list(csv.reader(handle))
+        self.assertEqual(rows[0][1:], ["Shortfall_P10", "Shortfall_P50", "Shortfall_P90"])
+        self.assertEqual(len(rows), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
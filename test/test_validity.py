@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Tests for the validity check and repair of the population polygons.
+
+The repair tests run against a disposable PostGIS database (see
+``postgis_fixture``) and are skipped when none is available.
+"""
+
+import unittest
+
+import psycopg2
+
+from ..analysis import AnalysisJob, compute_needed_schools
+from ..database import metadata_cache
+from ..instrumentation import RunTrace
+from ..validity import REPAIRS_TABLE, valid_table
+from .postgis_fixture import DisposablePostgis
+from .utilities import ScriptedCursor
+
+
+class PermissionDenied(psycopg2.DatabaseError):
+    pgcode = "42501"
+
+
+class ValidTableTest(unittest.TestCase):
+    """Test that valid tables are used as they are."""
+
+    def setUp(self):
+        metadata_cache.clear()
+
+    def test_valid_table_is_kept(self):
+        # savepoint, geometry column, create repairs table, insert new hashes, count repaired areas, release
+        cursor = ScriptedCursor([None, [("geom", 4326)], None, [(False,), (False,)], [(0,)], None])
+        self.assertEqual(valid_table(cursor, "zomba_adm3"), ("zomba_adm3", 0))
+        self.assertFalse(cursor.answers)
+
+    def test_unchanged_copy_is_reused(self):
+        # savepoint, geometry column, create, insert, count, fingerprint, existing copy's comment, release
+        cursor = ScriptedCursor([None, [("geom", 4326)], None, [], [(1,)], [("2:123",)],
+                                 [(True, "Needed Schools repaired copy 2:123")], None])
+        self.assertEqual(valid_table(cursor, "zomba_adm3"), ("zomba_adm3_valid", 1))
+        self.assertFalse(cursor.answers)
+
+    def test_read_only_role_counts_unrepaired(self):
+        # savepoint, geometry column, refused create, rollback to savepoint, read-only invalid count
+        cursor = ScriptedCursor([None, [("geom", 4326)], PermissionDenied("permission denied for schema public"),
+                                 None, [(2,)]])
+        self.assertEqual(valid_table(cursor, "zomba_adm3"), ("zomba_adm3", 0))
+        self.assertFalse(cursor.answers)
+        self.assertEqual(cursor.queries[3], "ROLLBACK TO SAVEPOINT needed_schools_repairs")
+
+
+# A bow-tie area that holds two schools, next to a valid one holding one
+INVALID_AREAS = """
+    DROP TABLE IF EXISTS bowtie_areas, bowtie_areas_valid, bowtie_schools, {repairs};
+    CREATE TABLE bowtie_areas (gid serial PRIMARY KEY, adm3_en text, pop2024 numeric, geom geometry(Polygon, 4326));
+    INSERT INTO bowtie_areas (adm3_en, pop2024, geom) VALUES
+        ('Bowtie', 3000, ST_GeomFromText('POLYGON((35 -15, 35.1 -14.9, 35.1 -15, 35 -14.9, 35 -15))', 4326)),
+        ('Square', 1000, ST_MakeEnvelope(35.2, -15, 35.3, -14.9, 4326));
+    CREATE TABLE bowtie_schools (id serial PRIMARY KEY, geom geometry(Point, 4326));
+    INSERT INTO bowtie_schools (geom) VALUES
+        (ST_SetSRID(ST_MakePoint(35.01, -14.95), 4326)), (ST_SetSRID(ST_MakePoint(35.09, -14.95), 4326)),
+        (ST_SetSRID(ST_MakePoint(35.25, -14.95), 4326));
+""".format(repairs=REPAIRS_TABLE)
+
+
+class RepairTest(unittest.TestCase):
+    """Test the repair of a self-intersecting area and the reuse of stored repairs."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database = DisposablePostgis()
+        cls.connection = cls.database.start()
+        cursor = cls.connection.cursor()
+        cursor.execute(INVALID_AREAS)
+        cls.connection.commit()
+        metadata_cache.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.database.stop()
+        metadata_cache.clear()
+
+    def test_repaired_areas_are_counted(self):
+        cursor = self.connection.cursor()
+        table, invalid = valid_table(cursor, "bowtie_areas")
+        self.assertEqual((table, invalid), ("bowtie_areas_valid", 1))
+        self.connection.commit()
+
+        job = AnalysisJob(table, "bowtie_schools", "pop2024", 1000)
+        counts = compute_needed_schools(cursor, job, RunTrace(enabled=False)).existing.tolist()
+        self.assertEqual(sorted(counts), [1, 2])
+
+        # The second run finds every hash stored, repairs nothing new and keeps the copy
+        cursor.execute(f"SELECT count(*) FROM {REPAIRS_TABLE}")
+        stored = cursor.fetchone()[0]
+        cursor.execute("SELECT 'bowtie_areas_valid'::regclass::oid")
+        copy = cursor.fetchone()[0]
+        self.assertEqual(valid_table(cursor, "bowtie_areas"), ("bowtie_areas_valid", 1))
+        cursor.execute(f"SELECT count(*) FROM {REPAIRS_TABLE}")
+        self.assertEqual(cursor.fetchone()[0], stored)
+        cursor.execute("SELECT 'bowtie_areas_valid'::regclass::oid")
+        self.assertEqual(cursor.fetchone()[0], copy)
+
+        # A changed population table gets a fresh copy
+        cursor.execute("UPDATE bowtie_areas SET pop2024 = pop2024 + 1")
+        self.assertEqual(valid_table(cursor, "bowtie_areas"), ("bowtie_areas_valid", 1))
+        cursor.execute("SELECT pop2024 FROM bowtie_areas_valid WHERE adm3_en = 'Bowtie'")
+        self.assertEqual(cursor.fetchone()[0], 3001)
+        self.connection.rollback()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# coding=utf-8
+"""Tests for the vector tile export."""
+
+import gzip
+import os
+import sqlite3
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..vector_tiles import EXTENT, clip_ring, encode_tile, ring_area, tile_rings, write_mbtiles
+
+
+def polygon_wkb(*rings):
+    """Little-endian WKB polygon of closed ``rings``."""
+    data = struct.pack("<BII", 1, 3, len(rings))
+    for ring in rings:
+        data += struct.pack("<I", len(ring)) + np.asarray(ring, dtype="<f8").tobytes()
+    return data
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def read_message(data):
+    """``{field number: [values]}`` of a protocol buffer message."""
+    fields = {}
+    offset = 0
+    while offset < len(data):
+        key, offset = read_varint(data, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, offset = read_varint(data, offset)
+        elif wire_type == 1:
+            value, offset = data[offset:offset + 8], offset + 8
+        else:
+            length, offset = read_varint(data, offset)
+            value, offset = data[offset:offset + length], offset + length
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def read_packed(data):
+    values, offset = [], 0
+    while offset < len(data):
+        value, offset = read_varint(data, offset)
+        values.append(value)
+    return values
+
+
+def decode_rings(commands):
+    """Rings of MVT polygon command integers, in tile coordinates."""
+    rings, x, y, index = [], 0, 0, 0
+    while index < len(commands):
+        command, count = commands[index] & 7, commands[index] >> 3
+        index += 1
+        if command == 7:
+            continue
+        for _ in range(count):
+            dx, dy = commands[index], commands[index + 1]
+            index += 2
+            x += (dx >> 1) ^ -(dx & 1)
+            y += (dy >> 1) ^ -(dy & 1)
+            if command == 1:
+                rings.append([])
+            rings[-1].append((x, y))
+    return [np.array(ring) for ring in rings]
+
+
+SQUARE = [(35.0, -15.0), (35.2, -15.0), (35.2, -14.8), (35.0, -14.8), (35.0, -15.0)]
+HOLE = [(35.05, -14.95), (35.05, -14.85), (35.15, -14.85), (35.15, -14.95), (35.05, -14.95)]
+FIELDS = ["Area_Id", "Location_Name", "Population", "Schools_that_are_supposed_to_be_built"]
+
+
+class VectorTileTest(unittest.TestCase):
+    """Test clipping, encoding and the MBTiles layout."""
+
+    def test_clip_keeps_the_part_inside(self):
+        square = np.array([[-100, -100], [100, -100], [100, 100], [-100, 100]])
+        clipped = clip_ring(square, 0, 50)
+        self.assertAlmostEqual(abs(ring_area(clipped)), 2500)
+
+    def test_rings_are_wound_for_mvt(self):
+        # Counter-clockwise exterior in tile coordinates, with a hole wound the same way
+        exterior = np.array([[0, 0], [0, 1000], [1000, 1000], [1000, 0]])
+        hole = np.array([[200, 200], [200, 800], [800, 800], [800, 200]])
+        rings = tile_rings([[exterior, hole]], 0, 0)
+        self.assertGreater(ring_area(rings[0]), 0)
+        self.assertLess(ring_area(rings[1]), 0)
+
+    def test_tile_round_trip(self):
+        ring = np.array([[10, 10], [10, 20], [20, 20], [20, 10]])[::-1]
+        layer = read_message(read_message(encode_tile([(7, [ring], ["a1", "Likangala", 4600.0, 3])], FIELDS))[3][0])
+        self.assertEqual(layer[1], [b"needed_schools"])
+        self.assertEqual(layer[5], [EXTENT])
+        self.assertEqual(layer[3], [name.encode("utf-8") for name in FIELDS])
+        feature = read_message(layer[2][0])
+        self.assertEqual((feature[1], feature[3]), ([7], [3]))
+        np.testing.assert_array_equal(decode_rings(read_packed(feature[4][0]))[0], ring)
+        values = [read_message(value) for value in layer[4]]
+        self.assertEqual(values[1][1], [b"Likangala"])
+        self.assertEqual(struct.unpack("<d", values[2][3][0])[0], 4600.0)
+        self.assertEqual(values[3][6], [6])
+
+    def test_mbtiles_pyramid(self):
+        rows = [(["1", "Likangala", 4600.0, 3], polygon_wkb(SQUARE, HOLE)),
+                (["2", "Chingale", 900.0, 0], polygon_wkb([(x + 0.3, y) for x, y in SQUARE]))]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.mbtiles")
+            count = write_mbtiles(path, FIELDS, rows, 4, 10, workers=1)
+            pooled_path = os.path.join(directory, "pooled.mbtiles")
+            self.assertEqual(write_mbtiles(pooled_path, FIELDS, rows, 4, 10, workers=2), count)
+            with sqlite3.connect(path) as connection:
+                tiles = connection.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles "
+                                           "ORDER BY 1, 2, 3").fetchall()
+                metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+            with sqlite3.connect(pooled_path) as connection:
+                pooled = connection.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles "
+                                            "ORDER BY 1, 2, 3").fetchall()
+        self.assertEqual(tiles, pooled)
+        self.assertEqual(count, len(tiles))
+        self.assertEqual(sorted({tile[0] for tile in tiles}), list(range(4, 11)))
+        self.assertEqual((metadata["format"], metadata["minzoom"], metadata["maxzoom"]), ("pbf", "4", "10"))
+        # Zoom 4 tile x=9, y=8 (XYZ) holds both areas; MBTiles rows count from the south
+        zoom, column, row, data = tiles[0]
+        self.assertEqual((zoom, column, row), (4, 9, 2 ** 4 - 1 - 8))
+        layer = read_message(read_message(gzip.decompress(data))[3][0])
+        self.assertEqual(len(layer[2]), 2)
+        # The hole survives at zoom 10
+        top = [tile for tile in tiles if tile[0] == 10]
+        ring_counts = [len(decode_rings(read_packed(read_message(feature)[4][0])))
+                       for tile in top for feature in read_message(read_message(gzip.decompress(tile[3]))[3][0])[2]]
+        self.assertIn(2, ring_counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
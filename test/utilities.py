@@ -12,6 +12,39 @@ PARENT = None
 IFACE = None
 
 
+class ScriptedCursor(object):
+    """Cursor stand-in that answers queries from a fixed script, in order.
+
+    An exception in the script is raised by the query it answers.  The
+    queries and their parameters are kept for inspection.
+    """
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.queries = []
+        self.params = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        self.params.append(params)
+        self.current = self.answers.pop(0)
+        if isinstance(self.current, Exception):
+            raise self.current
+
+    def fetchone(self):
+        return self.current[0] if self.current else None
+
+    def fetchall(self):
+        return list(self.current)
+
+
+class DiscardingSink(object):
+    """Result sink stand-in that drops every table it is given."""
+
+    def write_table(self, table, leading=()):
+        pass
+
+
 def get_qgis_app():
     """ Start one QGIS application to test against.
 
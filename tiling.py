@@ -0,0 +1,198 @@
+"""Tiled, resumable execution of a needed-schools job.
+
+The population extent is split into tiles, either a regular grid or a
+quadtree that keeps splitting tiles holding too many schools.  Every tile is
+computed on its own, so only one tile's areas are held in memory, and its
+result table is stored in a SQLite checkpoint before moving on.  A failed or
+interrupted run keeps its checkpoint; running the same job again replays the
+finished tiles and only computes the rest.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+
+from qgis.core import Qgis, QgsSettings
+from psycopg2 import sql
+
+from .analysis import OUTPUT_SRID, compute_needed_schools, geometry_sql, resolve_mapping
+from .instrumentation import log_message
+from .results import ResultTable
+
+SETTING_TILE_GRID = "needed_schools/tile_grid"
+SETTING_TILE_MAX_SCHOOLS = "needed_schools/tile_max_schools"
+SETTING_CHECKPOINT_DIR = "needed_schools/checkpoint_dir"
+DEFAULT_TILE_GRID = 8
+MAX_QUADTREE_DEPTH = 8
+# Part of the checkpoint file name so files written in an older layout are never resumed
+CHECKPOINT_FORMAT = 2
+
+# Widens the extent so areas on its upper edges fall inside the last tiles
+EDGE_MARGIN = 1e-9
+
+
+def population_extent(cursor, job, mapping):
+    """Bounding box of the label points of the job's areas, in EPSG:4326."""
+    where = sql.SQL("")
+    params = []
+    if job.partition_column is not None:
+        where = sql.SQL(" WHERE {} = %s").format(sql.Identifier("p", job.partition_column))
+        params = [job.region]
+    cursor.execute(sql.SQL(
+        "SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) "
+        "FROM (SELECT ST_Extent(ST_PointOnSurface({geom})) AS e FROM {population_layer} p{where}) extent"
+    ).format(
+        geom=geometry_sql("p", mapping.geometry_column, mapping.srid, OUTPUT_SRID),
+        population_layer=sql.Identifier(job.population_table),
+        where=where
+    ), params)
+    xmin, ymin, xmax, ymax = cursor.fetchone()
+    if xmin is None:
+        return None
+    return xmin, ymin, xmax + EDGE_MARGIN, ymax + EDGE_MARGIN
+
+
+def grid_tiles(extent, columns, rows=None):
+    """Split ``extent`` into a ``columns`` x ``rows`` grid of tiles."""
+    rows = rows or columns
+    xmin, ymin, xmax, ymax = extent
+    width = (xmax - xmin) / columns
+    height = (ymax - ymin) / rows
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            tiles.append((
+                xmin + column * width,
+                ymin + row * height,
+                xmax if column == columns - 1 else xmin + (column + 1) * width,
+                ymax if row == rows - 1 else ymin + (row + 1) * height,
+            ))
+    return tiles
+
+
+def split_tile(tile):
+    """The four quadrants of ``tile``."""
+    xmin, ymin, xmax, ymax = tile
+    xmid = (xmin + xmax) / 2
+    ymid = (ymin + ymax) / 2
+    return [(xmin, ymin, xmid, ymid), (xmid, ymin, xmax, ymid), (xmin, ymid, xmid, ymax), (xmid, ymid, xmax, ymax)]
+
+
+def quadtree_tiles(cursor, job, mapping, extent, max_schools, max_depth=MAX_QUADTREE_DEPTH):
+    """Split ``extent`` until no tile holds more than ``max_schools`` schools.
+
+    Dense urban areas end up in small tiles and empty countryside in large
+    ones, which keeps the work per tile roughly even.
+    """
+    schools_srid = mapping.schools_srid or OUTPUT_SRID
+    counting = sql.SQL(
+        "SELECT COUNT(*) FROM {schools_layer} s WHERE {school_geom} && ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, {srid}), {schools_srid})"
+    ).format(
+        schools_layer=sql.Identifier(job.schools_table),
+        school_geom=geometry_sql("s", mapping.schools_geometry_column, mapping.schools_srid, schools_srid),
+        srid=sql.Literal(OUTPUT_SRID),
+        schools_srid=sql.Literal(schools_srid)
+    )
+    tiles = []
+    pending = [(extent, 0)]
+    while pending:
+        tile, depth = pending.pop()
+        cursor.execute(counting, list(tile))
+        if cursor.fetchone()[0] > max_schools and depth < max_depth:
+            pending.extend((quadrant, depth + 1) for quadrant in split_tile(tile))
+        else:
+            tiles.append(tile)
+    return sorted(tiles, key=lambda tile: (tile[1], tile[0]))
+
+
+def plan_tiles(cursor, job, grid=None, max_schools=None):
+    """Tiles for ``job`` as configured in the QGIS settings, or by the arguments."""
+    settings = QgsSettings()
+    if grid is None:
+        grid = settings.value(SETTING_TILE_GRID, DEFAULT_TILE_GRID, type=int)
+    if max_schools is None:
+        max_schools = settings.value(SETTING_TILE_MAX_SCHOOLS, 0, type=int)
+
+    mapping = resolve_mapping(cursor, job)
+    extent = population_extent(cursor, job, mapping)
+    if extent is None:
+        return []
+    if max_schools > 0:
+        return quadtree_tiles(cursor, job, mapping, extent, max_schools)
+    return grid_tiles(extent, max(1, grid))
+
+
+class TileCheckpoint:
+    """SQLite file holding the result table of every finished tile of one run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tiles (tile_index INTEGER PRIMARY KEY, results BLOB);
+        """)
+
+    @classmethod
+    def for_run(cls, job, tiles, directory=None):
+        """Open the checkpoint of ``job`` split into ``tiles``, resuming an earlier run of it."""
+        if directory is None:
+            directory = QgsSettings().value(SETTING_CHECKPOINT_DIR, "", type=str) or os.path.join(
+                tempfile.gettempdir(), "needed_schools_checkpoints")
+        os.makedirs(directory, exist_ok=True)
+        signature = json.dumps([
+            CHECKPOINT_FORMAT, job.population_table, job.schools_table, job.population_field, job.students_per_school,
+            job.partition_column, str(job.region), job.label_column, job.id_column, repr(job.categories), tiles
+        ])
+        digest = hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
+        return cls(os.path.join(directory, f"{job.population_table}_{digest}.sqlite"))
+
+    def finished_tiles(self):
+        """Indexes of the tiles whose results are stored."""
+        return {row[0] for row in self.connection.execute("SELECT tile_index FROM tiles")}
+
+    def save(self, tile_index, table):
+        """Store the result table of a finished tile."""
+        with self.connection:
+            self.connection.execute("INSERT INTO tiles (tile_index, results) VALUES (?, ?)",
+                                    [tile_index, table.to_bytes()])
+
+    def table(self, tile_index):
+        """The stored result table of a tile."""
+        (data,) = self.connection.execute("SELECT results FROM tiles WHERE tile_index = ?", [tile_index]).fetchone()
+        return ResultTable.from_bytes(data)
+
+    def remove(self):
+        """Delete the checkpoint after a complete run."""
+        self.connection.close()
+        os.remove(self.path)
+
+
+def run_tiled(cursor, job, sink, trace, tiles, checkpoint):
+    """Compute ``job`` tile by tile into ``sink``.
+
+    A failing tile is logged and skipped so the others still finish; its
+    index is returned in the list of failed tiles and a later run with the
+    same checkpoint computes only the tiles that are still missing.
+    """
+    finished = checkpoint.finished_tiles()
+    failed = []
+    for tile_index, tile in enumerate(tiles):
+        if tile_index in finished:
+            with trace.span("replay checkpoint"):
+                sink.write_table(checkpoint.table(tile_index))
+            continue
+        try:
+            with trace.span("tile"):
+                table = compute_needed_schools(cursor, job.copy(tile=tile), trace)
+            with trace.span("write checkpoint"):
+                checkpoint.save(tile_index, table)
+        except Exception as error:
+            cursor.connection.rollback()
+            failed.append(tile_index)
+            log_message(f"Tile {tile_index + 1} of {len(tiles)} failed: {error}", Qgis.Warning)
+            continue
+        with trace.span("write results"):
+            sink.write_table(table)
+        log_message(f"Tile {tile_index + 1} of {len(tiles)} finished ({len(table)} area(s))")
+    return failed
@@ -0,0 +1,87 @@
+"""Uncertainty bands on the shortfall from sampled population and capacity.
+
+Population figures per area are estimates, and so is the number of
+students a school takes.  Each area's population and students per school
+are drawn thousands of times from lognormal distributions centred on the
+run's values, with the configured relative standard deviations, and the
+shortfall against the school counts the run already has is evaluated for
+all draws at once.  The 10th, 50th and 90th percentiles of every area's
+shortfall are joined to the output layer; draws are independent between
+areas, so the percentiles of the total shortfall come from the same draws.
+
+Areas are processed in blocks in single precision, so memory stays small
+however many areas and draws there are.
+"""
+import numpy as np
+from qgis.core import QgsSettings
+
+from .output_sinks import output_directory, write_area_csv
+
+SETTING_POPULATION_SD = "needed_schools/population_uncertainty"
+SETTING_CAPACITY_SD = "needed_schools/capacity_uncertainty"
+SETTING_SAMPLES = "needed_schools/uncertainty_samples"
+SETTING_SEED = "needed_schools/uncertainty_seed"
+SETTING_OUTPUT_DIR = "needed_schools/uncertainty_output_dir"
+DEFAULT_SAMPLES = 2000
+DEFAULT_SEED = 20240101
+PERCENTILES = (10, 50, 90)
+# Areas per block; block x samples single-precision arrays stay in the tens of megabytes
+BLOCK_AREAS = 2048
+
+
+def uncertainty_settings():
+    """``(population relative sd, capacity relative sd, samples, seed)``; both sds 0 means off."""
+    settings = QgsSettings()
+    return (settings.value(SETTING_POPULATION_SD, 0.0, type=float),
+            settings.value(SETTING_CAPACITY_SD, 0.0, type=float),
+            settings.value(SETTING_SAMPLES, DEFAULT_SAMPLES, type=int),
+            settings.value(SETTING_SEED, DEFAULT_SEED, type=int))
+
+
+def _lognormal_sigma(relative_sd):
+    # Lognormal with mean 1 and the given coefficient of variation
+    return float(np.sqrt(np.log1p(relative_sd ** 2)))
+
+
+class ShortfallBands:
+    """Shortfall percentiles of every area, and of the total over all areas."""
+
+    def __init__(self, percentiles, areas, total):
+        self.percentiles = tuple(percentiles)
+        self.areas = areas
+        self.total = total
+
+    def fields(self):
+        return [f"Shortfall_P{percentile}" for percentile in self.percentiles]
+
+
+def shortfall_bands(population, existing, students_per_school, population_sd, capacity_sd,
+                    samples=DEFAULT_SAMPLES, seed=DEFAULT_SEED, percentiles=PERCENTILES):
+    """``ShortfallBands`` over ``samples`` independent draws per area.
+
+    Population and capacity factors are both lognormal with mean 1; the
+    population factor divided by the capacity factor is again lognormal,
+    so one normal array per block gives the sampled schools needed.
+    """
+    population = np.asarray(population, dtype=np.float32)
+    existing = np.asarray(existing, dtype=np.float32)
+    population_sigma, capacity_sigma = _lognormal_sigma(population_sd), _lognormal_sigma(capacity_sd)
+    sigma = np.float32(np.hypot(population_sigma, capacity_sigma))
+    shift = np.float32((capacity_sigma ** 2 - population_sigma ** 2) / 2)
+    generator = np.random.default_rng(seed)
+    bands = np.empty((len(population), len(percentiles)), dtype=np.float64)
+    total = np.zeros(samples, dtype=np.float64)
+    for start in range(0, len(population), BLOCK_AREAS):
+        stop = min(start + BLOCK_AREAS, len(population))
+        draws = generator.standard_normal((stop - start, samples), dtype=np.float32)
+        schools = population[start:stop, None] / np.float32(students_per_school) * np.exp(draws * sigma + shift)
+        shortfall = np.maximum(0, np.rint(schools) - existing[start:stop, None])
+        bands[start:stop] = np.percentile(shortfall, percentiles, axis=1).T
+        total += shortfall.sum(axis=0, dtype=np.float64)
+    return ShortfallBands(percentiles, bands, np.percentile(total, percentiles))
+
+
+def write_bands(table, bands, layer_name, directory=None):
+    """Write the shortfall percentiles of every area as CSV, returning its path."""
+    return write_area_csv(table.area_ids.tolist(), dict(zip(bands.fields(), bands.areas.T)), "Real", layer_name,
+                          "bands", output_directory(SETTING_OUTPUT_DIR, "needed_schools_uncertainty", directory))
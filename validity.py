@@ -0,0 +1,167 @@
+"""Validity check and repair of the population polygons before counting.
+
+Self-intersecting or badly ordered admin polygons make ``ST_Within`` raise
+or miscount.  Every population geometry is checked in one set-based
+statement, invalid ones are repaired with ``ST_MakeValid``, and the outcome
+is stored in a side table keyed by the MD5 of the geometry's EWKB.  Later
+runs only check geometries whose hash is not in the side table yet, so an
+unchanged table costs one hash per area.
+
+When some areas are invalid, the job counts against ``<table>_valid``, a
+copy of the population table with the repaired geometries, indexed like
+the original.  The copy's comment records a fingerprint of the source rows,
+so it is only rebuilt after the population table changed.
+
+The check writes to the database and is therefore off unless enabled; a
+role that may not write gets a read-only count of the invalid areas instead.
+"""
+import psycopg2
+from psycopg2 import sql
+from qgis.core import QgsSettings
+
+from .database import metadata_cache
+from .instrumentation import log_message
+
+SETTING_CHECK = "needed_schools/check_geometries"
+REPAIRS_TABLE = "needed_schools_repairs"
+VALID_SUFFIX = "_valid"
+VALID_TABLE_COMMENT = "Needed Schools repaired copy"
+# SQLSTATEs insufficient_privilege and read_only_sql_transaction
+READ_ONLY_ERRORS = ("42501", "25006")
+
+
+def check_enabled():
+    """Whether population polygons are checked and repaired before database runs."""
+    return QgsSettings().value(SETTING_CHECK, False, type=bool)
+
+
+def geometry_hash(column):
+    """Expression hashing ``column`` with its SRID."""
+    return sql.SQL("md5(ST_AsEWKB({}))").format(column)
+
+
+def record_validity(cursor, table):
+    """Check the geometries of ``table`` missing from the repairs table; returns ``(checked, repaired)``."""
+    geometry_column, _ = metadata_cache.geometry(cursor, table)
+    cursor.execute(sql.SQL(
+        "CREATE TABLE IF NOT EXISTS {} (geom_hash text PRIMARY KEY, repaired geometry, reason text)"
+    ).format(sql.Identifier(REPAIRS_TABLE)))
+    cursor.execute(sql.SQL("""
+        INSERT INTO {repairs} (geom_hash, repaired, reason)
+        SELECT DISTINCT ON (h.geom_hash) h.geom_hash,
+               CASE WHEN ST_IsValid(p.{geom}) THEN NULL ELSE ST_CollectionExtract(ST_MakeValid(p.{geom}), 3) END,
+               CASE WHEN ST_IsValid(p.{geom}) THEN NULL ELSE ST_IsValidReason(p.{geom}) END
+        FROM {table} p
+        CROSS JOIN LATERAL (SELECT {hash} AS geom_hash) h
+        WHERE p.{geom} IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM {repairs} r WHERE r.geom_hash = h.geom_hash)
+        ON CONFLICT (geom_hash) DO NOTHING
+        RETURNING repaired IS NOT NULL
+    """).format(
+        repairs=sql.Identifier(REPAIRS_TABLE),
+        geom=sql.Identifier(geometry_column),
+        table=sql.Identifier(table),
+        hash=geometry_hash(sql.Identifier("p", geometry_column)),
+    ))
+    outcomes = [row[0] for row in cursor.fetchall()]
+    return len(outcomes), sum(outcomes)
+
+
+def invalid_count(cursor, table):
+    """Number of areas of ``table`` with a stored repair."""
+    geometry_column, _ = metadata_cache.geometry(cursor, table)
+    cursor.execute(sql.SQL(
+        "SELECT count(*) FROM {table} p JOIN {repairs} r ON r.geom_hash = {hash} WHERE r.repaired IS NOT NULL"
+    ).format(
+        table=sql.Identifier(table),
+        repairs=sql.Identifier(REPAIRS_TABLE),
+        hash=geometry_hash(sql.Identifier("p", geometry_column)),
+    ))
+    return cursor.fetchone()[0]
+
+
+def unrepaired_count(cursor, table):
+    """Number of invalid areas of ``table``, counted without writing anything."""
+    geometry_column, _ = metadata_cache.geometry(cursor, table)
+    cursor.execute(sql.SQL("SELECT count(*) FROM {} p WHERE NOT ST_IsValid(p.{})").format(
+        sql.Identifier(table), sql.Identifier(geometry_column)))
+    return cursor.fetchone()[0]
+
+
+def source_fingerprint(cursor, table):
+    """Order-independent hash of every row of ``table``."""
+    cursor.execute(sql.SQL(
+        "SELECT count(*)::text || ':' || coalesce(sum(('x' || substr(md5(p::text), 1, 15))::bit(60)::bigint), 0)::text "
+        "FROM {} p"
+    ).format(sql.Identifier(table)))
+    return cursor.fetchone()[0]
+
+
+def write_valid_table(cursor, table):
+    """Make ``<table>_valid`` a copy of ``table`` carrying the repaired geometries; returns its name.
+
+    An existing copy made from the same rows is kept as it is.  The
+    geometry column loses its geometry-type constraint, since a repair may
+    turn a polygon into a multipolygon, but keeps its SRID.
+    """
+    copy = table + VALID_SUFFIX
+    comment = f"{VALID_TABLE_COMMENT} {source_fingerprint(cursor, table)}"
+    qualified_name = f'"public"."{copy}"'
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL, obj_description(to_regclass(%s), 'pg_class')",
+                   [qualified_name, qualified_name])
+    exists, current = cursor.fetchone()
+    if exists and current == comment:
+        return copy
+    if exists and not (current or "").startswith(VALID_TABLE_COMMENT):
+        raise ValueError(f"Table {copy} exists and was not created by Needed Schools.")
+
+    geometry_column, srid = metadata_cache.geometry(cursor, table)
+    key_column = metadata_cache.primary_key(cursor, table)
+    geometry_type = sql.SQL("geometry(Geometry, {})").format(sql.Literal(srid)) if srid else sql.SQL("geometry")
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(copy)))
+    cursor.execute(sql.SQL("CREATE TABLE {} AS SELECT * FROM {}").format(
+        sql.Identifier(copy), sql.Identifier(table)))
+    cursor.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN {} TYPE {}").format(
+        sql.Identifier(copy), sql.Identifier(geometry_column), geometry_type))
+    cursor.execute(sql.SQL(
+        "UPDATE {valid} p SET {geom} = r.repaired FROM {repairs} r "
+        "WHERE r.geom_hash = {hash} AND r.repaired IS NOT NULL"
+    ).format(
+        valid=sql.Identifier(copy),
+        geom=sql.Identifier(geometry_column),
+        repairs=sql.Identifier(REPAIRS_TABLE),
+        hash=geometry_hash(sql.Identifier("p", geometry_column)),
+    ))
+    cursor.execute(sql.SQL("CREATE INDEX ON {} USING gist ({})").format(
+        sql.Identifier(copy), sql.Identifier(geometry_column)))
+    if key_column is not None:
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY ({})").format(
+            sql.Identifier(copy), sql.Identifier(key_column)))
+    cursor.execute(sql.SQL("COMMENT ON TABLE {} IS {}").format(sql.Identifier(copy), sql.Literal(comment)))
+    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(copy)))
+    # The cached table list predates the copy; jobs validated against it would miss the table
+    metadata_cache.clear()
+    return copy
+
+
+def valid_table(cursor, table):
+    """``(table to count against, invalid areas)``: ``<table>_valid`` when some areas needed a repair.
+
+    The caller commits, so the repairs are kept for later runs.  Without
+    permission to write, ``table`` is counted as it is and its invalid
+    areas are only reported.
+    """
+    cursor.execute("SAVEPOINT needed_schools_repairs")
+    try:
+        record_validity(cursor, table)
+        invalid = invalid_count(cursor, table)
+        counted = write_valid_table(cursor, table) if invalid else table
+    except psycopg2.DatabaseError as error:
+        if getattr(error, "pgcode", None) not in READ_ONLY_ERRORS:
+            raise
+        cursor.execute("ROLLBACK TO SAVEPOINT needed_schools_repairs")
+        log_message(f"Repairs of {table} cannot be stored ({str(error).strip()}); "
+                    f"its {unrepaired_count(cursor, table)} invalid area(s) are counted unrepaired.")
+        return table, 0
+    cursor.execute("RELEASE SAVEPOINT needed_schools_repairs")
+    return counted, invalid
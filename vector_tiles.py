@@ -0,0 +1,434 @@
+"""Mapbox Vector Tiles of the result polygons in an MBTiles file.
+
+The result polygons are projected to Web Mercator once and cut into a zoom
+pyramid.  Per zoom, every polygon is snapped to a grid a few tile units
+wide, which both quantizes and simplifies it: consecutive points falling
+into the same grid cell and points on a straight line are dropped, so an
+admin boundary at a low zoom keeps only the vertices that show.  Rings are
+then clipped to their tiles, with a small buffer against seams, and encoded
+as MVT 2.1 polygons with the area attributes.
+
+Tiles are encoded in worker processes, a block of neighbouring tiles per
+task so each polygon is shipped to few workers, and written gzipped into
+one SQLite transaction.  This module imports nothing from QGIS so the
+workers start quickly.
+"""
+import gzip
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SETTING_MIN_ZOOM = "needed_schools/tiles_min_zoom"
+SETTING_MAX_ZOOM = "needed_schools/tiles_max_zoom"
+SETTING_WORKERS = "needed_schools/tiles_workers"
+DEFAULT_MIN_ZOOM = 4
+DEFAULT_MAX_ZOOM = 12
+LAYER_NAME = "needed_schools"
+EXTENT = 4096
+# Tile units around every tile that polygons are kept in, hiding seams between tiles
+BUFFER = 64
+# Grid step in tile units that polygons are snapped to at every zoom
+SNAP_UNITS = 4
+# Neighbouring tiles encoded by one worker task
+TILES_PER_TASK = 128
+MAX_LATITUDE = 85.0511287798
+
+_POLYGON, _MULTIPOLYGON = 3, 6
+_MOVE_TO, _LINE_TO, _CLOSE_PATH = 1, 2, 7
+
+
+def tile_settings():
+    """``(min zoom, max zoom, worker processes or None for one per CPU)``."""
+    from qgis.core import QgsSettings
+
+    settings = QgsSettings()
+    return (settings.value(SETTING_MIN_ZOOM, DEFAULT_MIN_ZOOM, type=int),
+            settings.value(SETTING_MAX_ZOOM, DEFAULT_MAX_ZOOM, type=int),
+            settings.value(SETTING_WORKERS, 0, type=int) or None)
+
+
+def wkb_polygons(wkb):
+    """Polygons of a (multi)polygon in WKB, each a list of ``(n, 2)`` rings, exterior first."""
+    polygons = []
+
+    def read(offset):
+        byte_order = "<" if wkb[offset] == 1 else ">"
+        (geometry_type,) = struct.unpack_from(byte_order + "I", wkb, offset + 1)
+        # ISO WKB adds 1000 for Z, 2000 for M and 3000 for ZM coordinates
+        dimensions = (2, 3, 3, 4)[geometry_type // 1000]
+        base_type = geometry_type % 1000
+        offset += 5
+        (count,) = struct.unpack_from(byte_order + "I", wkb, offset)
+        offset += 4
+        if base_type == _MULTIPOLYGON:
+            for _ in range(count):
+                offset = read(offset)
+        elif base_type == _POLYGON:
+            rings = []
+            for _ in range(count):
+                (points,) = struct.unpack_from(byte_order + "I", wkb, offset)
+                offset += 4
+                coordinates = np.frombuffer(wkb, np.dtype(np.float64).newbyteorder(byte_order),
+                                            points * dimensions, offset)
+                rings.append(coordinates.reshape(points, dimensions)[:, :2].astype(np.float64))
+                offset += points * dimensions * 8
+            polygons.append(rings)
+        else:
+            raise ValueError(f"Vector tiles need polygon areas, not WKB type {geometry_type}")
+        return offset
+
+    if wkb:
+        read(0)
+    return polygons
+
+
+def to_mercator(ring):
+    """EPSG:4326 ring in Web Mercator scaled to the unit square, y growing southwards."""
+    x = (ring[:, 0] + 180.0) / 360.0
+    latitude = np.radians(np.clip(ring[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+    y = 0.5 - np.log(np.tan(np.pi / 4 + latitude / 2)) / (2 * np.pi)
+    return np.column_stack([x, y])
+
+
+# Protocol buffer encoding of the vector tile schema
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _key(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number, payload):
+    return _key(number, 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number, value):
+    return _key(number, 0) + _varint(value)
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, _packed_varints(values))
+
+
+def _packed_varints(values):
+    """Varints of a sequence of non-negative integers, encoded together with NumPy."""
+    if len(values) < 64:
+        return b"".join(_varint(int(value)) for value in values)
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for group in range(1, 10):
+        longer = values >= np.uint64(1 << (7 * group))
+        if not longer.any():
+            break
+        lengths += longer
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for group in range(int(lengths.max())):
+        present = lengths > group
+        byte = (values[present] >> np.uint64(7 * group)) & np.uint64(0x7F)
+        out[starts[present] + group] = byte | np.where(lengths[present] > group + 1, 0x80, 0).astype(np.uint64)
+    return out.tobytes()
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def encode_value(value):
+    """A ``Value`` message holding a string, double, signed integer or boolean."""
+    if isinstance(value, (bool, np.bool_)):
+        return _varint_field(7, int(value))
+    if isinstance(value, (int, np.integer)):
+        return _varint_field(6, _zigzag(int(value)) & 0xFFFFFFFFFFFFFFFF)
+    if isinstance(value, (float, np.floating)):
+        return _key(3, 1) + struct.pack("<d", float(value))
+    return _bytes_field(1, str(value).encode("utf-8"))
+
+
+def _previous(ring):
+    return np.concatenate([ring[-1:], ring[:-1]])
+
+
+def _next(ring):
+    return np.concatenate([ring[1:], ring[:1]])
+
+
+def ring_area(ring):
+    """Signed area by the surveyor's formula; positive for MVT exterior rings."""
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.dot(x, _next(y)) - np.dot(_next(x), y)) / 2
+
+
+def encode_geometry(rings):
+    """Command integers of polygon ``rings``: integer ``(n, 2)`` arrays, unclosed and correctly wound."""
+    parts = []
+    cursor = np.zeros((1, 2), dtype=np.int64)
+    for ring in rings:
+        deltas = np.diff(np.vstack([cursor, ring]), axis=0)
+        cursor = ring[-1:]
+        zigzag = (deltas << 1) ^ (deltas >> 63)
+        parts += [[(_MOVE_TO & 0x7) | (1 << 3)], zigzag[0], [(_LINE_TO & 0x7) | ((len(ring) - 1) << 3)],
+                  zigzag[1:].ravel(), [(_CLOSE_PATH & 0x7) | (1 << 3)]]
+    return np.concatenate(parts).astype(np.int64) if parts else np.zeros(0, dtype=np.int64)
+
+
+def encode_tile(features, names):
+    """One-layer tile of ``features``, ``(id, rings, attributes)`` tuples."""
+    keys = {}
+    values = {}
+    encoded = []
+    for feature_id, rings, attributes in features:
+        tags = []
+        for name, value in zip(names, attributes):
+            if value is None:
+                continue
+            key_index = keys.setdefault(name, len(keys))
+            value_index = values.setdefault((type(value).__name__, value), len(values))
+            tags += [key_index, value_index]
+        encoded.append(_bytes_field(2, _varint_field(1, feature_id) + _packed_field(2, tags)
+                                    + _varint_field(3, 3) + _packed_field(4, encode_geometry(rings))))
+    layer = (_varint_field(15, 2) + _bytes_field(1, LAYER_NAME.encode("utf-8")) + b"".join(encoded)
+             + b"".join(_bytes_field(3, name.encode("utf-8")) for name in keys)
+             + b"".join(_bytes_field(4, encode_value(value)) for _, value in values)
+             + _varint_field(5, EXTENT))
+    return _bytes_field(3, layer)
+
+
+# Snapping and clipping
+
+def snap_ring(ring, scale):
+    """Unit-square ring as integer coordinates at ``scale``, snapped to ``SNAP_UNITS``; None when collapsed."""
+    snapped = (np.rint(ring * (scale / SNAP_UNITS)) * SNAP_UNITS).astype(np.int64)
+    return _clean(snapped)
+
+
+def _clean(ring):
+    """Ring without its closing point, repeated points and straight-line points; None below a triangle."""
+    if len(ring) and np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]
+    for _ in range(2):
+        if len(ring) < 3:
+            return None
+        ring = ring[np.any(ring != _previous(ring), axis=1)]
+        if len(ring) < 3:
+            return None
+        before, after = _previous(ring), _next(ring)
+        turn = ((ring[:, 0] - before[:, 0]) * (after[:, 1] - ring[:, 1])
+                - (ring[:, 1] - before[:, 1]) * (after[:, 0] - ring[:, 0]))
+        ring = ring[turn != 0]
+    return ring if len(ring) >= 3 else None
+
+
+def _clip_edge(ring, axis, bound, keep_above):
+    """One Sutherland-Hodgman step: the part of ``ring`` on one side of ``coordinate[axis] = bound``."""
+    inside = ring[:, axis] >= bound if keep_above else ring[:, axis] <= bound
+    if inside.all():
+        return ring
+    if not inside.any():
+        return ring[:0]
+    previous = _previous(ring)
+    previous_inside = _previous(inside)
+    crossing = inside != previous_inside
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (bound - previous[:, axis]) / (ring[:, axis] - previous[:, axis])
+        intersection = previous + (ring - previous) * t[:, None]
+    # Per point: the crossing into or out of the kept side, then the point itself when kept
+    candidates = np.stack([intersection, ring], axis=1)
+    keep = np.stack([crossing, inside], axis=1)
+    return candidates[keep]
+
+
+def clip_ring(ring, low, high):
+    """``ring`` clipped to the square ``[low, high]``, as float coordinates."""
+    ring = ring.astype(np.float64)
+    for axis in (0, 1):
+        ring = _clip_edge(ring, axis, low, True)
+        ring = _clip_edge(ring, axis, high, False)
+        if not len(ring):
+            break
+    return ring
+
+
+def tile_rings(polygons, origin_x, origin_y):
+    """Rings of snapped ``polygons`` clipped to the tile at ``origin`` in tile coordinates, wound for MVT."""
+    rings = []
+    for polygon in polygons:
+        for index, ring in enumerate(polygon):
+            clipped = clip_ring(ring - (origin_x, origin_y), -BUFFER, EXTENT + BUFFER)
+            if len(clipped) < 3:
+                if index == 0:
+                    break
+                continue
+            clipped = _clean(np.rint(clipped).astype(np.int64))
+            if clipped is None:
+                if index == 0:
+                    break
+                continue
+            exterior = index == 0
+            if (ring_area(clipped) > 0) != exterior:
+                clipped = clipped[::-1]
+            rings.append(clipped)
+    return rings
+
+
+def encode_tiles(zoom, tiles, features, names):
+    """Gzipped tiles ``[(zoom, x, y, data)]`` of ``tiles``, each ``(x, y, feature indices)``.
+
+    ``features`` maps a feature index to ``(id, unit-square polygons,
+    attributes)``.  Runs in the worker processes.
+    """
+    scale = EXTENT * 2 ** zoom
+    snapped = {}
+    encoded = []
+    for x, y, indices in tiles:
+        content = []
+        for index in indices:
+            if index not in snapped:
+                feature_id, polygons, _ = features[index]
+                snapped[index] = [[ring for ring in (snap_ring(ring, scale) for ring in polygon) if ring is not None]
+                                  for polygon in polygons]
+                snapped[index] = [polygon for polygon in snapped[index] if polygon]
+            rings = tile_rings(snapped[index], x * EXTENT, y * EXTENT)
+            if rings:
+                content.append((features[index][0], rings, features[index][2]))
+        if content:
+            encoded.append((zoom, x, y, gzip.compress(encode_tile(content, names), 6, mtime=0)))
+    return encoded
+
+
+# Planning and writing
+
+def prepare_features(rows):
+    """``[(id, unit-square polygons, attributes)]`` and their bounds from ``(attributes, wkb)`` rows."""
+    features = []
+    bounds = []
+    for feature_id, (attributes, wkb) in enumerate(rows, 1):
+        polygons = [[to_mercator(ring) for ring in polygon] for polygon in wkb_polygons(wkb)]
+        if not polygons:
+            continue
+        exteriors = np.vstack([polygon[0] for polygon in polygons])
+        features.append((feature_id, polygons, [_plain(value) for value in attributes]))
+        bounds.append((*exteriors.min(axis=0), *exteriors.max(axis=0)))
+    return features, np.array(bounds, dtype=np.float64).reshape(len(bounds), 4)
+
+
+def _plain(value):
+    # Database numerics arrive as Decimal
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    return float(value) if hasattr(value, "as_integer_ratio") else str(value)
+
+
+def plan_tasks(bounds, zoom):
+    """``[[(x, y, feature indices)]]`` blocks of neighbouring tiles of ``zoom`` holding any feature."""
+    tiles_across = 2 ** zoom
+    margin = BUFFER / EXTENT
+    low = np.clip(np.floor(bounds[:, :2] * tiles_across - margin), 0, tiles_across - 1).astype(np.int64)
+    high = np.clip(np.floor(bounds[:, 2:] * tiles_across + margin), 0, tiles_across - 1).astype(np.int64)
+    tiles = {}
+    for index, ((x0, y0), (x1, y1)) in enumerate(zip(low.tolist(), high.tolist())):
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                tiles.setdefault((x, y), []).append(index)
+    ordered = [(x, y, tiles[(x, y)]) for x, y in sorted(tiles)]
+    return [ordered[start:start + TILES_PER_TASK] for start in range(0, len(ordered), TILES_PER_TASK)]
+
+
+def _task_features(features, block):
+    return {index: features[index] for _, _, indices in block for index in indices}
+
+
+def _process_context():
+    """Spawn context whose workers run a Python interpreter, also when QGIS is the running executable."""
+    context = multiprocessing.get_context("spawn")
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        for name in ("pythonw.exe", "python.exe", os.path.join("bin", "python3")):
+            candidate = os.path.join(sys.exec_prefix, name)
+            if os.path.exists(candidate):
+                context.set_executable(candidate)
+                break
+    return context
+
+
+def create_mbtiles(path, names, min_zoom, max_zoom, bounds):
+    """New MBTiles file at ``path`` with its metadata; returns the open connection."""
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE metadata (name text, value text)")
+    connection.execute("CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)")
+    connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    west, south, east, north = bounds
+    layer = {"id": LAYER_NAME, "minzoom": min_zoom, "maxzoom": max_zoom, "fields": {name: "" for name in names}}
+    connection.executemany("INSERT INTO metadata VALUES (?, ?)", [
+        ("name", LAYER_NAME), ("format", "pbf"), ("type", "overlay"), ("version", "1"),
+        ("minzoom", str(min_zoom)), ("maxzoom", str(max_zoom)),
+        ("bounds", f"{west},{south},{east},{north}"),
+        ("center", f"{(west + east) / 2},{(south + north) / 2},{min_zoom}"),
+        ("json", json.dumps({"vector_layers": [layer]})),
+    ])
+    return connection
+
+
+def write_mbtiles(path, names, rows, min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM, workers=None):
+    """Write ``(attributes, wkb)`` rows with attribute ``names`` as vector tiles; returns the tile count.
+
+    ``workers`` processes encode the tiles, by default one per CPU; with 1
+    everything runs in this process.
+    """
+    features, bounds = prepare_features(rows)
+    if len(bounds):
+        west, north = bounds[:, 0].min() * 360 - 180, _latitude(bounds[:, 1].min())
+        east, south = bounds[:, 2].max() * 360 - 180, _latitude(bounds[:, 3].max())
+    else:
+        west = south = east = north = 0.0
+    connection = create_mbtiles(path, names, min_zoom, max_zoom, (west, south, east, north))
+    blocks = [(zoom, block) for zoom in range(min_zoom, max_zoom + 1) for block in plan_tasks(bounds, zoom)]
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    try:
+        if workers == 1 or len(blocks) < 2:
+            results = (encode_tiles(zoom, block, features, names) for zoom, block in blocks)
+            count = _insert(connection, results)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(blocks)), mp_context=_process_context()) as pool:
+                futures = [pool.submit(encode_tiles, zoom, block, _task_features(features, block), names)
+                           for zoom, block in blocks]
+                count = _insert(connection, (future.result() for future in futures))
+        connection.commit()
+    finally:
+        connection.close()
+    return count
+
+
+def _latitude(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+def _insert(connection, results):
+    count = 0
+    for tiles in results:
+        # MBTiles rows count from the south (TMS), XYZ tiles from the north
+        connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                               [(zoom, x, 2 ** zoom - 1 - y, data) for zoom, x, y, data in tiles])
+        count += len(tiles)
+    return count